@@ -1,11 +1,62 @@
 import os
 
+BINARIES_FOLDER = os.path.expanduser('~/.nearup/near')
+BINARY_CACHE_FOLDER = os.path.expanduser('~/.nearup/cache')
+BINARY_CACHE_MAX_BYTES = int(
+    os.environ.get('NEARUP_BINARY_CACHE_MAX_BYTES', 4 * 1024**3))
+INSTANCES_FOLDER = os.path.expanduser('~/.nearup/instances')
 LOCALNET_FOLDER = os.path.expanduser("~/.nearup/near/localnet")
+LOCALNET_HOME = os.path.expanduser('~/.near/localnet')
+LOCALNET_MANIFEST = 'nearup_localnet.json'
+LOCALNET_STATUS = 'nearup_localnet_status.json'
 LOGS_FOLDER = os.path.expanduser('~/.nearup/logs')
 LOCALNET_LOGS_FOLDER = os.path.expanduser("~/.nearup/logs/localnet")
 NODE_PID_FILE = os.path.expanduser('~/.nearup/node.pid')
 WATCHER_PID_FILE = os.path.expanduser('~/.nearup/watcher.pid')
+FLEET_REGISTRY = os.path.expanduser('~/.nearup/fleet.json')
+FLEET_PID_FILE = os.path.expanduser('~/.nearup/fleet.pid')
+# first ports tried for the nodes of a fleet, neard's defaults
+FLEET_RPC_PORT = 3030
+FLEET_NETWORK_PORT = 24567
 DEFAULT_WAIT_TIMEOUT = 30
+LOCALNET_READY_TIMEOUT = 120
+LOCALNET_RPC_PORT = 3030
+LOCALNET_NETWORK_PORT = 24567
+PORTS_REGISTRY = os.path.expanduser('~/.nearup/ports.json')
+SNAPSHOTS_FOLDER = os.path.expanduser('~/.nearup/snapshots')
+SNAPSHOT_COPY_WORKERS = 16
+# Ports reserved by a localnet which has not written its PID file are kept
+# for this long, so concurrent allocations don't hand out the same range.
+PORTS_RESERVATION_TIMEOUT = 10 * 60
+NEARD_EXIT_GRACE_PERIOD = 1
+
+# neard log rotation. Compression is gzip, zstd or none.
+LOG_MAX_BYTES = int(os.environ.get('NEARUP_LOG_MAX_BYTES', 256 * 1024**2))
+LOG_MAX_AGE = float(os.environ.get('NEARUP_LOG_MAX_AGE', 24 * 60 * 60))
+LOG_RETENTION_BYTES = int(
+    os.environ.get('NEARUP_LOG_RETENTION_BYTES', 2 * 1024**3))
+LOG_COMPRESSION = os.environ.get('NEARUP_LOG_COMPRESSION', 'gzip')
+TRASH_WORKERS = 8
+
+# Watcher poll schedule, in seconds. The jitter is a fraction of the interval.
+WATCHER_POLL_INTERVAL = float(os.environ.get('NEARUP_WATCHER_INTERVAL', 60))
+WATCHER_POLL_JITTER = float(os.environ.get('NEARUP_WATCHER_JITTER', 0.2))
+WATCHER_MAX_BACKOFF = 15 * 60
+WATCHER_FAST_POLL_INTERVAL = 10
+WATCHER_FAST_POLL_WINDOW = 10 * 60
+# neard dying again this soon after the watcher restarted it is restarted
+# with backoff
+WATCHER_CRASH_LOOP_PERIOD = 5 * 60
+
+# `nearup supervise` restarts a crashed neard after a delay doubling with
+# every crash, reset once it has run for the stable period. It stops neard
+# before `nearup stop` gives up waiting on it.
+SUPERVISOR_RESTART_BACKOFF = 1
+SUPERVISOR_MAX_RESTART_BACKOFF = 5 * 60
+SUPERVISOR_STABLE_PERIOD = 10 * 60
+SUPERVISOR_STOP_TIMEOUT = 20
+# How often an orchestrated localnet probes its nodes and writes its status.
+ORCHESTRATOR_STATUS_INTERVAL = 5
 
 S3_BUCKETS = {
     'default': 'build.nearprotocol.com',
@@ -15,3 +66,12 @@ S3_BUCKETS = {
     'guildnet': 'build.openshards.io',
     'shardnet': 'build.nearprotocol.com',
 }
+
+# Override the S3 endpoint, e.g. to point nearup at a local S3 stand-in.
+S3_ENDPOINT_URL = os.environ.get('NEARUP_S3_ENDPOINT_URL') or None
+S3_MAX_POOL_CONNECTIONS = 16
+S3_CONNECT_TIMEOUT = 10
+S3_READ_TIMEOUT = 60
+
+DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CONCURRENCY = 8
@@ -0,0 +1,469 @@
+"""Fleet mode: several nodes of public networks on one host.
+
+Nodes are registered by home dir in ~/.nearup/fleet.json with ports of
+their own, and get a PID file and logs folder per home (see
+instance.node_instance). One poller, `python3 -m nearuplib.fleet`, takes the
+place of their watchers: every check fetches the release metadata of each
+network once and restarts all the nodes a new release affects, and nodes
+which crash are restarted as soon as they exit. Nodes are always restarted
+with the options they were registered with.
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+import typing
+
+from nearuplib.constants import (BINARIES_FOLDER, FLEET_NETWORK_PORT,
+                                 FLEET_PID_FILE, FLEET_REGISTRY, FLEET_RPC_PORT,
+                                 LOGS_FOLDER, NEARD_EXIT_GRACE_PERIOD,
+                                 WATCHER_MAX_BACKOFF, WATCHER_POLL_INTERVAL,
+                                 WATCHER_POLL_JITTER)
+from nearuplib.exceptions import NetworkError
+from nearuplib.instance import instance_name, node_instance
+from nearuplib.nodeconfig import patch_node_configs
+from nearuplib.nodelib import (NeardMonitor, is_neard_running, run, setup_node,
+                               stage_release, stop_native)
+from nearuplib.ports import find_free_range, locked_registry, read_registry
+from nearuplib.scheduler import PollScheduler
+from nearuplib.util import (fetch_release_metadata, new_release_ready,
+                            read_genesis_md5sum)
+from nearuplib.watcher import is_watcher_running
+
+
+class FleetNode(typing.NamedTuple):
+    """A node of the fleet, as registered by `nearup fleet add`."""
+    home: str
+    network: str
+    rpc_port: int
+    network_port: int
+    account_id: typing.Optional[str] = None
+    boot_nodes: str = ''
+    verbose: bool = False
+    binary_path: str = ''
+
+    @property
+    def instance(self):
+        return node_instance(self.home)
+
+    @property
+    def official_binary(self):
+        return self.binary_path == ''
+
+
+def load_fleet(registry_path=FLEET_REGISTRY):
+    """The registered nodes, ordered by home."""
+    nodes = [
+        FleetNode(**entry) for entry in read_registry(registry_path).values()
+    ]
+    return sorted(nodes, key=lambda node: node.home)
+
+
+def add_node(home,
+             network,
+             account_id=None,
+             boot_nodes='',
+             verbose=False,
+             binary_path='',
+             rpc_port=None,
+             network_port=None,
+             registry_path=FLEET_REGISTRY):
+    """Register a node, giving it the first ports no other node uses."""
+    home = os.path.abspath(home)
+    name = instance_name(home)
+    with locked_registry(registry_path) as registry:
+        if name in registry:
+            raise ValueError(f'{home} is already in the fleet')
+        reserved = {
+            port for entry in registry.values()
+            for port in (entry['rpc_port'], entry['network_port'])
+        }
+        if rpc_port is None:
+            [rpc_port] = find_free_range(1, FLEET_RPC_PORT, reserved)
+        reserved.add(rpc_port)
+        if network_port is None:
+            [network_port] = find_free_range(1, FLEET_NETWORK_PORT, reserved)
+
+        node = FleetNode(home, network, rpc_port, network_port, account_id,
+                         boot_nodes, verbose, binary_path)
+        registry[name] = node._asdict()
+    return node
+
+
+def remove_node(home, registry_path=FLEET_REGISTRY):
+    """Unregister the node of home. Returns False if it was not registered."""
+    with locked_registry(registry_path) as registry:
+        return registry.pop(instance_name(home), None) is not None
+
+
+def select_nodes(homes, registry_path=FLEET_REGISTRY):
+    """The registered nodes of homes, or all of them if homes is empty."""
+    nodes = load_fleet(registry_path)
+    if not homes:
+        return nodes
+    by_home = {node.home: node for node in nodes}
+    selected = []
+    for home in homes:
+        home = os.path.abspath(home)
+        if home not in by_home:
+            logging.error(f'{home} is not in the fleet, add it with '
+                          '`nearup fleet add`')
+            sys.exit(1)
+        selected.append(by_home[home])
+    return selected
+
+
+def _patch_ports(node):
+    patch_node_configs([node.home], lambda _: [
+        (['rpc', 'addr'], f'0.0.0.0:{node.rpc_port}'),
+        (['network', 'addr'], f'0.0.0.0:{node.network_port}'),
+    ])
+
+
+def _run(node, binary_path):
+    _patch_ports(node)
+    run(node.home,
+        binary_path,
+        node.boot_nodes,
+        '',
+        node.verbose,
+        node.network,
+        instance=node.instance)
+
+
+def start_node(node, metadata=None):
+    if is_neard_running(node.instance.pid_file):
+        return False
+    logging.info(f'Starting the {node.network} node in {node.home}')
+    binary_path = setup_node(node.binary_path,
+                             node.home,
+                             node.network,
+                             node.account_id,
+                             metadata=metadata)
+    _run(node, binary_path)
+    return True
+
+
+def stop_node(node):
+    logging.info(f'Stopping the {node.network} node in {node.home}')
+    stop_native(pid_file=node.instance.pid_file)
+
+
+def _stop_for_restart(node):
+    stop_node(node)
+    if is_neard_running(node.instance.pid_file):
+        # stop_native keeps the PID file of processes which survived, and a
+        # second neard must not be started on their home
+        raise RuntimeError(f'Unable to stop the node in {node.home}')
+
+
+def restart_node(node):
+    """Restart node on the binary it has already."""
+    _stop_for_restart(node)
+    if node.official_binary:
+        _run(node, os.path.join(BINARIES_FOLDER, node.network))
+    else:
+        _run(node, node.binary_path)
+
+
+def upgrade_node(node, metadata):
+    """Restart an official node on the release of metadata.
+
+    The release is staged while the node keeps running, so it is only down
+    for the time it takes to stop and start it.
+    """
+    if not os.path.exists(node.home):
+        _stop_for_restart(node)
+        start_node(node, metadata)
+        return
+
+    binary_path, staged = stage_release(node.network, node.home,
+                                        os.uname()[0], metadata)
+    try:
+        _stop_for_restart(node)
+        if staged is not None:
+            logging.info(f'Updating the genesis config of {node.home}')
+            staged.apply(node.home)
+        _run(node, binary_path)
+    finally:
+        if staged is not None:
+            staged.cleanup()
+
+
+class FleetPoller:
+    """Watches every node of the fleet from one process."""
+
+    def __init__(self,
+                 load=load_fleet,
+                 scheduler=None,
+                 fetch=fetch_release_metadata):
+        self.load = load
+        self.scheduler = scheduler or PollScheduler()
+        self.fetch = fetch
+        self.nodes = []
+        # nodes which could not be restarted in the last check
+        self.failed = []
+        # when the nodes whose restart failed are tried again, each backing
+        # off on its own so the release checks don't reset it
+        self._retry_at = {}
+        self._backoffs = {}
+        self._check_at = None
+        self._monitors = {}
+        # commit and genesis md5sums each running official node has
+        self._commits = {}
+        self._genesis = {}
+        self._metadata = {}
+
+    def refresh(self):
+        """Pick up the nodes added to or removed from the fleet."""
+        self.nodes = self.load()
+        homes = {node.home for node in self.nodes}
+        for home in list(self._monitors):
+            if home not in homes:
+                self._monitors.pop(home).close()
+                self._retried(home)
+        for node in self.nodes:
+            if node.home not in self._monitors:
+                self._monitors[node.home] = NeardMonitor(node.instance.pid_file)
+            if not os.path.exists(node.instance.pid_file):
+                # a stopped node gets the latest release when it is started
+                self._commits.pop(node.home, None)
+                self._genesis.pop(node.home, None)
+            elif node.official_binary and node.home not in self._genesis:
+                # the genesis the node was set up with, it may be outdated
+                self._genesis[node.home] = read_genesis_md5sum(node.home)
+
+    def networks(self):
+        return sorted(
+            {node.network for node in self.nodes if node.official_binary})
+
+    def _retried(self, home):
+        self._retry_at.pop(home, None)
+        self._backoffs.pop(home, None)
+
+    def _outdated(self, node, metadata):
+        return (metadata.commit != self._commits.get(node.home) or
+                metadata.genesis_md5sums != self._genesis.get(node.home))
+
+    def _record(self, node, metadata):
+        self._commits[node.home] = metadata.commit
+        self._genesis[node.home] = metadata.genesis_md5sums
+
+    def _try(self, action, node, *args):
+        """Apply action to node. Returns False if that failed."""
+        try:
+            action(node, *args)
+            return True
+        except (Exception, SystemExit) as ex:
+            # setting up and running a node exit on some errors, which must
+            # neither end the poller nor keep it from the other nodes
+            logging.error(f'Unable to restart the {node.network} node in '
+                          f'{node.home}: {ex!r}')
+            self.failed.append(node)
+            return False
+
+    def check_releases(self):
+        """Fetch the metadata of each network once, and restart the nodes a
+        new release affects. Returns the restarted nodes."""
+        restarted = []
+        for network in self.networks():
+            metadata = self.fetch(network)
+            self._metadata[network] = metadata
+            running = [
+                node for node in self.nodes
+                if node.network == network and node.home in self._genesis
+            ]
+            for node in running:
+                # a node found running runs the current release
+                self._commits.setdefault(node.home, metadata.commit)
+            # nodes waiting for a retry are upgraded by check_crashes
+            affected = [
+                node for node in running if self._outdated(node, metadata) and
+                node.home not in self._retry_at
+            ]
+            if not affected:
+                continue
+
+            logging.info(f'New {network} release {metadata.commit} affects '
+                         f'{len(affected)} nodes')
+            if not new_release_ready(network, os.uname()[0], metadata):
+                logging.info('The binary of the release is not uploaded yet')
+                self.scheduler.release_announced(
+                    (network, metadata.commit, metadata.genesis_md5sums))
+                continue
+            # one at a time, so the fleet keeps serving while it upgrades
+            for node in affected:
+                if self._try(upgrade_node, node, metadata):
+                    self._record(node, metadata)
+                    restarted.append(node)
+        return restarted
+
+    def _crash_metadata(self, node):
+        """The new release a crashed official node is restarted on, or None
+        to restart it on the binary it has."""
+        try:
+            metadata = self._metadata.get(node.network) or self.fetch(
+                node.network)
+        except NetworkError as ex:
+            logging.warning(f'caught networking error {ex}, restarting the '
+                            'node on its release')
+            return None
+        self._commits.setdefault(node.home, metadata.commit)
+        if node.home not in self._genesis:
+            self._genesis[node.home] = read_genesis_md5sum(node.home)
+        if self._outdated(node, metadata) and new_release_ready(
+                node.network,
+                os.uname()[0], metadata):
+            return metadata
+        return None
+
+    def check_crashes(self):
+        """Restart the nodes which died, and retry those whose restart failed
+        once it is time to. Returns the restarted nodes."""
+        restarted = []
+        now = time.monotonic()
+        for node in self.nodes:
+            monitor = self._monitors[node.home]
+            retry_at = self._retry_at.get(node.home)
+            if retry_at is None:
+                if not monitor.is_zombie():
+                    continue
+                logging.warning(f'The {node.network} node in {node.home} has '
+                                'died, restarting it')
+            elif retry_at > now:
+                continue
+            else:
+                logging.info(f'Trying again to restart the {node.network} '
+                             f'node in {node.home}')
+
+            metadata = None
+            if node.official_binary:
+                try:
+                    metadata = self._crash_metadata(node)
+                except Exception as ex:
+                    logging.warning(f'Unable to check the release of '
+                                    f'{node.home}: {ex!r}')
+            if metadata is None and monitor.refresh(
+            ) and not monitor.is_zombie():
+                # only its upgrade failed, and there is none to do any more
+                self._retried(node.home)
+                continue
+            if metadata is None:
+                if not self._try(restart_node, node):
+                    continue
+            elif self._try(upgrade_node, node, metadata):
+                # it may have been restarted on a newer release
+                self._record(node, metadata)
+            else:
+                continue
+            self._retried(node.home)
+            restarted.append(node)
+        return restarted
+
+    def _check(self, check):
+        self.failed = []
+        try:
+            check()
+        except NetworkError as ex:
+            self.scheduler.record_error()
+            logging.warning(f'caught networking error {ex} - will try again')
+            return
+        except Exception as ex:
+            self.scheduler.record_error()
+            logging.error(f'Unable to check the fleet: {ex!r}')
+            return
+
+        if not self.failed:
+            self.scheduler.record_success()
+            return
+        # the failed nodes are left out of the crash checks until they are
+        # tried again, so they don't keep the poller busy
+        self.scheduler.record_error()
+        now = time.monotonic()
+        for node in self.failed:
+            backoff = self._backoffs.setdefault(
+                node.home,
+                PollScheduler(interval=self.scheduler.interval,
+                              jitter=self.scheduler.jitter,
+                              max_backoff=self.scheduler.max_backoff))
+            backoff.record_error()
+            self._retry_at[node.home] = now + backoff.next_delay()
+
+    def poll_once(self):
+        try:
+            self.refresh()
+            now = time.monotonic()
+            if self._check_at is None:
+                self._check_at = now + self.scheduler.next_delay()
+            monitors = [
+                monitor for home, monitor in self._monitors.items()
+                if home not in self._retry_at
+            ]
+            timeout = min([self._check_at] + list(self._retry_at.values()))
+            exited = NeardMonitor.wait_for_any_exit(monitors,
+                                                    max(0, timeout - now))
+        except Exception as ex:
+            logging.error(f'Unable to load the fleet: {ex!r}')
+            self.scheduler.record_error()
+            self.scheduler.wait()
+            return
+
+        if exited:
+            # give `nearup fleet stop` a moment to remove the PID file, so
+            # an intentional stop is not mistaken for a crash
+            time.sleep(NEARD_EXIT_GRACE_PERIOD)
+        now = time.monotonic()
+        if exited or any(at <= now for at in self._retry_at.values()):
+            self._check(self.check_crashes)
+        # releases are checked on their own schedule, whatever crashes
+        if time.monotonic() >= self._check_at:
+            self._check(self.check_releases)
+            self._check_at = time.monotonic() + self.scheduler.next_delay()
+
+    def run(self):
+        self.refresh()
+        logging.info(f'Watching {len(self.nodes)} nodes of '
+                     f'{", ".join(self.networks()) or "no network"}')
+        while True:
+            self.poll_once()
+
+
+def start_poller(pid_file=FLEET_PID_FILE):
+    """Start the poller in the background, unless it is running already."""
+    if is_watcher_running(pid_file):
+        return None
+    os.makedirs(LOGS_FOLDER, exist_ok=True)
+    with open(os.path.join(LOGS_FOLDER, 'fleet.log'), 'a') as log_fd:
+        proc = subprocess.Popen([sys.executable, '-m', 'nearuplib.fleet'],
+                                stdin=subprocess.DEVNULL,
+                                stdout=log_fd,
+                                stderr=log_fd,
+                                start_new_session=True)
+    with open(pid_file, 'w') as pid_fd:
+        pid_fd.write(str(proc.pid))
+    logging.info(f'Started the fleet poller with pid {proc.pid}')
+    return proc
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--interval', type=float, default=WATCHER_POLL_INTERVAL)
+    parser.add_argument('--jitter', type=float, default=WATCHER_POLL_JITTER)
+    parser.add_argument('--max-backoff',
+                        type=float,
+                        default=WATCHER_MAX_BACKOFF)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s.%(msecs)03d %(levelname)s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S')
+    FleetPoller(scheduler=PollScheduler(interval=args.interval,
+                                        jitter=args.jitter,
+                                        max_backoff=args.max_backoff)).run()
+
+
+if __name__ == '__main__':
+    main()
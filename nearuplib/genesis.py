@@ -0,0 +1,265 @@
+import hashlib
+import itertools
+import json
+import os
+import typing
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+
+class JsonStream:
+    """Incremental reader for a JSON document too large to load at once.
+
+    Containers are walked one element at a time with iter_object and
+    iter_array, and each element is decoded with the standard json decoder,
+    so only the element being decoded is held in memory.
+    """
+
+    def __init__(self, fd, chunk_size=READ_CHUNK_SIZE):
+        self._fd = fd
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Read more input. Returns False once the input is exhausted."""
+        if self._eof:
+            return False
+
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+        # Grow the read size with the buffer so a single huge value is
+        # decoded in linear rather than quadratic time.
+        chunk = self._fd.read(max(self._chunk_size, len(self._buf)))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf += chunk
+        return True
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buf):
+                char = self._buf[self._pos]
+                if char not in _WHITESPACE:
+                    return char
+                self._pos += 1
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f'expected {char!r} in JSON stream, got {found!r}')
+        self._pos += 1
+
+    def decode_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+
+            # A number at the end of the buffer may continue in the next
+            # chunk, so only trust it once more input has been seen.
+            if end == len(self._buf) and self._fill():
+                continue
+
+            self._pos = end
+            return value
+
+    def _iter_container(self, opening, closing):
+        self._expect(opening)
+        if self._peek() == closing:
+            self._pos += 1
+            return
+
+        while True:
+            yield
+            separator = self._peek()
+            self._pos += 1
+            if separator == closing:
+                return
+            if separator != ',':
+                raise ValueError(
+                    f'expected {closing!r} or \',\' in JSON stream, '
+                    f'got {separator!r}')
+
+    def iter_array(self):
+        """Yield the elements of the array at the current position."""
+        for _ in self._iter_container('[', ']'):
+            yield self.decode_value()
+
+    def iter_object(self):
+        """Yield the keys of the object at the current position.
+
+        The caller must consume the value of every key, with decode_value,
+        iter_array or iter_object, before advancing to the next key.
+        """
+        for _ in self._iter_container('{', '}'):
+            key = self.decode_value()
+            self._expect(':')
+            yield key
+
+
+def _update_records_hash(hasher, records):
+    for record in records:
+        hasher.update(json.dumps(record).encode('utf-8'))
+
+
+def scan_genesis(path, chunk_size=READ_CHUNK_SIZE):
+    """Read a genesis file without holding its records in memory.
+
+    Returns the genesis fields other than records, and the SHA-256 digest of
+    its records as computed by records_hash.
+    """
+    fields = {}
+    hasher = hashlib.sha256()
+    with open(path, 'r') as genesis_fd:
+        stream = JsonStream(genesis_fd, chunk_size)
+        for key in stream.iter_object():
+            if key == 'records':
+                _update_records_hash(hasher, stream.iter_array())
+            else:
+                fields[key] = stream.decode_value()
+    return fields, hasher.digest()
+
+
+def records_hash(path, chunk_size=READ_CHUNK_SIZE):
+    """SHA-256 digest of the records of a records.json file."""
+    hasher = hashlib.sha256()
+    with open(path, 'r') as records_fd:
+        _update_records_hash(hasher,
+                             JsonStream(records_fd, chunk_size).iter_array())
+    return hasher.digest()
+
+
+def fields_digest(fields):
+    return hashlib.sha256(json.dumps(
+        fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def genesis_digests(path, index=None):
+    """Hex digests of the fields and of the records of a genesis file.
+
+    If a DigestIndex is given, digests of an unchanged file are taken from
+    it instead of scanning the file again.
+    """
+    if index is not None:
+        cached = (index.lookup(path, 'fields-sha256'),
+                  index.lookup(path, 'records-sha256'))
+        if None not in cached:
+            return cached
+
+    stat = os.stat(path)
+    fields, records_digest = scan_genesis(path)
+    digests = (fields_digest(fields), records_digest.hex())
+
+    if index is not None:
+        index.store(path, {
+            'fields-sha256': digests[0],
+            'records-sha256': digests[1]
+        }, stat)
+        index.save()
+    return digests
+
+
+_MISSING = object()
+
+
+class GenesisDiff(typing.NamedTuple):
+    """Differences between two genesis configs.
+
+    fields are the names of the changed fields other than records, and
+    record_ranges the [start, end) index ranges of the records which differ.
+    Every genesis field goes into the epoch, runtime or economics config of
+    the chain, so any difference changes the state.
+    """
+    fields: typing.Tuple[str, ...]
+    record_ranges: typing.Tuple[typing.Tuple[int, int], ...]
+
+    @property
+    def state_changing(self):
+        return bool(self.fields or self.record_ranges)
+
+    def describe(self):
+        if not self.state_changing:
+            return 'no changes'
+        changes = []
+        if self.fields:
+            changes.append(f'fields {", ".join(self.fields)}')
+        if self.record_ranges:
+            changes.append('records ' + ', '.join(
+                f'{start}..{end}' for start, end in self.record_ranges))
+        return '; '.join(changes)
+
+
+def _iter_genesis_records(path, fields, chunk_size):
+    with open(path, 'r') as genesis_fd:
+        stream = JsonStream(genesis_fd, chunk_size)
+        for key in stream.iter_object():
+            if key == 'records':
+                yield from stream.iter_array()
+            else:
+                fields[key] = stream.decode_value()
+
+
+def _iter_records_file(path, chunk_size):
+    with open(path, 'r') as records_fd:
+        yield from JsonStream(records_fd, chunk_size).iter_array()
+
+
+def _iter_records(genesis_path, records_path, fields, chunk_size):
+    records = _iter_genesis_records(genesis_path, fields, chunk_size)
+    if records_path is None:
+        return records
+    return itertools.chain(records, _iter_records_file(records_path,
+                                                       chunk_size))
+
+
+def compare_genesis(old_genesis_path,
+                    new_genesis_path,
+                    old_records_path=None,
+                    new_records_path=None,
+                    chunk_size=READ_CHUNK_SIZE):
+    """Compare two genesis configs without loading them into memory.
+
+    Records are read from the genesis file, followed by those of the
+    records file if one is given, and compared one by one in order.
+    """
+    old_fields = {}
+    new_fields = {}
+    old_records = _iter_records(old_genesis_path, old_records_path, old_fields,
+                                chunk_size)
+    new_records = _iter_records(new_genesis_path, new_records_path, new_fields,
+                                chunk_size)
+
+    record_ranges = []
+    start = None
+    index = 0
+    for index, (old, new) in enumerate(
+            itertools.zip_longest(old_records, new_records,
+                                  fillvalue=_MISSING)):
+        if old != new:
+            if start is None:
+                start = index
+        elif start is not None:
+            record_ranges.append((start, index))
+            start = None
+    if start is not None:
+        record_ranges.append((start, index + 1))
+
+    fields = tuple(
+        sorted(
+            key for key in set(old_fields) | set(new_fields)
+            if old_fields.get(key, _MISSING) != new_fields.get(key, _MISSING)))
+    return GenesisDiff(fields, tuple(record_ranges))
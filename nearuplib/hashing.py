@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+HASH_BUFFER_SIZE = 4 * 1024 * 1024
+DIGEST_INDEX_FILE = 'digests.json'
+
+
+def file_digests(path, algorithms=('md5',), buffer_size=HASH_BUFFER_SIZE):
+    """Compute several hex digests of a file in a single pass.
+
+    The file is read into one reused buffer, so memory use does not depend
+    on the file size. hashlib releases the GIL while hashing large buffers,
+    so files hashed from different threads are hashed in parallel.
+    """
+    hashers = [(name, hashlib.new(name)) for name in algorithms]
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as file_fd:
+        while True:
+            size = file_fd.readinto(buf)
+            if not size:
+                break
+            for _, hasher in hashers:
+                hasher.update(view[:size])
+    return {name: hasher.hexdigest() for name, hasher in hashers}
+
+
+def digest_files(paths, algorithms=('md5',), max_workers=None):
+    """Hash several files concurrently.
+
+    Returns a dict mapping each path to its digests as returned by
+    file_digests, or to None if the file does not exist.
+    """
+
+    def digest(path):
+        try:
+            return file_digests(path, algorithms)
+        except FileNotFoundError:
+            return None
+
+    paths = list(paths)
+    if len(paths) < 2:
+        return {path: digest(path) for path in paths}
+
+    max_workers = max_workers or min(len(paths), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(paths, executor.map(digest, paths)))
+
+
+class DigestIndex:
+    """On-disk cache of file digests.
+
+    Entries are keyed by absolute path and only trusted while the size,
+    mtime and inode of the file are the ones recorded when it was hashed,
+    so a digest of an unchanged file is looked up instead of recomputed.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        try:
+            with open(index_path) as index_fd:
+                self._entries = json.load(index_fd)
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+
+    @classmethod
+    def for_home(cls, home_dir):
+        return cls(os.path.join(home_dir, '.nearup', DIGEST_INDEX_FILE))
+
+    @staticmethod
+    def _signature(stat):
+        return {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'ino': stat.st_ino
+        }
+
+    def lookup(self, path, name):
+        path = os.path.abspath(path)
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        try:
+            signature = self._signature(os.stat(path))
+        except FileNotFoundError:
+            return None
+        if entry['stat'] != signature:
+            return None
+        return entry['digests'].get(name)
+
+    def store(self, path, digests, stat):
+        """Record digests of path computed while it had the given stat."""
+        path = os.path.abspath(path)
+        signature = self._signature(stat)
+        entry = self._entries.get(path)
+        if entry is None or entry['stat'] != signature:
+            entry = self._entries[path] = {'stat': signature, 'digests': {}}
+        entry['digests'].update(digests)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'w') as index_fd:
+            json.dump(self._entries, index_fd)
+        os.replace(tmp_path, self.index_path)
+
+    def file_digests(self, paths, algorithms=('md5', 'sha256')):
+        """Like digest_files, hashing only files not already in the index."""
+        results = {}
+        stale = {}
+        for path in paths:
+            digests = {name: self.lookup(path, name) for name in algorithms}
+            if None in digests.values():
+                try:
+                    stale[path] = os.stat(path)
+                except FileNotFoundError:
+                    results[path] = None
+            else:
+                results[path] = digests
+
+        if stale:
+            for path, digests in digest_files(stale, algorithms).items():
+                if digests is not None:
+                    self.store(path, digests, stale[path])
+                results[path] = digests
+            self.save()
+
+        return results
@@ -0,0 +1,46 @@
+import hashlib
+import os
+import typing
+
+from nearuplib.constants import (INSTANCES_FOLDER, LOCALNET_HOME,
+                                 LOCALNET_LOGS_FOLDER, LOGS_FOLDER,
+                                 NODE_PID_FILE)
+
+
+class Instance(typing.NamedTuple):
+    """Where nearup keeps the runtime state of the nodes of one home dir."""
+    name: typing.Optional[str]
+    pid_file: str
+    logs_folder: str
+
+
+def instance_name(home):
+    """Stable, readable name for the nodes running from home."""
+    home = os.path.abspath(os.path.expanduser(home))
+    digest = hashlib.sha1(home.encode('utf-8')).hexdigest()[:8]
+    return f'{os.path.basename(home) or "root"}-{digest}'
+
+
+def localnet_instance(home):
+    # The default localnet keeps the paths it always had, so `nearup stop`
+    # and `nearup logs` work for it without any extra arguments.
+    if os.path.abspath(home) == LOCALNET_HOME:
+        return Instance(None, NODE_PID_FILE, LOCALNET_LOGS_FOLDER)
+
+    name = instance_name(home)
+    return Instance(name, os.path.join(INSTANCES_FOLDER, name, 'node.pid'),
+                    os.path.join(LOGS_FOLDER, f'localnet-{name}'))
+
+
+def node_instance(home=None):
+    """Paths of a node of a public network.
+
+    The node started by `nearup run` keeps the global paths, the nodes of a
+    fleet get their own per home.
+    """
+    if home is None:
+        return Instance(None, NODE_PID_FILE, LOGS_FOLDER)
+
+    name = instance_name(home)
+    return Instance(name, os.path.join(INSTANCES_FOLDER, name, 'node.pid'),
+                    os.path.join(LOGS_FOLDER, name))
@@ -4,25 +4,100 @@ import os
 import pathlib
 import shutil
 import sys
+import time
+import typing
+import urllib.error
+import urllib.request
 
-from nearuplib.constants import NODE_PID_FILE, LOCALNET_FOLDER, LOCALNET_LOGS_FOLDER
+from concurrent.futures import ThreadPoolExecutor
+
+from nearuplib.constants import (LOCALNET_FOLDER, LOCALNET_MANIFEST,
+                                 LOCALNET_NETWORK_PORT, LOCALNET_READY_TIMEOUT,
+                                 LOCALNET_RPC_PORT)
+from nearuplib.instance import Instance, localnet_instance
+from nearuplib.nodeconfig import (discover_node_dirs, patch_node_configs,
+                                  write_json_atomic)
 from nearuplib.nodelib import run_binary, proc_name_from_pid, is_neard_running
+from nearuplib.orchestrator import orchestrate
+from nearuplib.ports import allocate_ports
+from nearuplib.snapshot import restore_snapshot
 from nearuplib import util
 
 
-def run(binary_path,
-        home,
-        num_nodes,
-        num_shards,
-        override,
-        fix_accounts,
-        archival_nodes,
-        tracked_shards,
-        verbose=True,
-        interactive=False):
+def node_ready(port, timeout=2):
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/status',
+                                    timeout=timeout) as response:
+            return response.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def wait_for_nodes(procs,
+                   rpc_ports,
+                   timeout=LOCALNET_READY_TIMEOUT,
+                   interval=0.5):
+    """Wait until every node serves its /status RPC or timeout expires.
+
+    Returns the seconds each node took to become ready, or None for the
+    nodes that exited or were not ready in time.
+    """
+    started = time.monotonic()
+    deadline = started + timeout
+
+    def wait_for_node(node):
+        proc, port = node
+        while proc.poll() is None:
+            if node_ready(port):
+                return time.monotonic() - started
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, len(procs))) as executor:
+        return list(executor.map(wait_for_node, zip(procs, rpc_ports)))
+
+
+def write_manifest(home, manifest):
+    write_json_atomic(os.path.join(home, LOCALNET_MANIFEST), manifest)
+
+
+class Localnet(typing.NamedTuple):
+    """A localnet home dir set up and configured to be started."""
+    home: str
+    instance: Instance
+    node_dirs: typing.List[str]
+    rpc_ports: typing.List[int]
+    network_ports: typing.List[int]
+    public_key: str
+
+    def boot_nodes(self, i):
+        """Every node but the first boots from the first one."""
+        if i == 0:
+            return None
+        return f'{self.public_key}@127.0.0.1:{self.network_ports[0]}'
+
+
+def prepare(binary_path,
+            home,
+            num_nodes,
+            num_shards,
+            override,
+            fix_accounts,
+            archival_nodes,
+            tracked_shards,
+            interactive=False,
+            config_overrides=(),
+            from_snapshot=None):
+    """Initialize the localnet in home if needed and allocate its ports."""
     home = pathlib.Path(home)
+    instance = localnet_instance(home)
 
-    if home.exists():
+    if from_snapshot:
+        # the snapshot replaces home, its ports are allocated afresh below
+        restore_snapshot(from_snapshot, str(home))
+    elif home.exists():
         if util.prompt_bool_flag(
                 'Would you like to remove data from the previous localnet run?',
                 override,
@@ -82,48 +157,143 @@ def run(binary_path,
                    tracked_shards=tracked_shards,
                    print_command=interactive).wait()
 
+    node_dirs = discover_node_dirs(home)
+    num_nodes = len(node_dirs)
+
+    ports = allocate_ports(instance.name or 'localnet', instance.pid_file,
+                           [(num_nodes, LOCALNET_RPC_PORT),
+                            (num_nodes, LOCALNET_NETWORK_PORT)])
+    rpc_ports = ports[0]
+    network_ports = ports[1]
+    write_manifest(
+        home, {
+            'num_nodes': num_nodes,
+            'rpc_ports': rpc_ports,
+            'network_ports': network_ports,
+            'pid_file': instance.pid_file,
+            'logs_folder': instance.logs_folder,
+        })
+
     # Edit args files
-    num_nodes = 0
-    while True:
-        path = home / f'node{num_nodes}' / 'config.json'
-        if not path.exists():
-            break
-
-        data = json.loads(path.read_text())
-        data['rpc']['addr'] = f'0.0.0.0:{3030 + num_nodes}'
-        data['network']['addr'] = f'0.0.0.0:{24567 + num_nodes}'
-        path.write_text(json.dumps(data, indent=2))
-        num_nodes += 1
+    def node_overrides(i):
+        return [
+            (['rpc', 'addr'], f'0.0.0.0:{rpc_ports[i]}'),
+            (['network', 'addr'], f'0.0.0.0:{network_ports[i]}'),
+        ] + list(config_overrides)
+
+    patch_node_configs(node_dirs, node_overrides)
 
     # Load public key from first node
-    data = json.loads((home / 'node0' / 'node_key.json').read_text())
+    data = json.loads(pathlib.Path(node_dirs[0], 'node_key.json').read_text())
     public_key = data['public_key']
 
+    return Localnet(str(home), instance, node_dirs, rpc_ports, network_ports,
+                    public_key)
+
+
+def run(binary_path,
+        home,
+        num_nodes,
+        num_shards,
+        override,
+        fix_accounts,
+        archival_nodes,
+        tracked_shards,
+        verbose=True,
+        interactive=False,
+        ready_timeout=LOCALNET_READY_TIMEOUT,
+        config_overrides=(),
+        from_snapshot=None):
+    localnet = prepare(binary_path, home, num_nodes, num_shards, override,
+                       fix_accounts, archival_nodes, tracked_shards,
+                       interactive, config_overrides, from_snapshot)
+    instance = localnet.instance
+    node_dirs = localnet.node_dirs
+    num_nodes = len(node_dirs)
+
     # Recreate log folder
-    shutil.rmtree(LOCALNET_LOGS_FOLDER, ignore_errors=True)
-    os.mkdir(LOCALNET_LOGS_FOLDER)
+    shutil.rmtree(instance.logs_folder, ignore_errors=True)
+    os.makedirs(instance.logs_folder)
 
     # Spawn network
-    with open(NODE_PID_FILE, 'w') as pid_fd:
-        for i in range(0, num_nodes):
-            proc = run_binary(
-                binary_path,
-                os.path.join(home, f'node{i}'),
-                'run',
-                verbose=verbose,
-                boot_nodes=f'{public_key}@127.0.0.1:24567' if i > 0 else None,
-                output=os.path.join(LOCALNET_LOGS_FOLDER, f'node{i}'),
-                print_command=interactive)
-            proc_name = proc_name_from_pid(proc.pid)
+    def spawn(i):
+        proc = run_binary(binary_path,
+                          node_dirs[i],
+                          'run',
+                          verbose=verbose,
+                          boot_nodes=localnet.boot_nodes(i),
+                          output=os.path.join(instance.logs_folder, f'node{i}'),
+                          print_command=interactive)
+        return proc, proc_name_from_pid(proc.pid)
+
+    nodes = []
+    failures = []
+    with ThreadPoolExecutor(max_workers=min(num_nodes, 32)) as executor:
+        futures = [executor.submit(spawn, i) for i in range(num_nodes)]
+        for i, future in enumerate(futures):
+            try:
+                nodes.append(future.result())
+            except Exception as ex:
+                failures.append((i, ex))
+
+    # every node which started is recorded, so `nearup stop` reaches it even
+    # if others failed
+    os.makedirs(os.path.dirname(instance.pid_file), exist_ok=True)
+    with open(instance.pid_file, 'w') as pid_fd:
+        for proc, proc_name in nodes:
             pid_fd.write(f'{proc.pid}|{proc_name}|localnet\n')
 
+    if failures:
+        for i, ex in failures:
+            logging.error(f'Unable to start node{i}: {ex!r}, see its logs in '
+                          f'{os.path.join(instance.logs_folder, f"node{i}")}')
+        logging.error('Stop the other nodes with `nearup stop`')
+        sys.exit(1)
+
+    logging.info(f'Spawned {num_nodes} localnet nodes...')
+    logging.info(f'Localnet logs written in: {instance.logs_folder}')
+
+    if not ready_timeout:
+        return True
+
+    logging.info(f'Waiting up to {ready_timeout}s for the nodes to be ready...')
+    ready_times = wait_for_nodes([proc for proc, _ in nodes],
+                                 localnet.rpc_ports,
+                                 timeout=ready_timeout)
+    for i, ready_time in enumerate(ready_times):
+        if ready_time is None:
+            logging.error(
+                f'node{i} is not ready, see its logs in '
+                f'{os.path.join(instance.logs_folder, f"node{i}.log")}')
+        else:
+            logging.info(f'node{i} ready in {ready_time:.1f}s')
+
+    if None in ready_times:
+        return False
+
     logging.info('Localnet was spawned successfully...')
-    logging.info(f'Localnet logs written in: {LOCALNET_LOGS_FOLDER}')
-    logging.info('Check localnet status at http://127.0.0.1:3030/status')
+    logging.info(
+        f'Check localnet status at http://127.0.0.1:{localnet.rpc_ports[0]}/status'
+    )
+    if instance.name:
+        logging.info(f'Stop this localnet with `nearup stop --home {home}`')
+    return True
 
 
-def entry(binary_path, home, num_nodes, num_shards, override, fix_accounts,
-          archival_nodes, tracked_shards, verbose, interactive):
+def entry(binary_path,
+          home,
+          num_nodes,
+          num_shards,
+          override,
+          fix_accounts,
+          archival_nodes,
+          tracked_shards,
+          verbose,
+          interactive,
+          ready_timeout=LOCALNET_READY_TIMEOUT,
+          config_overrides=(),
+          orchestrated=False,
+          from_snapshot=None):
     if binary_path:
         binary_path = os.path.join(binary_path, 'neard')
     else:
@@ -133,8 +303,17 @@ def entry(binary_path, home, num_nodes, num_shards, override, fix_accounts,
             os.makedirs(LOCALNET_FOLDER)
         util.download_binaries('localnet', uname)
 
-    if is_neard_running():
+    if is_neard_running(localnet_instance(home).pid_file):
         sys.exit(1)
 
-    run(binary_path, home, num_nodes, num_shards, override, fix_accounts,
-        archival_nodes, tracked_shards, verbose, interactive)
+    if orchestrated:
+        localnet = prepare(binary_path, home, num_nodes, num_shards, override,
+                           fix_accounts, archival_nodes, tracked_shards,
+                           interactive, config_overrides, from_snapshot)
+        orchestrate(binary_path, localnet, verbose)
+        return
+
+    if not run(binary_path, home, num_nodes, num_shards, override, fix_accounts,
+               archival_nodes, tracked_shards, verbose, interactive,
+               ready_timeout, config_overrides, from_snapshot):
+        sys.exit(1)
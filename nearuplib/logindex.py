@@ -0,0 +1,388 @@
+"""Indexed search over neard logs.
+
+Each log keeps a sidecar <log>.idx with, for every segment, checkpoints
+every INDEX_STRIDE bytes mapping the timestamp and the block height in
+effect to a byte offset. A query seeks straight to the checkpoints around
+the requested time or height in the memory-mapped segment and only scans
+the lines in between. Indexes are extended from where they stopped as the
+log grows.
+
+Compressed segments can't be seeked into, so only the time and height
+range they cover is indexed and they are skipped when out of range.
+"""
+import calendar
+import gzip
+import json
+import mmap
+import os
+import re
+import subprocess
+import sys
+import time
+import typing
+
+from nearuplib.nodeconfig import write_json_atomic
+from nearuplib.tailer import format_line, log_segments
+
+INDEX_STRIDE = 1024 * 1024
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+# Lines a checkpoint may skip looking for a timestamp, e.g. in a backtrace.
+_MAX_UNTIMED_LINES = 256
+
+_ANSI = rb'(?:\x1b\[[0-9;]*m)*'
+_ISO_TIME_RE = re.compile(
+    _ANSI + rb'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(\.\d+)?')
+# neard before the switch to tracing logged `Apr 20 10:15:23.123`
+_LEGACY_TIME_RE = re.compile(
+    _ANSI + rb'([A-Z][a-z]{2}) +(\d{1,2}) (\d{2}):(\d{2}):(\d{2})(\.\d+)?')
+_MONTHS = {
+    name.encode(): i for i, name in enumerate(calendar.month_abbr) if name
+}
+HEIGHT_RE = re.compile(rb'stats: #\s*(\d+)')
+
+_RELATIVE_RE = re.compile(r'(\d+(?:\.\d+)?)([smhd])')
+_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+_TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M',
+                 '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+def parse_line_time(line, year):
+    """UTC timestamp at the start of a log line, or None.
+
+    year is used for the legacy format, which does not log it.
+    """
+    match = _ISO_TIME_RE.match(line)
+    if match:
+        fields = [int(value) for value in match.groups()[:6]]
+    else:
+        match = _LEGACY_TIME_RE.match(line)
+        if not match or match.group(1) not in _MONTHS:
+            return None
+        fields = [year, _MONTHS[match.group(1)]
+                 ] + [int(value) for value in match.groups()[1:5]]
+
+    fraction = match.groups()[-1]
+    try:
+        return calendar.timegm(tuple(fields) +
+                               (0, 0, 0)) + (float(fraction) if fraction else 0)
+    except (OverflowError, ValueError):
+        return None
+
+
+def parse_time(value, now=None):
+    """Timestamp of a command line time: UTC ISO date and time, or a
+    duration like 90s, 30m, 2h or 1d meaning that long ago."""
+    match = _RELATIVE_RE.fullmatch(value.strip())
+    if match:
+        now = time.time() if now is None else now
+        return now - float(match.group(1)) * _UNITS[match.group(2)]
+
+    value = value.strip().rstrip('Z')
+    fraction = 0
+    if '.' in value:
+        value, _, digits = value.partition('.')
+        fraction = float(f'0.{digits}')
+    for time_format in _TIME_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(value, time_format)) + fraction
+        except ValueError:
+            pass
+    raise ValueError(f'unrecognized time {value!r}')
+
+
+class LogQuery(typing.NamedTuple):
+    pattern: typing.Optional[typing.Pattern] = None
+    since: typing.Optional[float] = None
+    until: typing.Optional[float] = None
+    height: typing.Optional[int] = None
+
+    @property
+    def ranged(self):
+        return (self.since is not None or self.until is not None or
+                self.height is not None)
+
+    def before_range(self, timestamp, height):
+        """Whether everything logged up to timestamp and height is too old."""
+        return (self.since is not None and timestamp is not None and timestamp
+                < self.since) or (self.height is not None and
+                                  (height is None or height < self.height))
+
+    def after_range(self, timestamp, height):
+        """Whether everything logged from timestamp and height is too new."""
+        return (self.until is not None and timestamp is not None and
+                timestamp > self.until) or (self.height is not None and
+                                            height is not None and
+                                            height > self.height)
+
+    def matches(self, line, timestamp, height):
+        if self.since is not None and (timestamp is None or
+                                       timestamp < self.since):
+            return False
+        if self.until is not None and (timestamp is None or
+                                       timestamp > self.until):
+            return False
+        if self.height is not None and height != self.height:
+            return False
+        return self.pattern is None or self.pattern.search(line) is not None
+
+
+def _segment_identity(stat):
+    return {'dev': stat.st_dev, 'ino': stat.st_ino}
+
+
+def _line_start(mm, offset, end):
+    if offset == 0 or mm[offset - 1] == ord('\n'):
+        return offset
+    newline = mm.find(b'\n', offset, end)
+    return end if newline < 0 else newline + 1
+
+
+def _first_timed_line(mm, offset, end, year):
+    """Offset and timestamp of the first timestamped line from offset."""
+    for _ in range(_MAX_UNTIMED_LINES):
+        if offset >= end:
+            break
+        newline = mm.find(b'\n', offset, end)
+        timestamp = parse_line_time(mm[offset:min(offset + 64, newline)], year)
+        if timestamp is not None:
+            return offset, timestamp
+        offset = newline + 1
+    return offset, None
+
+
+def _last_time(mm, end, year):
+    """Timestamp of the last timestamped line before end."""
+    for _ in range(_MAX_UNTIMED_LINES):
+        if end <= 0:
+            break
+        start = mm.rfind(b'\n', 0, end - 1) + 1
+        timestamp = parse_line_time(mm[start:min(start + 64, end)], year)
+        if timestamp is not None:
+            return timestamp
+        end = start
+    return None
+
+
+def _new_entry(stat):
+    return dict(_segment_identity(stat),
+                year=time.gmtime(stat.st_mtime).tm_year,
+                size=0,
+                next=0,
+                height=None,
+                checkpoints=[],
+                first_time=None,
+                last_time=None,
+                first_height=None)
+
+
+def _extend_entry(entry, mm, stride):
+    """Index the complete lines appended since the entry was last updated."""
+    start = entry['size']
+    end = mm.rfind(b'\n', start) + 1
+    if end <= start:
+        return
+
+    heights = [(match.start(), int(match.group(1)))
+               for match in HEIGHT_RE.finditer(mm, start, end)]
+    height_index = 0
+    height = entry['height']
+
+    target = entry['next']
+    while target < end:
+        offset, timestamp = _first_timed_line(mm, _line_start(mm, target, end),
+                                              end, entry['year'])
+        if timestamp is None:
+            target = offset
+            continue
+        while height_index < len(heights) and heights[height_index][0] < offset:
+            height = heights[height_index][1]
+            height_index += 1
+        entry['checkpoints'].append([offset, timestamp, height])
+        target = offset + stride
+
+    if heights:
+        if entry['first_height'] is None:
+            entry['first_height'] = heights[0][1]
+        entry['height'] = heights[-1][1]
+    if entry['checkpoints']:
+        entry['first_time'] = entry['checkpoints'][0][1]
+    entry['last_time'] = _last_time(mm, end,
+                                    entry['year']) or entry['last_time']
+    entry['size'] = end
+    entry['next'] = target
+
+
+def _open_compressed(path):
+    if path.endswith('.zst'):
+        proc = subprocess.Popen(['zstd', '-dcq', path],
+                                stdout=subprocess.PIPE,
+                                stdin=subprocess.DEVNULL)
+        return proc.stdout
+    return gzip.open(path, 'rb')
+
+
+def _scan_lines(lines, year, query, timestamp=None, height=None):
+    """Yield the lines matching query, tracking time and height."""
+    for line in lines:
+        line = line.rstrip(b'\n')
+        line_time = parse_line_time(line[:64], year)
+        if line_time is not None:
+            timestamp = line_time
+            if query.after_range(timestamp, None):
+                return
+        match = HEIGHT_RE.search(line)
+        if match:
+            height = int(match.group(1))
+            if query.after_range(None, height):
+                return
+        if query.matches(line, timestamp, height):
+            yield line
+
+
+def _mapped_lines(mm, start, end):
+    while start < end:
+        newline = mm.find(b'\n', start, end)
+        yield mm[start:newline]
+        start = newline + 1
+
+
+class LogIndex:
+    """The sidecar index of a log and its rotated segments."""
+
+    def __init__(self, logname, stride=INDEX_STRIDE):
+        self.logname = logname
+        self.stride = stride
+        self.index_path = logname + INDEX_SUFFIX
+        try:
+            with open(self.index_path) as index_fd:
+                data = json.load(index_fd)
+            if data.get('version') != INDEX_VERSION or data.get(
+                    'stride') != stride:
+                raise ValueError('stale index')
+            self._segments = data['segments']
+        except (FileNotFoundError, ValueError, KeyError):
+            self._segments = {}
+
+    def segments(self):
+        """Paths of the segments of the log, oldest first."""
+        paths = [path for _, path in log_segments(self.logname)]
+        if os.path.exists(self.logname):
+            paths.append(self.logname)
+        return paths
+
+    def _entry(self, path, stat):
+        entry = self._segments.get(os.path.basename(path))
+        if (entry is None or {
+                key: entry[key] for key in ('dev', 'ino')
+        } != _segment_identity(stat) or entry['size'] > stat.st_size):
+            entry = self._segments[os.path.basename(path)] = _new_entry(stat)
+        return entry
+
+    def save(self):
+        names = {os.path.basename(path) for path in self.segments()}
+        write_json_atomic(
+            self.index_path, {
+                'version': INDEX_VERSION,
+                'stride': self.stride,
+                'segments': {
+                    name: entry
+                    for name, entry in self._segments.items()
+                    if name in names
+                }
+            })
+
+    def _search_mapped(self, path, stat, query):
+        entry = self._entry(path, stat)
+        with open(path,
+                  'rb') as segment_fd, mmap.mmap(segment_fd.fileno(),
+                                                 0,
+                                                 access=mmap.ACCESS_READ) as mm:
+            _extend_entry(entry, mm, self.stride)
+
+            start, end = 0, entry['size']
+            timestamp, height = None, None
+            for offset, checkpoint_time, checkpoint_height in entry[
+                    'checkpoints']:
+                if query.after_range(checkpoint_time, checkpoint_height):
+                    end = offset
+                    break
+                if query.before_range(checkpoint_time, checkpoint_height):
+                    start, timestamp, height = (offset, checkpoint_time,
+                                                checkpoint_height)
+
+            if not query.ranged and query.pattern is not None:
+                # plain grep: let the regex engine scan the mapped file
+                previous = -1
+                for match in query.pattern.finditer(mm, start, end):
+                    line_start = mm.rfind(b'\n', start,
+                                          match.start()) + 1 or start
+                    if line_start <= previous:
+                        continue
+                    previous = line_start
+                    yield mm[line_start:mm.find(b'\n', match.start(), end)]
+                return
+
+            yield from _scan_lines(_mapped_lines(mm, start, end), entry['year'],
+                                   query, timestamp, height)
+
+    def _search_compressed(self, path, stat, query):
+        entry = self._entry(path, stat)
+        if entry['size'] == stat.st_size:
+            if query.after_range(entry['first_time'],
+                                 entry['first_height']) or query.before_range(
+                                     entry['last_time'], entry['height']):
+                return
+            with _open_compressed(path) as lines:
+                yield from _scan_lines(lines, entry['year'], query)
+            return
+
+        # the first search of a segment reads all of it to summarize it
+        first_time = first_height = timestamp = height = None
+        with _open_compressed(path) as lines:
+            for line in lines:
+                line = line.rstrip(b'\n')
+                line_time = parse_line_time(line[:64], entry['year'])
+                if line_time is not None:
+                    timestamp = line_time
+                    if first_time is None:
+                        first_time = line_time
+                match = HEIGHT_RE.search(line)
+                if match:
+                    height = int(match.group(1))
+                    if first_height is None:
+                        first_height = height
+                if query.matches(line, timestamp, height):
+                    yield line
+
+        entry.update(first_time=first_time,
+                     last_time=timestamp,
+                     first_height=first_height,
+                     height=height,
+                     size=stat.st_size)
+
+    def search(self, query):
+        """Yield the lines of every segment matching query, oldest first."""
+        for path in self.segments():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if path.endswith(('.gz', '.zst')):
+                yield from self._search_compressed(path, stat, query)
+            elif stat.st_size:
+                yield from self._search_mapped(path, stat, query)
+
+
+def search_logs(sources, query, output=sys.stdout):
+    """Print the lines of the (prefix, path) logs matching query."""
+    for prefix, logname in sources:
+        index = LogIndex(logname)
+        try:
+            for line in index.search(query):
+                print(format_line(prefix, line.decode('utf-8',
+                                                      errors='replace')),
+                      file=output)
+        finally:
+            index.save()
@@ -0,0 +1,205 @@
+"""Rotating writer for neard logs.
+
+neard writes to a pipe read by `python3 -m nearuplib.logrotate <log>`, which
+appends to <log> and renames it to the next <log>.<index> once it exceeds a
+size or an age. Rotated segments are compressed in a background thread and
+the oldest are deleted once they exceed the retention budget.
+"""
+import argparse
+import gzip
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from nearuplib.constants import (LOG_COMPRESSION, LOG_MAX_AGE, LOG_MAX_BYTES,
+                                 LOG_RETENTION_BYTES)
+from nearuplib.tailer import log_segments, next_logname
+
+READ_SIZE = 64 * 1024
+COMPRESSIONS = ('gzip', 'zstd', 'none')
+
+
+def _compress_gzip(path, target):
+    with open(path, 'rb') as src, gzip.open(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def _compress_zstd(path, target):
+    subprocess.run(['zstd', '-q', '-f', '-o', target, path],
+                   check=True,
+                   stdin=subprocess.DEVNULL)
+
+
+def compress_segment(path, compression=LOG_COMPRESSION):
+    """Compress a rotated segment next to it and remove the original.
+
+    zstd needs the zstd command, gzip is used when it is missing.
+    """
+    if compression == 'none':
+        return path
+    if compression == 'zstd' and shutil.which('zstd'):
+        target, compress = f'{path}.zst', _compress_zstd
+    else:
+        target, compress = f'{path}.gz', _compress_gzip
+
+    # compress into a temporary name, so a segment is never half compressed
+    compress(path, f'{target}.tmp')
+    os.replace(f'{target}.tmp', target)
+    os.remove(path)
+    return target
+
+
+def prune_segments(logname, retention_bytes=LOG_RETENTION_BYTES):
+    """Delete the oldest segments until the rest fit in retention_bytes."""
+    segments = []
+    for _, path in log_segments(logname):
+        try:
+            segments.append((path, os.path.getsize(path)))
+        except FileNotFoundError:
+            pass
+
+    total = sum(size for _, size in segments)
+    removed = []
+    for path, size in segments:
+        if total <= retention_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed.append(path)
+    return removed
+
+
+class RotatingLogWriter:
+    """Appends to logname, rotating it by size and by age.
+
+    Rotation only happens at the end of a line, so no line is split across
+    two segments. Writers can share one executor for compression, which
+    close() then leaves running.
+    """
+
+    def __init__(self,
+                 logname,
+                 max_bytes=LOG_MAX_BYTES,
+                 max_age=LOG_MAX_AGE,
+                 retention_bytes=LOG_RETENTION_BYTES,
+                 compression=LOG_COMPRESSION,
+                 clock=time.monotonic,
+                 executor=None):
+        self.logname = logname
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.retention_bytes = retention_bytes
+        self.compression = compression
+        self._clock = clock
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=1)
+        self._fd = None
+
+        # segments a killed writer did not get to compress are done now
+        for _, path in log_segments(logname):
+            if not path.endswith(('.gz', '.zst')):
+                self._executor.submit(self._compress, path)
+        # and the log of the previous run is rotated, as on every neard start
+        if os.path.exists(logname) and os.path.getsize(logname):
+            self._rotate_file()
+        self._open()
+
+    def _open(self):
+        self._fd = open(self.logname, 'ab', buffering=0)
+        self._size = self._fd.tell()
+        self._opened = self._clock()
+        self._line_ended = True
+
+    def _compress(self, path):
+        try:
+            compress_segment(path, self.compression)
+            prune_segments(self.logname, self.retention_bytes)
+        except (OSError, subprocess.CalledProcessError) as ex:
+            logging.error(f'Unable to compress {path}: {ex}')
+
+    def _rotate_file(self):
+        segment = next_logname(self.logname)
+        os.rename(self.logname, segment)
+        self._executor.submit(self._compress, segment)
+
+    def rotate(self):
+        if self._fd is not None:
+            self._fd.close()
+        self._rotate_file()
+        self._open()
+
+    def _expired(self):
+        return self._size and self._clock() - self._opened >= self.max_age
+
+    def write(self, data):
+        if self._expired() and self._line_ended:
+            self.rotate()
+        if self._size + len(data) > self.max_bytes or self._expired():
+            end = data.rfind(b'\n') + 1
+            if end:
+                self._write(data[:end])
+                self.rotate()
+                data = data[end:]
+        self._write(data)
+
+    def _write(self, data):
+        self._fd.write(data)
+        self._size += len(data)
+        if data:
+            self._line_ended = data.endswith(b'\n')
+
+    def close(self):
+        self._fd.close()
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
+
+
+def start_log_rotator(logname):
+    """Start a writer process for logname and return it.
+
+    Pass its stdin as neard's output, then close the stdin of the returned
+    process so the writer exits once neard does.
+    """
+    return subprocess.Popen(
+        [sys.executable, '-m', 'nearuplib.logrotate', logname],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('logname')
+    parser.add_argument('--max-bytes', type=int, default=LOG_MAX_BYTES)
+    parser.add_argument('--max-age', type=float, default=LOG_MAX_AGE)
+    parser.add_argument('--retention-bytes',
+                        type=int,
+                        default=LOG_RETENTION_BYTES)
+    parser.add_argument('--compression',
+                        choices=COMPRESSIONS,
+                        default=LOG_COMPRESSION)
+    args = parser.parse_args(argv)
+
+    # keep draining the pipe until neard exits, even on ^C in the terminal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    writer = RotatingLogWriter(args.logname, args.max_bytes, args.max_age,
+                               args.retention_bytes, args.compression)
+    try:
+        stdin = sys.stdin.buffer
+        for data in iter(lambda: stdin.read1(READ_SIZE), b''):
+            writer.write(data)
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import json
+import os
+import re
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+_NODE_DIR = re.compile(r'node(\d+)')
+
+
+def discover_node_dirs(home):
+    """Return the node<i> directories of a localnet home, ordered by i."""
+    nodes = []
+    with os.scandir(home) as entries:
+        for entry in entries:
+            match = _NODE_DIR.fullmatch(entry.name)
+            if match and entry.is_dir():
+                nodes.append((int(match.group(1)), entry.path))
+    return [path for _, path in sorted(nodes)]
+
+
+def parse_override(override):
+    """Parse a `dotted.key=value` override; value is JSON or a plain string."""
+    key, sep, value = override.partition('=')
+    if not sep or not key:
+        raise ValueError(f'config override {override!r} is not KEY=VALUE')
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return key.split('.'), value
+
+
+def apply_overrides(config, overrides):
+    for keys, value in overrides:
+        section = config
+        for key in keys[:-1]:
+            section = section.setdefault(key, {})
+            if not isinstance(section, dict):
+                raise ValueError(
+                    f'cannot override {".".join(keys)}: {key} is not an object')
+        section[keys[-1]] = value
+    return config
+
+
+def write_json_atomic(path, data):
+    directory = os.path.dirname(path)
+    with tempfile.NamedTemporaryFile('w',
+                                     dir=directory,
+                                     prefix='.',
+                                     suffix='.tmp',
+                                     delete=False) as tmp_fd:
+        json.dump(data, tmp_fd, indent=2)
+    os.chmod(tmp_fd.name, 0o644)
+    os.replace(tmp_fd.name, path)
+
+
+def patch_node_configs(node_dirs, overrides_for_node, max_workers=None):
+    """Apply overrides to the config.json of every node in parallel.
+
+    overrides_for_node(i) returns the overrides for the i-th node, as a list
+    of (keys, value) pairs. Every file is replaced atomically.
+    """
+
+    def patch(node):
+        i, node_dir = node
+        path = os.path.join(node_dir, 'config.json')
+        with open(path) as config_fd:
+            config = json.load(config_fd)
+        write_json_atomic(path, apply_overrides(config, overrides_for_node(i)))
+
+    max_workers = max_workers or min(32, len(node_dirs) or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(patch, enumerate(node_dirs)))
@@ -1,22 +1,27 @@
-import hashlib
 import json
 import logging
 import os
+import select
 import site
 import shutil
 import subprocess
 import sys
 import tempfile
-
-import psutil
-
-from nearuplib.constants import DEFAULT_WAIT_TIMEOUT, LOGS_FOLDER, NODE_PID_FILE
-from nearuplib.util import (download_binaries, download_genesis,
+import time
+
+# psutil is imported by the functions using it, like boto3 in util, to keep
+# the startup of every nearup command fast.
+from nearuplib import genesis, trash
+from nearuplib.constants import (BINARIES_FOLDER, DEFAULT_WAIT_TIMEOUT,
+                                 NODE_PID_FILE)
+from nearuplib.hashing import DigestIndex
+from nearuplib.instance import node_instance
+from nearuplib.util import (download_binaries, fetch_release_metadata,
                             latest_genesis_md5sum, read_genesis_md5sum,
                             write_genesis_md5sum, new_release_ready,
                             prompt_bool_flag, prompt_flag, wraptext)
 from nearuplib.watcher import is_watcher_running, run_watcher, stop_watcher
-from nearuplib.tailer import next_logname
+from nearuplib.logrotate import start_log_rotator
 
 
 def read_validator_key(home_dir):
@@ -54,7 +59,12 @@ def print_validator_info(home_dir):
     print()
 
 
-def init_near(home_dir, binary_path, chain_id, account_id, interactive=False):
+def init_near(home_dir,
+              binary_path,
+              chain_id,
+              account_id,
+              interactive=False,
+              metadata=None):
     logging.info("Initializing the node configuration using near binary...")
 
     msg = wraptext('''
@@ -88,7 +98,10 @@ def init_near(home_dir, binary_path, chain_id, account_id, interactive=False):
     if chain_id in ['betanet', 'testnet', 'shardnet']:
         cmd.append('--download-genesis')
         cmd.append('--download-config')
-        genesis_md5sum = latest_genesis_md5sum(chain_id)
+        if metadata is not None:
+            genesis_md5sum = metadata.genesis_md5sums
+        else:
+            genesis_md5sum = latest_genesis_md5sum(chain_id)
 
     while True:
         if interactive:
@@ -100,7 +113,7 @@ def init_near(home_dir, binary_path, chain_id, account_id, interactive=False):
 
             if new_genesis_md5sum != genesis_md5sum:
                 genesis_md5sum = new_genesis_md5sum
-                logger.info(
+                logging.info(
                     f'genesis md5sum changed while neard init was running. reinitializing...'
                 )
                 shutil.rmtree(home_dir)
@@ -114,8 +127,11 @@ def init_near(home_dir, binary_path, chain_id, account_id, interactive=False):
         print_validator_info(home_dir)
 
 
-def genesis_changed(chain_id, home_dir):
-    genesis_md5sum, records_md5sum = latest_genesis_md5sum(chain_id)
+def genesis_changed(chain_id, home_dir, metadata=None):
+    if metadata is not None:
+        genesis_md5sum, records_md5sum = metadata.genesis_md5sums
+    else:
+        genesis_md5sum, records_md5sum = latest_genesis_md5sum(chain_id)
 
     local_genesis_md5sum, local_records_md5sum = read_genesis_md5sum(home_dir)
 
@@ -141,125 +157,177 @@ def genesis_changed(chain_id, home_dir):
 # only meant to be called when the old genesis has records in the genesis file, and the new genesis
 # has records in a separate file. returns true if all fields of the genesis are the same as well as the records
 # (without trying to sort them or be clever at all)
-def genesis_files_equivalent(old_genesis_path, new_genesis_path,
-                             new_records_path):
-    with open(old_genesis_path, 'r') as old_genesis, open(
-            new_genesis_path, 'r') as new_genesis, open(new_records_path,
-                                                        'r') as new_records:
-        old_genesis = json.load(old_genesis)
-        new_genesis = json.load(new_genesis)
-
-        seen_keys = set()
-        for key in old_genesis:
-            if key == 'records':
-                continue
-
-            seen_keys.add(key)
-            try:
-                new_value = new_genesis[key]
-            except KeyError:
-                return False
+def genesis_files_equivalent(old_genesis_path,
+                             new_genesis_path,
+                             new_records_path,
+                             index=None):
+    # all three files are streamed, since the old genesis embeds every record and is very big for testnet
+    new_fields_digest, _ = genesis.genesis_digests(new_genesis_path)
+    old_fields_digest, old_records_digest = genesis.genesis_digests(
+        old_genesis_path, index)
+    if old_fields_digest != new_fields_digest:
+        return False
 
-            old_value = old_genesis[key]
+    return genesis.records_hash(new_records_path).hex() == old_records_digest
 
-            if old_value != new_value:
-                return False
 
-        for key in new_genesis:
-            if key == 'records':
-                continue
+def genesis_change_keeps_data(old_home,
+                              new_home,
+                              old_has_records,
+                              new_has_records,
+                              index=None):
+    """Whether a data dir created with the genesis in old_home stays valid
+    with the genesis in new_home.
 
-            if key not in seen_keys:
-                return False
+    This is only the case if neither a field nor a record differs, even if
+    the records moved to records.json, see genesis.compare_genesis.
+    """
+    old_genesis = os.path.join(old_home, 'genesis.json')
+    new_genesis = os.path.join(new_home, 'genesis.json')
+    old_records = os.path.join(old_home,
+                               'records.json') if old_has_records else None
+    new_records = os.path.join(new_home,
+                               'records.json') if new_has_records else None
 
-        h = hashlib.sha256()
+    try:
+        # moving the records of the old genesis to records.json is the likely case, and is answered from the
+        # digest index without scanning the old genesis again
+        if old_records is None and new_records is not None and genesis_files_equivalent(
+                old_genesis, new_genesis, new_records, index):
+            return True
+
+        diff = genesis.compare_genesis(old_genesis, new_genesis, old_records,
+                                       new_records)
+    except (OSError, ValueError) as ex:
+        logging.warning(f'Unable to compare the genesis configs: {ex}')
+        return False
 
-        for record in old_genesis['records']:
-            h.update(json.dumps(record).encode('utf-8'))
-        old_records_hash = h.digest()
+    logging.info(f'Genesis changes: {diff.describe()}')
+    return not diff.state_changing
+
+
+class StagedGenesis:
+    """A new genesis initialized by `neard init` in a temporary directory.
+
+    Staging downloads and compares the genesis files while the node keeps
+    running, so applying it only has to move files into the home directory.
+    """
+
+    def __init__(self, tmp_dir, config_has_records, records_downloaded,
+                 keep_data):
+        self._tmp_dir = tmp_dir
+        self.config_has_records = config_has_records
+        self.records_downloaded = records_downloaded
+        self.keep_data = keep_data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+    def cleanup(self):
+        self._tmp_dir.cleanup()
+
+    def apply(self, home_dir):
+        tmp_dir = self._tmp_dir.name
+
+        with open(os.path.join(home_dir, 'config.json'), 'r+') as config_fd:
+            config = json.load(config_fd)
+            config_had_records = config['genesis_records_file'] is not None
+            if self.config_has_records != config_had_records:
+                config[
+                    'genesis_records_file'] = 'records.json' if self.config_has_records else None
+                config_fd.seek(0)
+                json.dump(config, config_fd, indent=2)
+                config_fd.truncate()
+
+        if not self.keep_data:
+            trash.trash_and_delete(os.path.join(home_dir, 'data'))
+
+        shutil.move(os.path.join(tmp_dir, 'genesis.json'),
+                    os.path.join(home_dir, 'genesis.json'))
+        if self.records_downloaded:
+            shutil.move(os.path.join(tmp_dir, 'records.json'),
+                        os.path.join(home_dir, 'records.json'))
+        # TODO: would be sad to get ^C between moving the above files and moving these two.
+        # would be good to handle that somehow
+        shutil.move(os.path.join(tmp_dir, '.nearup/genesis_md5sum'),
+                    os.path.join(home_dir, '.nearup/genesis_md5sum'))
+        try:
+            shutil.move(os.path.join(tmp_dir, '.nearup/records_md5sum'),
+                        os.path.join(home_dir, '.nearup/records_md5sum'))
+        except FileNotFoundError:
+            pass
+
+
+def stage_genesis_update(chain_id, home_dir, binary_path, metadata=None):
+    """Prepare the new genesis of chain_id without touching home_dir.
+
+    Returns a StagedGenesis, or None if the genesis has not changed.
+    """
+    if not genesis_changed(chain_id, home_dir, metadata):
+        return None
 
-        # actually del it because it's really big for testnet. would be nice to read thru
-        # these sequentially instead of all at once into a giant object
-        del old_genesis
-        new_records = json.load(new_records)
+    logging.info(f'Staging the new genesis config for {chain_id}')
+    tmp_dir = tempfile.TemporaryDirectory()
+    try:
+        init_near(tmp_dir.name,
+                  binary_path,
+                  chain_id,
+                  None,
+                  interactive=False,
+                  metadata=metadata)
+
+        with open(os.path.join(tmp_dir.name, 'config.json'), 'r') as config_fd:
+            config = json.load(config_fd)
+        config_has_records = config['genesis_records_file'] is not None
+        records_downloaded = os.path.exists(
+            os.path.join(tmp_dir.name, 'records.json'))
+        if config_has_records != records_downloaded:
+            if config_has_records:
+                logging.warning(
+                    f'newly downloaded config shows records needed, but neard init did not download records.json'
+                )
+            else:
+                logging.warning(
+                    f'newly downloaded config shows records not needed, but neard init downloaded records.json'
+                )
 
-        h = hashlib.sha256()
-        for record in new_records:
-            h.update(json.dumps(record).encode('utf-8'))
-        new_records_hash = h.digest()
+        with open(os.path.join(home_dir, 'config.json'), 'r') as config_fd:
+            config = json.load(config_fd)
+        config_had_records = config['genesis_records_file'] is not None
 
-        return new_records_hash == old_records_hash
+        keep_data = os.path.exists(os.path.join(
+            home_dir, 'data')) and genesis_change_keeps_data(
+                home_dir, tmp_dir.name, config_had_records,
+                config_has_records and records_downloaded,
+                DigestIndex.for_home(home_dir))
+    except BaseException:
+        tmp_dir.cleanup()
+        raise
 
+    return StagedGenesis(tmp_dir, config_has_records, records_downloaded,
+                         keep_data)
 
-def check_and_update_genesis(chain_id, home_dir, binary_path):
-    if genesis_changed(chain_id, home_dir):
-        logging.info(
-            f'Update genesis config and remove stale data for {chain_id}')
-
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            init_near(tmp_dir, binary_path, chain_id, None, interactive=False)
-
-            with open(os.path.join(tmp_dir, 'config.json'), 'r') as config_fd:
-                config = json.load(config_fd)
-                config_has_records = config['genesis_records_file'] is not None
-                records_downloaded = os.path.exists(
-                    os.path.join(tmp_dir, 'records.json'))
-                if config_has_records != records_downloaded:
-                    if config_has_records:
-                        logging.warning(
-                            f'newly downloaded config shows records needed, but neard init did not download records.json'
-                        )
-                    else:
-                        logging.warning(
-                            f'newly downloaded config shows records not needed, but neard init downloaded records.json'
-                        )
-
-            with open(os.path.join(home_dir, 'config.json'), 'r+') as config_fd:
-                config = json.load(config_fd)
-                config_had_records = config['genesis_records_file'] is not None
-                if config_has_records != config_had_records:
-                    config[
-                        'genesis_records_file'] = 'records.json' if config_has_records else None
-                    config_fd.seek(0)
-                    json.dump(config, config_fd, indent=2)
-                    config_fd.truncate()
-
-            if os.path.exists(os.path.join(home_dir, 'data')):
-                # for now the only situation where we try to check if we can avoid deleting the data dir is the case
-                # of moving from no records file to having a records file, since it's best effort anyway and it's the
-                # only likely case for the moment
-                keep_data = not config_had_records and config_has_records and records_downloaded and genesis_files_equivalent(
-                    os.path.join(home_dir, 'genesis.json'),
-                    os.path.join(tmp_dir, 'genesis.json'),
-                    os.path.join(tmp_dir, 'records.json'))
-                if not keep_data:
-                    shutil.rmtree(os.path.join(home_dir, 'data'))
-
-            shutil.move(os.path.join(tmp_dir, 'genesis.json'),
-                        os.path.join(home_dir, 'genesis.json'))
-            if records_downloaded:
-                shutil.move(os.path.join(tmp_dir, 'records.json'),
-                            os.path.join(home_dir, 'records.json'))
-            # TODO: would be sad to get ^C between moving the above files and moving these two.
-            # would be good to handle that somehow
-            shutil.move(os.path.join(tmp_dir, '.nearup/genesis_md5sum'),
-                        os.path.join(home_dir, '.nearup/genesis_md5sum'))
-            try:
-                shutil.move(os.path.join(tmp_dir, '.nearup/records_md5sum'),
-                            os.path.join(home_dir, '.nearup/records_md5sum'))
-            except FileNotFoundError:
-                pass
 
-        return True
+def check_and_update_genesis(chain_id, home_dir, binary_path, metadata=None):
+    staged = stage_genesis_update(chain_id, home_dir, binary_path, metadata)
+    if staged is None:
+        return False
 
-    return False
+    logging.info(f'Update genesis config and remove stale data for {chain_id}')
+    with staged:
+        staged.apply(home_dir)
+    return True
 
 
 def check_and_setup(binary_path,
                     home_dir,
                     chain_id,
                     account_id,
-                    interactive=False):
+                    interactive=False,
+                    metadata=None):
     """Checks if there is already everything setup on this machine, otherwise sets up NEAR node."""
     if os.path.exists(os.path.join(home_dir)):
         if chain_id != 'localnet':
@@ -273,7 +341,7 @@ def check_and_setup(binary_path,
                     sys.exit(1)
 
         if chain_id in ['guildnet', 'betanet', 'testnet', 'shardnet']:
-            check_and_update_genesis(chain_id, home_dir, binary_path)
+            check_and_update_genesis(chain_id, home_dir, binary_path, metadata)
         elif chain_id == 'mainnet':
             logging.info("Using the mainnet genesis...")
         else:
@@ -282,7 +350,12 @@ def check_and_setup(binary_path,
         return
 
     logging.info("Setting up network configuration.")
-    init_near(home_dir, binary_path, chain_id, account_id, interactive)
+    init_near(home_dir,
+              binary_path,
+              chain_id,
+              account_id,
+              interactive,
+              metadata=metadata)
 
     if chain_id not in [
             'mainnet', 'guildnet', 'betanet', 'testnet', 'shardnet'
@@ -307,20 +380,19 @@ def print_staking_key(home_dir):
                  key_data['public_key'])
 
 
-def run_binary(path,
-               home,
-               action,
-               neard_log=None,
-               verbose=False,
-               shards=None,
-               validators=None,
-               non_validators=None,
-               boot_nodes=None,
-               output=None,
-               print_command=False,
-               fixed_shards=False,
-               archival_nodes=False,
-               tracked_shards=False):
+def neard_command(path,
+                  home,
+                  action,
+                  neard_log=None,
+                  verbose=False,
+                  shards=None,
+                  validators=None,
+                  non_validators=None,
+                  boot_nodes=None,
+                  fixed_shards=False,
+                  archival_nodes=False,
+                  tracked_shards=False):
+    """Command line and environment to run neard with."""
     command = [path, '--home', str(home)]
 
     env = os.environ.copy()
@@ -349,29 +421,62 @@ def run_binary(path,
         command.append('--archival-nodes')
     if tracked_shards:
         command.extend(['--tracked-shards', tracked_shards])
+    return command, env
 
+
+def run_binary(path,
+               home,
+               action,
+               neard_log=None,
+               verbose=False,
+               shards=None,
+               validators=None,
+               non_validators=None,
+               boot_nodes=None,
+               output=None,
+               print_command=False,
+               fixed_shards=False,
+               archival_nodes=False,
+               tracked_shards=False):
+    command, env = neard_command(path,
+                                 home,
+                                 action,
+                                 neard_log=neard_log,
+                                 verbose=verbose,
+                                 shards=shards,
+                                 validators=validators,
+                                 non_validators=non_validators,
+                                 boot_nodes=boot_nodes,
+                                 fixed_shards=fixed_shards,
+                                 archival_nodes=archival_nodes,
+                                 tracked_shards=tracked_shards)
+
+    rotator = None
     if output:
-        logname = f'{output}.log'
-        if logname != next_logname(logname):
-            shutil.move(logname, next_logname(logname))
-        output = open(logname, 'w')
+        rotator = start_log_rotator(f'{output}.log')
+        output = rotator.stdin
 
     if print_command:
         print(f'Running "{" ".join(command)}"')
     neard = subprocess.Popen(command, stderr=output, stdout=output, env=env)
+    if rotator is not None:
+        # neard holds the only write end left, so the writer exits with it
+        rotator.stdin.close()
     return neard
 
 
 def proc_name_from_pid(pid):
+    import psutil
+
     process = psutil.Process(pid)
     return process.name()
 
 
-def is_neard_running():
-    if os.path.exists(NODE_PID_FILE):
+def is_neard_running(pid_file=NODE_PID_FILE):
+    if os.path.exists(pid_file):
         logging.error("There is already binary nodes running.")
         logging.error("Either run nearup stop or by kill the process manually.")
-        logging.warning(f"If this is a mistake, remove {NODE_PID_FILE}")
+        logging.warning(f"If this is a mistake, remove {pid_file}")
         return True
     return False
 
@@ -383,47 +488,47 @@ def run(home_dir,
         verbose,
         chain_id,
         print_command=False,
-        watch=False):
+        watch=False,
+        instance=None):
+    instance = instance or node_instance()
+    os.makedirs(instance.logs_folder, exist_ok=True)
     proc = run_binary(os.path.join(binary_path, 'neard'),
                       home_dir,
                       'run',
                       neard_log=neard_log,
                       verbose=verbose,
                       boot_nodes=boot_nodes,
-                      output=os.path.join(LOGS_FOLDER, chain_id),
+                      output=os.path.join(instance.logs_folder, chain_id),
                       print_command=print_command)
     proc_name = proc_name_from_pid(proc.pid)
 
-    with open(NODE_PID_FILE, 'w') as pid_fd:
+    os.makedirs(os.path.dirname(instance.pid_file), exist_ok=True)
+    with open(instance.pid_file, 'w') as pid_fd:
         pid_fd.write(f"{proc.pid}|{proc_name}|{chain_id}")
         pid_fd.close()
 
     logging.info("Node is running...")
-    logging.info("To check logs call: `nearup logs` or `nearup logs --follow`")
+    if instance.name:
+        logging.info(f"To check logs call: `nearup logs --home {home_dir}`")
+    else:
+        logging.info(
+            "To check logs call: `nearup logs` or `nearup logs --follow`")
 
     if watch:
         logging.info("Watcher is enabled. Starting watcher...")
         run_watcher(chain_id, home=home_dir)
 
 
-def setup_and_run(binary_path,
-                  home_dir,
-                  boot_nodes,
-                  chain_id,
-                  account_id=None,
-                  verbose=False,
-                  interactive=False,
-                  neard_log='',
-                  watcher=True):
-    logging.info(
-        f'setup and run, chain_id: {chain_id} binary_path: {binary_path}')
-
-    if is_neard_running():
-        sys.exit(1)
-
-    if watcher and is_watcher_running():
-        sys.exit(1)
+def setup_node(binary_path,
+               home_dir,
+               chain_id,
+               account_id=None,
+               interactive=False,
+               metadata=None):
+    """Gets neard and sets up home_dir, returns the directory of neard.
 
+    The officially compiled binary is downloaded if binary_path is empty.
+    """
     if binary_path == '':
         logging.info('Using officially compiled binary')
         uname = os.uname()[0]
@@ -439,14 +544,58 @@ def setup_and_run(binary_path,
         if not os.path.exists(binary_path):
             os.makedirs(binary_path)
 
-        download_binaries(chain_id, uname)
+        if metadata is None:
+            metadata = fetch_release_metadata(chain_id)
+        download_binaries(chain_id, uname, metadata)
     else:
         logging.info(f'Using local binary at {binary_path}')
-        watcher = False  # ensure watcher doesn't run and try to download official binaries
 
-    check_and_setup(binary_path, home_dir, chain_id, account_id, interactive)
+    # data dirs a previous deletion left behind, e.g. on reboot. Swept before
+    # setting up, which may trash the current data dir with its own deleter.
+    trash.delete_in_background(trash.find_trash(home_dir))
+
+    check_and_setup(binary_path,
+                    home_dir,
+                    chain_id,
+                    account_id,
+                    interactive,
+                    metadata=metadata)
 
     print_staking_key(home_dir)
+    return binary_path
+
+
+def setup_and_run(binary_path,
+                  home_dir,
+                  boot_nodes,
+                  chain_id,
+                  account_id=None,
+                  verbose=False,
+                  interactive=False,
+                  neard_log='',
+                  watcher=True,
+                  metadata=None,
+                  instance=None):
+    logging.info(
+        f'setup and run, chain_id: {chain_id} binary_path: {binary_path}')
+
+    instance = instance or node_instance()
+    if is_neard_running(instance.pid_file):
+        sys.exit(1)
+
+    if watcher and is_watcher_running():
+        sys.exit(1)
+
+    if binary_path != '':
+        watcher = False  # ensure watcher doesn't run and try to download official binaries
+
+    binary_path = setup_node(binary_path,
+                             home_dir,
+                             chain_id,
+                             account_id,
+                             interactive,
+                             metadata=metadata)
+
     run(home_dir,
         binary_path,
         boot_nodes,
@@ -454,27 +603,48 @@ def setup_and_run(binary_path,
         verbose,
         chain_id,
         watch=watcher,
-        print_command=interactive)
-
+        print_command=interactive,
+        instance=instance)
 
-def stop_nearup(keep_watcher=False):
-    logging.warning("Stopping the near daemon...")
-    stop_native()
 
+def stop_nearup(keep_watcher=False, pid_file=NODE_PID_FILE):
+    # Stop the watcher first so it does not restart the node being stopped.
     if not keep_watcher:
         logging.warning("Stopping the nearup watcher...")
         stop_watcher()
     else:
         logging.warning("Skipping the stopping of the nearup watcher...")
 
+    logging.warning("Stopping the near daemon...")
+    stop_native(pid_file=pid_file)
+
+
+def stage_release(net, home_dir, uname, metadata):
+    """Get a release ready to run while the node keeps running.
+
+    The new binary is linked in place of the old one, whose process keeps
+    using the file it was started from, and the new genesis is staged.
+    Returns the directory of neard and the StagedGenesis or None.
+    """
+    binary_path = os.path.join(BINARIES_FOLDER, net)
+    os.makedirs(binary_path, exist_ok=True)
+    download_binaries(net, uname, metadata)
+    staged = None
+    if net in ['guildnet', 'betanet', 'testnet', 'shardnet']:
+        staged = stage_genesis_update(net, home_dir, binary_path, metadata)
+    return binary_path, staged
+
 
 def restart_nearup(net,
                    path=os.path.join(site.USER_BASE, 'bin/nearup'),
                    home_dir='',
                    keep_watcher=True,
                    verbose=False,
-                   restart_only_new_version=True):
+                   restart_only_new_version=True,
+                   metadata=None,
+                   instance=None):
     logging.warning("Restarting nearup...")
+    instance = instance or node_instance()
 
     if not os.path.exists(path):
         logging.error(
@@ -486,72 +656,311 @@ def restart_nearup(net,
         sys.exit(1)
 
     uname = os.uname()[0]
-    if restart_only_new_version and not new_release_ready(net, uname):
+    if metadata is None:
+        metadata = fetch_release_metadata(net)
+    if restart_only_new_version and not new_release_ready(net, uname, metadata):
         logging.warning(
             f'Latest release for {net} is not ready. Skipping restart.')
         return
 
-    logging.warning("Stopping nearup...")
-    stop_nearup(keep_watcher=keep_watcher)
+    if not os.path.exists(home_dir):
+        logging.warning("Stopping nearup...")
+        stop_nearup(keep_watcher=keep_watcher, pid_file=instance.pid_file)
+
+        logging.warning("Starting nearup...")
+        setup_and_run(binary_path='',
+                      home_dir=home_dir,
+                      chain_id=net,
+                      boot_nodes='',
+                      verbose=verbose,
+                      watcher=not keep_watcher,
+                      metadata=metadata,
+                      instance=instance)
+        logging.info("Nearup has been restarted...")
+        return
+
+    logging.warning("Staging the new release...")
+    binary_path, staged = stage_release(net, home_dir, uname, metadata)
 
-    logging.warning("Starting nearup...")
-    setup_and_run(binary_path='',
-                  home_dir=home_dir,
-                  chain_id=net,
-                  boot_nodes='',
-                  verbose=verbose,
-                  watcher=not keep_watcher)
+    try:
+        logging.warning("Stopping nearup...")
+        started = time.monotonic()
+        stop_nearup(keep_watcher=keep_watcher, pid_file=instance.pid_file)
+        if is_neard_running(instance.pid_file):
+            # stop_native keeps the PID file of processes which survived
+            logging.error("Unable to stop neard, not starting the new release")
+            sys.exit(1)
 
-    logging.info("Nearup has been restarted...")
+        logging.warning("Starting nearup...")
+        if staged is not None:
+            logging.info(
+                f'Update genesis config and remove stale data for {net}')
+            staged.apply(home_dir)
+        run(home_dir,
+            binary_path,
+            boot_nodes='',
+            neard_log='',
+            verbose=verbose,
+            chain_id=net,
+            watch=not keep_watcher,
+            instance=instance)
+    finally:
+        if staged is not None:
+            staged.cleanup()
 
+    logging.info(
+        f"Nearup has been restarted, the node was down for {time.monotonic() - started:.1f}s"
+    )
+
+
+def restart_neard(net, home_dir, verbose=False, instance=None):
+    """Restart the official neard of net on the binary it has, e.g. after it
+    crashed.
+
+    Unlike restart_nearup this needs no release metadata, so it works while
+    S3 can't be reached. New releases are left to the release checks.
+    """
+    instance = instance or node_instance()
+    binary_path = os.path.join(BINARIES_FOLDER, net)
+    if not os.path.exists(os.path.join(binary_path, 'neard')) or \
+            not os.path.exists(home_dir):
+        restart_nearup(net,
+                       home_dir=home_dir,
+                       verbose=verbose,
+                       restart_only_new_version=False,
+                       instance=instance)
+        return
+
+    logging.warning("Restarting neard...")
+    stop_native(pid_file=instance.pid_file)
+    if is_neard_running(instance.pid_file):
+        logging.error("Unable to stop neard, not starting it again")
+        sys.exit(1)
+    run(home_dir,
+        binary_path,
+        boot_nodes='',
+        neard_log='',
+        verbose=verbose,
+        chain_id=net,
+        instance=instance)
+
+
+def stop_processes(processes, timeout=DEFAULT_WAIT_TIMEOUT):
+    """Stop processes together within one overall timeout.
+
+    Every process is sent SIGTERM at once and they are waited for together.
+    Processes still running near the end of the timeout are killed, and the
+    rest of it is spent waiting for them to go. Returns the processes which
+    survived even that.
+    """
+    import psutil
+
+    started = time.monotonic()
+    deadline = started + timeout
+    # the part of the timeout kept for the processes to die after SIGKILL
+    kill_grace = min(1, timeout / 10)
+
+    def exited(process):
+        logging.info(f"Process {process.pid} exited after "
+                     f"{time.monotonic() - started:.1f}s")
+
+    for process in processes:
+        try:
+            process.terminate()
+        except psutil.NoSuchProcess:
+            pass
+
+    _, alive = psutil.wait_procs(processes,
+                                 timeout=timeout - kill_grace,
+                                 callback=exited)
+    for process in alive:
+        logging.warning(f"Timeout expired. Killing process {process.pid}")
+        try:
+            process.kill()
+        except psutil.NoSuchProcess:
+            pass
+    _, alive = psutil.wait_procs(alive,
+                                 timeout=max(0, deadline - time.monotonic()),
+                                 callback=exited)
+    return alive
+
+
+def stop_native(timeout=DEFAULT_WAIT_TIMEOUT, pid_file=NODE_PID_FILE):
+    import psutil
 
-def stop_native(timeout=DEFAULT_WAIT_TIMEOUT):
     try:
-        if os.path.exists(NODE_PID_FILE):
-            with open(NODE_PID_FILE) as pid_file:
-                for line in pid_file.readlines():
-                    pid, proc_name, _ = line.strip().split("|")
-                    pid = int(pid)
+        if os.path.exists(pid_file):
+            with open(pid_file) as pid_fd:
+                lines = pid_fd.readlines()
+            # Move the PID file aside before stopping anything, so that a
+            # watcher seeing the processes exit does not take it for a crash.
+            # It is only deleted once they are all gone.
+            stopping = f'{pid_file}.stopping'
+            os.replace(pid_file, stopping)
+
+            processes = []
+            for line in lines:
+                pid, proc_name, _ = line.strip().split("|")
+                pid = int(pid)
+                logging.info(f"Near procces is {proc_name} with pid: {pid}...")
+                try:
                     process = psutil.Process(pid)
-                    logging.info(
-                        f"Near procces is {proc_name} with pid: {pid}...")
-
-                    if proc_name in proc_name_from_pid(pid):
+                    if proc_name in process.name():
                         logging.info(
                             f"Stopping process {proc_name} with pid {pid}...")
-                        try:
-                            process.terminate()
-                            process.wait(timeout=timeout)
-                        except psutil.TimeoutExpired:
-                            logging.warning(
-                                f"Timeout expired. Killing process {pid}")
-                            process.kill()
-
-            os.remove(NODE_PID_FILE)
+                        processes.append(process)
+                except psutil.NoSuchProcess:
+                    logging.info(f"Process {pid} is not running")
+
+            alive = stop_processes(processes, timeout)
+            if alive:
+                logging.error(
+                    f"Unable to stop processes "
+                    f"{', '.join(str(process.pid) for process in alive)}")
+                os.replace(stopping, pid_file)
+            else:
+                os.remove(stopping)
         else:
             logging.info("Near deamon is not running...")
     except Exception as ex:
         logging.error(f"There was an error while stopping watcher: {ex}")
-        if os.path.exists(NODE_PID_FILE):
-            os.remove(NODE_PID_FILE)
-
-
-def is_neard_zombie():
-    if not is_neard_running():
-        return False
-    with open(NODE_PID_FILE) as pid_file:
-        for line in pid_file.readlines():
+        # keep the PID file while the processes may still be running
+        if os.path.exists(f'{pid_file}.stopping'):
+            os.replace(f'{pid_file}.stopping', pid_file)
+
+
+class NeardMonitor:
+    """Tracks the liveness of the processes listed in a node PID file.
+
+    psutil handles (and pidfds where the platform has them) are kept across
+    checks and only rebuilt when the PID file changes, so a check is cheap
+    and an exit can be waited for instead of polled.
+    """
+
+    def __init__(self, pid_file=NODE_PID_FILE):
+        self.pid_file = pid_file
+        self._pid_file_stat = None
+        self._processes = []
+        self._pidfds = []
+
+    @property
+    def processes(self):
+        """psutil handles of the processes, None for those already gone."""
+        return list(self._processes)
+
+    @property
+    def pidfds(self):
+        """pidfds of the processes, where the platform has them."""
+        return list(self._pidfds)
+
+    def close(self):
+        for pidfd in self._pidfds:
+            os.close(pidfd)
+        self._pidfds = []
+        self._processes = []
+        self._pid_file_stat = None
+
+    def _load(self, lines):
+        import psutil
+
+        for line in lines:
             pid, proc_name, _ = line.strip().split("|")
             pid = int(pid)
             try:
                 process = psutil.Process(pid)
-                logging.info(f"Near procces is {proc_name} with pid: {pid}...")
                 if proc_name not in process.name():
-                    return True
-                if process.status() in [
+                    process = None
+            except psutil.NoSuchProcess:
+                process = None
+            self._processes.append(process)
+
+            if process is not None and hasattr(os, 'pidfd_open'):
+                try:
+                    self._pidfds.append(os.pidfd_open(pid))
+                except OSError:
+                    pass
+
+    def refresh(self):
+        """Reload the PID file if it changed. Returns False if there is none."""
+        try:
+            stat = os.stat(self.pid_file)
+            with open(self.pid_file) as pid_file:
+                lines = pid_file.readlines()
+        except FileNotFoundError:
+            self.close()
+            return False
+
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if key != self._pid_file_stat:
+            self.close()
+            self._pid_file_stat = key
+            self._load(lines)
+        return True
+
+    def is_zombie(self):
+        import psutil
+
+        if not self.refresh():
+            return False
+
+        for process in self._processes:
+            if process is None:
+                return True
+            try:
+                if not process.is_running() or process.status() in [
                         psutil.STATUS_ZOMBIE, psutil.STATUS_DEAD
                 ]:
                     return True
             except psutil.NoSuchProcess:
                 return True
-    return False
+        return False
+
+    def wait_for_exit(self, timeout):
+        """Wait up to timeout seconds for a node process to exit.
+
+        Returns True as soon as one of the processes is gone, False if they
+        are all still running (or no node is running) after timeout.
+        """
+        return NeardMonitor.wait_for_any_exit([self], timeout)
+
+    @staticmethod
+    def wait_for_any_exit(monitors, timeout):
+        """wait_for_exit for the nodes of several monitors."""
+        import psutil
+
+        monitors = [
+            monitor for monitor in monitors
+            if monitor.refresh() and monitor.processes
+        ]
+        if not monitors:
+            time.sleep(timeout)
+            return False
+        if any(monitor.is_zombie() for monitor in monitors):
+            return True
+
+        processes = [
+            process for monitor in monitors for process in monitor.processes
+        ]
+        pidfds = [pidfd for monitor in monitors for pidfd in monitor.pidfds]
+        if len(pidfds) == len(processes):
+            readable, _, _ = select.select(pidfds, [], [], timeout)
+            return bool(readable)
+
+        # psutil.wait_procs only returns once every process is gone, so wait
+        # in short slices to notice the first exit.
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            gone, _ = psutil.wait_procs(processes, timeout=min(remaining, 0.5))
+            if gone:
+                return True
+
+
+def is_neard_zombie():
+    monitor = NeardMonitor()
+    try:
+        return monitor.is_zombie()
+    finally:
+        monitor.close()
@@ -0,0 +1,324 @@
+"""`nearup run localnet --orchestrate`: run every localnet node from one
+asyncio event loop.
+
+The orchestrator stays in the foreground as the parent of all the nodes. It
+drains their output into per-node rotating logs, restarts nodes which exit
+and keeps an aggregated status next to the localnet manifest. Nodes cost a
+few coroutines each, not threads, so a single process handles a hundred of
+them. Its own PID is the one in the localnet PID file, so `nearup stop`
+stops it and it stops the nodes on its way out.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from nearuplib.constants import (LOCALNET_STATUS, ORCHESTRATOR_STATUS_INTERVAL,
+                                 SUPERVISOR_STOP_TIMEOUT)
+from nearuplib.logrotate import READ_SIZE, RotatingLogWriter
+from nearuplib.nodeconfig import write_json_atomic
+from nearuplib.nodelib import neard_command, proc_name_from_pid
+from nearuplib.supervisor import RestartBackoff
+
+
+async def probe_status(port, timeout=2):
+    """Whether the node serves /status on port, without blocking the loop."""
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection('127.0.0.1', port), timeout)
+    except (asyncio.TimeoutError, OSError):
+        return False
+    try:
+        writer.write(b'GET /status HTTP/1.0\r\nHost: 127.0.0.1\r\n\r\n')
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        parts = status_line.split()
+        return len(parts) > 1 and parts[1] == b'200'
+    except (asyncio.TimeoutError, OSError):
+        return False
+    finally:
+        writer.close()
+
+
+class Node:
+    """One localnet node and what the orchestrator knows about it."""
+
+    def __init__(self, index, home, rpc_port, boot_nodes, logname, backoff):
+        self.index = index
+        self.home = home
+        self.rpc_port = rpc_port
+        self.boot_nodes = boot_nodes
+        self.logname = logname
+        self.backoff = backoff
+        self.proc = None
+        self.state = 'starting'
+        self.ready = False
+        self.starts = 0
+        self.last_exit_code = None
+        self.started_at = None
+
+    def status(self, now):
+        return {
+            'node':
+                self.index,
+            'home':
+                self.home,
+            'pid':
+                self.proc.pid if self.proc is not None else None,
+            'state':
+                self.state,
+            'ready':
+                self.ready,
+            'rpc_port':
+                self.rpc_port,
+            'starts':
+                self.starts,
+            'restarts':
+                max(self.starts - 1, 0),
+            'last_exit_code':
+                self.last_exit_code,
+            'uptime':
+                round(now -
+                      self.started_at, 1) if self.proc is not None else None,
+        }
+
+
+class Orchestrator:
+
+    def __init__(self,
+                 binary_path,
+                 localnet,
+                 verbose=False,
+                 backoff_factory=RestartBackoff,
+                 status_interval=ORCHESTRATOR_STATUS_INTERVAL,
+                 stop_timeout=SUPERVISOR_STOP_TIMEOUT):
+        self.binary_path = binary_path
+        self.localnet = localnet
+        self.verbose = verbose
+        self.status_interval = status_interval
+        self.stop_timeout = stop_timeout
+        self.status_path = os.path.join(localnet.home, LOCALNET_STATUS)
+        self.nodes = [
+            Node(i, node_dir, localnet.rpc_ports[i], localnet.boot_nodes(i),
+                 os.path.join(localnet.instance.logs_folder, f'node{i}.log'),
+                 backoff_factory())
+            for i, node_dir in enumerate(localnet.node_dirs)
+        ]
+        self._stopping = None
+        self._all_ready = False
+        # one thread compresses rotated segments for all the nodes
+        self._compressor = ThreadPoolExecutor(max_workers=1)
+        # and another one does their log writes and rotations, which block on
+        # the disk and would stall every node if done in the event loop
+        self._log_io = ThreadPoolExecutor(max_workers=1)
+
+    async def _drain(self, stream, writer):
+        loop = asyncio.get_event_loop()
+        while True:
+            data = await stream.read(READ_SIZE)
+            if not data:
+                return
+            # the node's output is not read further until the write is done,
+            # so a slow disk holds back its pipe instead of filling memory
+            await loop.run_in_executor(self._log_io, writer.write, data)
+
+    async def _run_node(self, node, writer):
+        command, env = neard_command(self.binary_path,
+                                     node.home,
+                                     'run',
+                                     verbose=self.verbose,
+                                     boot_nodes=node.boot_nodes)
+        while not self._stopping.is_set():
+            node.proc = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                env=env,
+                # ^C in the terminal is for the orchestrator, which stops the
+                # nodes itself
+                start_new_session=True)
+            node.starts += 1
+            node.started_at = time.monotonic()
+            node.state = 'running'
+            if self._stopping.is_set():
+                # the stop came while the node was being spawned
+                node.proc.terminate()
+
+            await self._drain(node.proc.stdout, writer)
+            code = await node.proc.wait()
+            uptime = time.monotonic() - node.started_at
+            node.proc = None
+            node.ready = False
+            node.last_exit_code = code
+            if self._stopping.is_set():
+                break
+
+            delay = node.backoff.next_delay(uptime)
+            node.state = 'backoff'
+            logging.warning(f'node{node.index} exited with code {code} after '
+                            f'{uptime:.1f}s, restarting it in {delay:.1f}s')
+            try:
+                await asyncio.wait_for(self._stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        node.state = 'stopped'
+
+    async def _supervise_node(self, node):
+        loop = asyncio.get_event_loop()
+        writer = await loop.run_in_executor(
+            self._log_io,
+            lambda: RotatingLogWriter(node.logname, executor=self._compressor))
+        try:
+            await self._run_node(node, writer)
+        finally:
+            await loop.run_in_executor(self._log_io, writer.close)
+
+    async def _probe(self, node):
+        proc = node.proc
+        if proc is None:
+            return
+        ready = await probe_status(node.rpc_port)
+        # the node may have exited while it was probed
+        if node.proc is proc:
+            node.ready = ready
+            node.state = 'ready' if ready else 'running'
+
+    def status(self):
+        now = time.monotonic()
+        nodes = [node.status(now) for node in self.nodes]
+        return {
+            'pid': os.getpid(),
+            'updated': time.time(),
+            'num_nodes': len(nodes),
+            'ready': sum(1 for node in nodes if node['ready']),
+            'restarts': sum(node['restarts'] for node in nodes),
+            'nodes': nodes,
+        }
+
+    def write_status(self):
+        write_json_atomic(self.status_path, self.status())
+
+    async def _report(self):
+        while True:
+            await asyncio.gather(*(self._probe(node) for node in self.nodes))
+            self.write_status()
+            if not self._all_ready and all(node.ready for node in self.nodes):
+                self._all_ready = True
+                logging.info(f'All {len(self.nodes)} localnet nodes are ready')
+            try:
+                await asyncio.wait_for(self._stopping.wait(),
+                                       self.status_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+    async def _stop_nodes(self):
+        procs = [node.proc for node in self.nodes if node.proc is not None]
+        for proc in procs:
+            try:
+                proc.terminate()
+            except ProcessLookupError:
+                pass
+        if not procs:
+            return
+        _, pending = await asyncio.wait(
+            [asyncio.ensure_future(proc.wait()) for proc in procs],
+            timeout=self.stop_timeout)
+        if pending:
+            logging.warning(f'Killing {len(pending)} nodes which did not stop '
+                            f'in {self.stop_timeout}s')
+            for proc in procs:
+                if proc.returncode is None:
+                    try:
+                        proc.kill()
+                    except ProcessLookupError:
+                        pass
+
+    def request_stop(self):
+        if not self._stopping.is_set():
+            logging.info('Stopping localnet nodes...')
+            self._stopping.set()
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self._stopping = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.request_stop)
+
+        shutil.rmtree(self.localnet.instance.logs_folder, ignore_errors=True)
+        os.makedirs(self.localnet.instance.logs_folder)
+
+        tasks = [
+            asyncio.ensure_future(self._supervise_node(node))
+            for node in self.nodes
+        ]
+        reporter = asyncio.ensure_future(self._report())
+        logging.info(f'Started {len(self.nodes)} localnet nodes, status in '
+                     f'{self.status_path}')
+        stopped = asyncio.ensure_future(self._stopping.wait())
+        try:
+            # the node tasks only end early if they fail, e.g. when neard
+            # cannot be executed, and then the whole localnet is stopped
+            await asyncio.wait([stopped, reporter] + tasks,
+                               return_when=asyncio.FIRST_COMPLETED)
+            self._stopping.set()
+            await self._stop_nodes()
+            results = await asyncio.gather(stopped,
+                                           reporter,
+                                           *tasks,
+                                           return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        finally:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(signum)
+            self._log_io.shutdown(wait=True)
+            self._compressor.shutdown(wait=True)
+            self.write_status()
+
+
+def watch_children_with_pidfds(loop):
+    """Wait for the nodes through pidfds where asyncio does not by default.
+
+    Before Python 3.12, asyncio waits for every child from a thread of its
+    own, which is a thread per node.
+    """
+    if (sys.version_info < (3, 12) and hasattr(asyncio, 'PidfdChildWatcher') and
+            hasattr(os, 'pidfd_open')):
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except OSError:
+            # the kernel is older than 5.3
+            return
+        watcher = asyncio.PidfdChildWatcher()
+        watcher.attach_loop(loop)
+        asyncio.set_child_watcher(watcher)
+
+
+def orchestrate(binary_path, localnet, verbose=False, **kwargs):
+    """Run the localnet in the foreground until it is stopped."""
+    instance = localnet.instance
+    os.makedirs(os.path.dirname(instance.pid_file), exist_ok=True)
+    with open(instance.pid_file, 'w') as pid_fd:
+        pid_fd.write(f'{os.getpid()}|{proc_name_from_pid(os.getpid())}'
+                     '|localnet\n')
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    watch_children_with_pidfds(loop)
+    try:
+        loop.run_until_complete(
+            Orchestrator(binary_path, localnet, verbose, **kwargs).run())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+        try:
+            os.remove(instance.pid_file)
+        except FileNotFoundError:
+            pass
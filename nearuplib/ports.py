@@ -0,0 +1,101 @@
+import contextlib
+import fcntl
+import json
+import os
+import socket
+import time
+
+from nearuplib.constants import PORTS_REGISTRY, PORTS_RESERVATION_TIMEOUT
+
+
+def port_free(port, host='0.0.0.0'):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind((host, port))
+        except OSError:
+            return False
+        return True
+
+
+def find_free_range(count, start, reserved=(), limit=65535):
+    """First range of count consecutive free ports starting at or after start."""
+    base = start
+    while base + count - 1 <= limit:
+        for port in range(base, base + count):
+            if port in reserved or not port_free(port):
+                base = port + 1
+                break
+        else:
+            return list(range(base, base + count))
+    raise RuntimeError(f'No {count} consecutive free ports above {start}')
+
+
+@contextlib.contextmanager
+def locked_registry(path=PORTS_REGISTRY):
+    """Yield the port registry, holding an exclusive lock on it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.lock', 'w') as lock_fd:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            with open(path) as registry_fd:
+                registry = json.load(registry_fd)
+        except (FileNotFoundError, ValueError):
+            registry = {}
+
+        yield registry
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as registry_fd:
+            json.dump(registry, registry_fd, indent=2)
+        os.replace(tmp_path, path)
+
+
+def read_registry(path=PORTS_REGISTRY):
+    """Read the registry under a shared lock, without rewriting it."""
+    try:
+        lock_fd = open(f'{path}.lock', 'a')
+    except FileNotFoundError:
+        # nothing was ever registered
+        return {}
+    with lock_fd:
+        fcntl.flock(lock_fd, fcntl.LOCK_SH)
+        try:
+            with open(path) as registry_fd:
+                return json.load(registry_fd)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+
+def _live(entry, now):
+    return os.path.exists(entry['pid_file']) or (now - entry['reserved_at']
+                                                 < PORTS_RESERVATION_TIMEOUT)
+
+
+def allocate_ports(name, pid_file, ranges, registry_path=PORTS_REGISTRY):
+    """Reserve a range of free ports for each (count, start) in ranges.
+
+    Ports held by other localnets in the registry are skipped even if
+    their nodes have not bound them yet. A reservation is dropped once its
+    PID file is gone, i.e. once its localnet is stopped.
+    """
+    now = time.time()
+    with locked_registry(registry_path) as registry:
+        for other in list(registry):
+            if other == name or not _live(registry[other], now):
+                del registry[other]
+
+        reserved = {
+            port for entry in registry.values() for port in entry['ports']
+        }
+        allocated = []
+        for count, start in ranges:
+            ports = find_free_range(count, start, reserved)
+            reserved.update(ports)
+            allocated.append(ports)
+
+        registry[name] = {
+            'pid_file': pid_file,
+            'reserved_at': now,
+            'ports': [port for ports in allocated for port in ports],
+        }
+    return allocated
@@ -0,0 +1,73 @@
+import random
+import time
+
+from nearuplib.constants import (WATCHER_FAST_POLL_INTERVAL,
+                                 WATCHER_FAST_POLL_WINDOW, WATCHER_MAX_BACKOFF,
+                                 WATCHER_POLL_INTERVAL, WATCHER_POLL_JITTER)
+
+
+class PollScheduler:
+    """Decides how long the watcher sleeps between two polls.
+
+    The delay is the base interval with random jitter, so that nodes started
+    together do not poll in lockstep. Consecutive network errors back off
+    exponentially up to max_backoff. For fast_window seconds after a new
+    release has been seen whose binary or genesis is not published yet, the
+    watcher polls every fast_interval to pick it up as soon as it is.
+    """
+
+    def __init__(self,
+                 interval=WATCHER_POLL_INTERVAL,
+                 jitter=WATCHER_POLL_JITTER,
+                 max_backoff=WATCHER_MAX_BACKOFF,
+                 fast_interval=WATCHER_FAST_POLL_INTERVAL,
+                 fast_window=WATCHER_FAST_POLL_WINDOW,
+                 clock=time.monotonic,
+                 rand=random.random):
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max(max_backoff, interval)
+        self.fast_interval = min(fast_interval, interval)
+        self.fast_window = fast_window
+        self.errors = 0
+        self.fast_until = None
+        self._announced = None
+        self._clock = clock
+        self._rand = rand
+
+    def base_delay(self):
+        if self.errors:
+            # the exponent is capped so a long outage can't overflow it
+            return min(self.interval * 2**min(self.errors, 30),
+                       self.max_backoff)
+        if self.fast_until is not None and self._clock() < self.fast_until:
+            return self.fast_interval
+        return self.interval
+
+    def next_delay(self):
+        spread = self.jitter * (2 * self._rand() - 1)
+        return max(0, self.base_delay() * (1 + spread))
+
+    def record_success(self):
+        self.errors = 0
+
+    def record_error(self):
+        self.errors += 1
+
+    def release_announced(self, release=None):
+        """A new release was seen but can't be applied yet.
+
+        The fast window starts when a release is first seen, polls seeing the
+        same one again don't extend it.
+        """
+        if release is not None and release == self._announced:
+            return
+        self._announced = release
+        self.fast_until = self._clock() + self.fast_window
+
+    def release_applied(self):
+        self._announced = None
+        self.fast_until = None
+
+    def wait(self):
+        time.sleep(self.next_delay())
@@ -0,0 +1,250 @@
+"""Snapshots of localnet home dirs.
+
+`nearup localnet snapshot <name>` copies a stopped localnet (configs, keys
+and chain data) to ~/.nearup/snapshots/<name>, and
+`nearup run localnet --from-snapshot <name>` copies it back, so a test run
+starts from a chain at the height it had instead of from genesis.
+
+Copies are reflinks where the filesystem has them (btrfs, XFS, APFS), which
+share the data until either side changes it. Elsewhere RocksDB .sst files,
+which are never modified once written, are hardlinked, and everything else
+is copied from several threads.
+"""
+import errno
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from nearuplib import trash
+from nearuplib.constants import (LOCALNET_MANIFEST, LOCALNET_STATUS,
+                                 SNAPSHOT_COPY_WORKERS, SNAPSHOTS_FOLDER)
+from nearuplib.instance import localnet_instance
+from nearuplib.nodeconfig import discover_node_dirs, write_json_atomic
+
+SNAPSHOT_METADATA = 'nearup_snapshot.json'
+# state of a running localnet, which does not belong in a snapshot
+EXCLUDED = frozenset({LOCALNET_MANIFEST, LOCALNET_STATUS, SNAPSHOT_METADATA})
+
+_FICLONE = 0x40049409
+_NAME = re.compile(r'[A-Za-z0-9][A-Za-z0-9_.-]*')
+# errors meaning that a way of copying can't work for this pair of dirs
+_UNSUPPORTED = frozenset({
+    errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+    errno.EPERM, errno.EMLINK
+})
+
+
+def _reflink(src, dst):
+    if sys.platform.startswith('linux'):
+        import fcntl
+
+        with open(src, 'rb') as src_fd, open(dst, 'wb') as dst_fd:
+            fcntl.ioctl(dst_fd.fileno(), _FICLONE, src_fd.fileno())
+    elif sys.platform == 'darwin':
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0):
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), dst)
+    else:
+        raise OSError(errno.EOPNOTSUPP, 'reflinks are not supported', dst)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class TreeCopier:
+    """Copies directory trees with the cheapest method that works.
+
+    A method which fails as unsupported once is not tried again.
+    """
+
+    def __init__(self, workers=SNAPSHOT_COPY_WORKERS):
+        self.workers = workers
+        self.reflink = True
+        self.hardlink = True
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, method):
+        with self._lock:
+            self.counts[method] += 1
+
+    def copy_file(self, src, dst):
+        if self.reflink:
+            try:
+                _reflink(src, dst)
+                shutil.copystat(src, dst)
+                self._count('cloned')
+                return
+            except OSError as ex:
+                _remove(dst)
+                if ex.errno not in _UNSUPPORTED:
+                    raise
+                self.reflink = False
+
+        if self.hardlink and src.endswith('.sst'):
+            try:
+                os.link(src, dst)
+                self._count('linked')
+                return
+            except OSError as ex:
+                if ex.errno not in _UNSUPPORTED:
+                    raise
+                self.hardlink = False
+
+        shutil.copy2(src, dst)
+        self._count('copied')
+
+    def copy_tree(self, src, dst, exclude=()):
+        """Copy src to dst, which must not exist, skipping the top-level
+        names in exclude."""
+        files = []
+        directories = []
+        for root, dirs, names in os.walk(src):
+            target = os.path.join(dst, os.path.relpath(root, src))
+            os.makedirs(target)
+            directories.append((root, target))
+            if root == src:
+                dirs[:] = [name for name in dirs if name not in exclude]
+                names = [name for name in names if name not in exclude]
+            # os.walk lists symlinks to directories in dirs without entering
+            # them, they are recreated as symlinks like the others
+            for name in dirs + names:
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    os.symlink(os.readlink(path), os.path.join(target, name))
+                elif name in names:
+                    files.append((path, os.path.join(target, name)))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in executor.map(lambda item: self.copy_file(*item), files):
+                pass
+        for root, target in directories:
+            shutil.copystat(root, target)
+
+    def summary(self):
+        return ', '.join(f'{count} {method}'
+                         for method, count in sorted(self.counts.items()))
+
+
+def snapshot_path(name, snapshots_folder=SNAPSHOTS_FOLDER):
+    if not _NAME.fullmatch(name) or trash.TRASH_SUFFIX in name:
+        raise ValueError(f'invalid snapshot name {name!r}, use letters, '
+                         'digits, ".", "_" and "-"')
+    return os.path.join(snapshots_folder, name)
+
+
+def _copy_atomically(src, dst, exclude=(), metadata=None):
+    """Copy src next to dst and rename it into place once complete."""
+    parent = os.path.dirname(os.path.abspath(dst))
+    os.makedirs(parent, exist_ok=True)
+    tmp = os.path.join(parent, f'.{os.path.basename(dst)}.{os.getpid()}.tmp')
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+
+    copier = TreeCopier()
+    started = time.monotonic()
+    try:
+        copier.copy_tree(src, tmp, exclude)
+        if metadata is not None:
+            write_json_atomic(os.path.join(tmp, SNAPSHOT_METADATA), metadata)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    os.rename(tmp, dst)
+    logging.info(f'Copied {src} to {dst} in '
+                 f'{time.monotonic() - started:.1f}s ({copier.summary()})')
+
+
+def create_snapshot(home, name, force=False, snapshots_folder=SNAPSHOTS_FOLDER):
+    home = os.path.abspath(home)
+    try:
+        path = snapshot_path(name, snapshots_folder)
+    except ValueError as ex:
+        logging.error(ex)
+        sys.exit(1)
+    if not os.path.isdir(home) or not discover_node_dirs(home):
+        logging.error(f'There is no localnet in {home}')
+        sys.exit(1)
+    if os.path.exists(localnet_instance(home).pid_file):
+        logging.error('The localnet is running, stop it with `nearup stop` '
+                      'before taking a snapshot')
+        sys.exit(1)
+    if os.path.exists(path):
+        if not force:
+            logging.error(f'Snapshot {name} already exists, use --force to '
+                          'replace it')
+            sys.exit(1)
+        trash.trash_and_delete(path)
+
+    _copy_atomically(home,
+                     path,
+                     EXCLUDED,
+                     metadata={
+                         'name': name,
+                         'home': home,
+                         'created': time.time(),
+                         'num_nodes': len(discover_node_dirs(home)),
+                     })
+    logging.info(f'Created snapshot {name} of {home}')
+    return path
+
+
+def restore_snapshot(name, home, snapshots_folder=SNAPSHOTS_FOLDER):
+    """Replace home with a copy of the snapshot."""
+    try:
+        path = snapshot_path(name, snapshots_folder)
+    except ValueError as ex:
+        logging.error(ex)
+        sys.exit(1)
+    if not os.path.exists(os.path.join(path, SNAPSHOT_METADATA)):
+        logging.error(f'There is no snapshot {name} in {snapshots_folder}')
+        sys.exit(1)
+
+    if os.path.exists(home):
+        logging.info(f'Replacing {home} with snapshot {name}')
+        trash.trash_and_delete(home)
+    _copy_atomically(path, home, EXCLUDED)
+
+
+def list_snapshots(snapshots_folder=SNAPSHOTS_FOLDER):
+    """Metadata of every snapshot, ordered by name."""
+    snapshots = []
+    if not os.path.isdir(snapshots_folder):
+        return snapshots
+    for name in sorted(os.listdir(snapshots_folder)):
+        if name.startswith('.') or trash.TRASH_SUFFIX in name:
+            continue
+        try:
+            with open(os.path.join(snapshots_folder, name,
+                                   SNAPSHOT_METADATA)) as metadata_fd:
+                snapshots.append(json.load(metadata_fd))
+        except (OSError, ValueError):
+            pass
+    return snapshots
+
+
+def delete_snapshot(name, snapshots_folder=SNAPSHOTS_FOLDER):
+    try:
+        path = snapshot_path(name, snapshots_folder)
+    except ValueError as ex:
+        logging.error(ex)
+        sys.exit(1)
+    if not os.path.exists(path):
+        logging.error(f'There is no snapshot {name} in {snapshots_folder}')
+        sys.exit(1)
+    trash.trash_and_delete(path)
@@ -0,0 +1,301 @@
+"""`nearup supervise`: run neard as a child of a long-lived nearup process.
+
+The supervisor takes the place of both `nearup run` and the watcher. It
+restarts neard as soon as SIGCHLD reports that it exited, backing off when
+it keeps crashing, and checks for new releases on the watcher's schedule.
+Its PID is kept in the watcher PID file, so `nearup stop` stops it, and it
+stops neard on its way out.
+"""
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+from nearuplib.constants import (LOGS_FOLDER, NODE_PID_FILE,
+                                 SUPERVISOR_MAX_RESTART_BACKOFF,
+                                 SUPERVISOR_RESTART_BACKOFF,
+                                 SUPERVISOR_STABLE_PERIOD,
+                                 SUPERVISOR_STOP_TIMEOUT, WATCHER_PID_FILE)
+from nearuplib.exceptions import NetworkError
+from nearuplib.nodelib import (is_neard_running, proc_name_from_pid, run_binary,
+                               setup_node, stage_release, stop_processes)
+from nearuplib.scheduler import PollScheduler
+from nearuplib.util import (fetch_release_metadata, new_release_ready,
+                            read_genesis_md5sum)
+from nearuplib.watcher import is_watcher_running
+
+
+class RestartBackoff:
+    """Delay before restarting a node which exited.
+
+    The delay doubles with every exit up to max_delay, and is reset once
+    the node has run for stable_period seconds.
+    """
+
+    def __init__(self,
+                 delay=SUPERVISOR_RESTART_BACKOFF,
+                 max_delay=SUPERVISOR_MAX_RESTART_BACKOFF,
+                 stable_period=SUPERVISOR_STABLE_PERIOD):
+        self.delay = delay
+        self.max_delay = max(max_delay, delay)
+        self.stable_period = stable_period
+        self.failures = 0
+
+    def next_delay(self, uptime):
+        if uptime >= self.stable_period:
+            self.failures = 0
+        delay = min(self.delay * 2**self.failures, self.max_delay)
+        self.failures += 1
+        return delay
+
+
+class Supervisor:
+
+    def __init__(self,
+                 chain_id,
+                 home_dir,
+                 binary_path,
+                 boot_nodes='',
+                 verbose=False,
+                 official_binary=True,
+                 scheduler=None,
+                 backoff=None,
+                 pid_file=NODE_PID_FILE,
+                 logs_folder=LOGS_FOLDER,
+                 metadata=None):
+        self.chain_id = chain_id
+        self.home_dir = home_dir
+        self.binary_path = binary_path
+        self.boot_nodes = boot_nodes
+        self.verbose = verbose
+        self.official_binary = official_binary
+        self.scheduler = scheduler or PollScheduler()
+        self.backoff = backoff or RestartBackoff()
+        self.pid_file = pid_file
+        self.logs_folder = logs_folder
+
+        self.proc = None
+        self.starts = 0
+        self._started_at = None
+        self._restart_at = None
+        self._check_at = None
+        self._stopping = False
+        self._wakeup = None
+        self._handlers = {}
+        # the release neard was set up with, if it is known
+        self._commit = metadata.commit if metadata is not None else None
+        self._genesis_md5sum = None
+
+    def start_node(self):
+        self.proc = run_binary(os.path.join(self.binary_path, 'neard'),
+                               self.home_dir,
+                               'run',
+                               verbose=self.verbose,
+                               boot_nodes=self.boot_nodes,
+                               output=os.path.join(self.logs_folder,
+                                                   self.chain_id))
+        self.starts += 1
+        self._started_at = time.monotonic()
+        self._restart_at = None
+        with open(self.pid_file, 'w') as pid_fd:
+            pid_fd.write(f'{self.proc.pid}|{proc_name_from_pid(self.proc.pid)}'
+                         f'|{self.chain_id}')
+        logging.info(f'Started neard with pid {self.proc.pid}')
+
+    def stop_node(self, timeout=SUPERVISOR_STOP_TIMEOUT):
+        import psutil
+
+        if self.proc is None:
+            return
+        # remove the PID file first, like stop_native, so nothing mistakes
+        # the exit for a crash
+        try:
+            os.remove(self.pid_file)
+        except FileNotFoundError:
+            pass
+        if self.proc.poll() is None:
+            try:
+                stop_processes([psutil.Process(self.proc.pid)], timeout)
+            except psutil.NoSuchProcess:
+                pass
+        self.proc.wait()
+        self.proc = None
+
+    def _reap(self):
+        """Schedule a restart if neard exited."""
+        if self.proc is None or self.proc.poll() is None:
+            return
+        uptime = time.monotonic() - self._started_at
+        delay = self.backoff.next_delay(uptime)
+        logging.warning(f'neard exited with code {self.proc.returncode} after '
+                        f'{uptime:.1f}s, restarting it in {delay:.1f}s')
+        self.proc = None
+        self._restart_at = time.monotonic() + delay
+
+    def check_release(self):
+        """Upgrade neard if a new release was published."""
+        metadata = fetch_release_metadata(self.chain_id)
+        if self._commit is None:
+            # neard runs the release of the first check
+            self._commit = metadata.commit
+        if (metadata.commit == self._commit and
+                metadata.genesis_md5sums == self._genesis_md5sum):
+            return False
+
+        logging.info(f'New release {metadata.commit} has been published')
+        uname = os.uname()[0]
+        if not new_release_ready(self.chain_id, uname, metadata):
+            logging.info('The binary of the release is not uploaded yet')
+            self.scheduler.release_announced(
+                (metadata.commit, metadata.genesis_md5sums))
+            return False
+
+        binary_path, staged = stage_release(self.chain_id, self.home_dir, uname,
+                                            metadata)
+        try:
+            started = time.monotonic()
+            self.stop_node()
+            if staged is not None:
+                staged.apply(self.home_dir)
+            self.binary_path = binary_path
+            self.start_node()
+        finally:
+            if staged is not None:
+                staged.cleanup()
+        logging.info(f'Upgraded to {metadata.commit}, the node was down for '
+                     f'{time.monotonic() - started:.1f}s')
+
+        self.scheduler.release_applied()
+        self._commit = metadata.commit
+        self._genesis_md5sum = metadata.genesis_md5sums
+        return True
+
+    def _check_release(self):
+        try:
+            self.check_release()
+            self.scheduler.record_success()
+        except NetworkError as ex:
+            self.scheduler.record_error()
+            logging.warning(f'caught networking error {ex} - will try again')
+        except (Exception, SystemExit) as ex:
+            # setting up a release exits on some errors, neither may take
+            # the running node down with the supervisor
+            self.scheduler.record_error()
+            logging.error(f'Unable to upgrade neard: {ex!r} - will try again')
+            if self.proc is None and self._restart_at is None:
+                # the upgrade failed after neard was stopped, bring it back
+                self._restart_at = time.monotonic()
+        self._check_at = time.monotonic() + self.scheduler.next_delay()
+
+    def request_stop(self, *args):  # pylint: disable=W0613
+        self._stopping = True
+
+    def _install_signal_handlers(self):
+        # Signal handlers only set a flag, and the wakeup fd interrupts the
+        # wait in poll_once, so an exit of neard is handled right away.
+        reader, writer = socket.socketpair()
+        reader.setblocking(False)
+        writer.setblocking(False)
+        self._wakeup = (reader, writer)
+        signal.set_wakeup_fd(writer.fileno())
+        for signum, handler in ((signal.SIGCHLD, lambda *args: None),
+                                (signal.SIGTERM, self.request_stop),
+                                (signal.SIGINT, self.request_stop)):
+            self._handlers[signum] = signal.signal(signum, handler)
+
+    def _restore_signal_handlers(self):
+        signal.set_wakeup_fd(-1)
+        for signum, handler in self._handlers.items():
+            signal.signal(signum, handler)
+        self._handlers = {}
+        for sock in self._wakeup:
+            sock.close()
+        self._wakeup = None
+
+    def poll_once(self, max_wait=None):
+        """Wait for a signal or the next timer, then handle what is due."""
+        now = time.monotonic()
+        deadlines = [
+            deadline for deadline in (self._restart_at, self._check_at)
+            if deadline is not None
+        ]
+        timeout = max(0, min(deadlines) - now) if deadlines else None
+        if max_wait is not None:
+            timeout = max_wait if timeout is None else min(timeout, max_wait)
+
+        if self._wakeup is not None:
+            if select.select([self._wakeup[0]], [], [], timeout)[0]:
+                try:
+                    while self._wakeup[0].recv(64):
+                        pass
+                except BlockingIOError:
+                    pass
+        elif timeout:
+            time.sleep(timeout)
+
+        if self._stopping:
+            return
+        self._reap()
+        now = time.monotonic()
+        if self._restart_at is not None and now >= self._restart_at:
+            self.start_node()
+        if self._check_at is not None and now >= self._check_at:
+            self._check_release()
+
+    def run(self):
+        self._install_signal_handlers()
+        try:
+            self.start_node()
+            if self.official_binary:
+                # releases are only fetched by the checks, which back off
+                # when that fails
+                self._genesis_md5sum = read_genesis_md5sum(self.home_dir)
+                self._check_at = time.monotonic() + self.scheduler.next_delay()
+            while not self._stopping:
+                self.poll_once()
+        finally:
+            logging.info('Stopping neard...')
+            self.stop_node()
+            self._restore_signal_handlers()
+
+
+def supervise(binary_path,
+              home_dir,
+              chain_id,
+              boot_nodes='',
+              account_id=None,
+              verbose=False,
+              scheduler=None,
+              backoff=None):
+    if is_neard_running() or is_watcher_running():
+        sys.exit(1)
+
+    official_binary = binary_path == ''
+    # fetched once for setting up and for the first release check
+    metadata = fetch_release_metadata(chain_id) if official_binary else None
+    binary_path = setup_node(binary_path,
+                             home_dir,
+                             chain_id,
+                             account_id,
+                             metadata=metadata)
+
+    with open(WATCHER_PID_FILE, 'w') as pid_fd:
+        pid_fd.write(str(os.getpid()))
+    try:
+        Supervisor(chain_id,
+                   home_dir,
+                   binary_path,
+                   boot_nodes=boot_nodes,
+                   verbose=verbose,
+                   official_binary=official_binary,
+                   scheduler=scheduler,
+                   backoff=backoff,
+                   metadata=metadata).run()
+    finally:
+        try:
+            os.remove(WATCHER_PID_FILE)
+        except FileNotFoundError:
+            pass
@@ -1,53 +1,294 @@
 import glob
 import logging
 import os
-import subprocess
+import re
+import select
 import sys
+import time
 
-from nearuplib.constants import NODE_PID_FILE
+from nearuplib.constants import LOCALNET_HOME
+from nearuplib.instance import localnet_instance, node_instance
 
+TAIL_BLOCK_SIZE = 64 * 1024
+FOLLOW_POLL_INTERVAL = 0.5
+
+
+def log_segments(logname):
+    """(index, path) of the rotated segments of logname, oldest first.
+
+    Segments are named <logname>.<index>, with a .gz or .zst suffix once
+    compressed.
+    """
+    pattern = re.compile(
+        re.escape(os.path.basename(logname)) + r'\.(\d+)(\.gz|\.zst)?')
+    segments = []
+    for path in glob.glob(f'{glob.escape(logname)}.*'):
+        match = pattern.fullmatch(os.path.basename(path))
+        if match:
+            segments.append((int(match.group(1)), path))
+    return sorted(segments)
 
-def next_logname(logname):
-    files = glob.glob(f'{logname}.*')
 
+def next_logname(logname):
+    """Name to rotate logname to, after every existing segment."""
     if not os.path.exists(logname):
         return logname
 
-    highest_index = max([1] + [int(f.split('.')[-1]) for f in files])
+    highest_index = max([0] + [index for index, _ in log_segments(logname)])
+
+    return f'{logname}.{highest_index + 1}'
+
+
+def _tail(fd, end, count, block_size=TAIL_BLOCK_SIZE):
+    """Last count lines before offset end, read backwards in blocks."""
+    if count <= 0:
+        return []
+
+    blocks = []
+    newlines = 0
+    position = end
+    # count + 1 newlines guarantee that the first of the count lines is whole
+    while position > 0 and newlines <= count:
+        size = min(block_size, position)
+        position -= size
+        fd.seek(position)
+        block = fd.read(size)
+        blocks.append(block)
+        newlines += block.count(b'\n')
+
+    lines = b''.join(reversed(blocks)).split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+    return [line.decode('utf-8', errors='replace') for line in lines[-count:]]
+
+
+def tail_lines(path, count, block_size=TAIL_BLOCK_SIZE):
+    """Last count lines of path, without reading the whole file."""
+    with open(path, 'rb') as log_fd:
+        return _tail(log_fd, log_fd.seek(0, os.SEEK_END), count, block_size)
+
+
+class LogFollower:
+    """Reads the lines appended to a log file.
+
+    A log rotated by renaming is read to its end before following the new
+    file at path, and a log truncated in place is read again from its start.
+    """
+
+    def __init__(self, path, prefix=None):
+        self.path = path
+        self.prefix = prefix
+        self._fd = None
+        self._inode = None
+        self._partial = b''
+        self._open(from_end=True)
+
+    def _open(self, from_end):
+        try:
+            self._fd = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        stat = os.fstat(self._fd.fileno())
+        self._inode = (stat.st_dev, stat.st_ino)
+        if from_end:
+            self._fd.seek(0, os.SEEK_END)
+
+    def close(self):
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def tail(self, count):
+        """Last count lines before the position the follower reads from."""
+        if self._fd is None:
+            return []
+        end = self._fd.tell()
+        lines = _tail(self._fd, end, count)
+        self._fd.seek(end)
+        return lines
+
+    def _drain(self):
+        data = self._fd.read()
+        if not data:
+            return []
+        *lines, self._partial = (self._partial + data).split(b'\n')
+        return [line.decode('utf-8', errors='replace') for line in lines]
+
+    def _flush(self):
+        lines = [self._partial.decode('utf-8', errors='replace')
+                ] if self._partial else []
+        self._partial = b''
+        return lines
+
+    def read_lines(self):
+        """Complete lines written since the previous call."""
+        if self._fd is None:
+            self._open(from_end=False)
+            if self._fd is None:
+                return []
+
+        lines = self._drain()
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return lines
+
+        if (stat.st_dev, stat.st_ino) != self._inode:
+            self.close()
+            lines += self._flush()
+            self._open(from_end=False)
+            if self._fd is not None:
+                lines += self._drain()
+        elif stat.st_size < self._fd.tell():
+            self._fd.seek(0)
+            self._partial = b''
+            lines += self._drain()
+        return lines
+
+
+class _Inotify:
+    """Wakes up on changes to the files of some directories (Linux only)."""
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+            IN_CREATE | IN_DELETE)
 
-    return f'{logname}.{highest_index}'
+    def __init__(self, directories):
+        import ctypes
+        import ctypes.util
 
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
 
-def show_logs(follow, number_lines):
-    if not os.path.exists(NODE_PID_FILE):
+        for directory in directories:
+            if libc.inotify_add_watch(self._fd, os.fsencode(directory),
+                                      self.MASK) < 0:
+                os.close(self._fd)
+                raise OSError(ctypes.get_errno(),
+                              f'unable to watch {directory}')
+
+    def wait(self, timeout):
+        if select.select([self._fd], [], [], timeout)[0]:
+            try:
+                while os.read(self._fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _Poller:
+
+    def __init__(self, interval):
+        self._interval = interval
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self._interval))
+
+    def close(self):
+        pass
+
+
+def change_waiter(paths, poll_interval=FOLLOW_POLL_INTERVAL):
+    """Something to wait on for changes of paths: inotify, else polling."""
+    if sys.platform.startswith('linux'):
+        try:
+            return _Inotify(
+                sorted({os.path.dirname(os.path.abspath(p)) for p in paths}))
+        except (OSError, AttributeError, TypeError) as ex:
+            logging.debug(f'inotify is unavailable, polling instead: {ex}')
+    return _Poller(poll_interval)
+
+
+def follow_lines(followers, waiter, timeout=1):
+    """Yield (prefix, line) for every line appended to the logs, forever."""
+    while True:
+        for follower in followers:
+            for line in follower.read_lines():
+                yield follower.prefix, line
+        waiter.wait(timeout)
+
+
+def format_line(prefix, line):
+    return f'{prefix} | {line}' if prefix else line
+
+
+def localnet_logs(logs_folder):
+    """(prefix, path) of the node logs of a localnet, in node order."""
+    paths = glob.glob(os.path.join(glob.escape(logs_folder), 'node*.log'))
+    sources = []
+    for path in paths:
+        match = re.fullmatch(r'node(\d+)\.log', os.path.basename(path))
+        if match:
+            sources.append((int(match.group(1)), path))
+    return [(f'node{i}', path) for i, path in sorted(sources)]
+
+
+def print_logs(sources, number_lines, follow, output=sys.stdout):
+    followers = [LogFollower(path, prefix) for prefix, path in sources]
+    try:
+        for follower in followers:
+            for line in follower.tail(number_lines):
+                print(format_line(follower.prefix, line), file=output)
+        output.flush()
+
+        if not follow:
+            return
+
+        waiter = change_waiter([path for _, path in sources])
+        try:
+            for prefix, line in follow_lines(followers, waiter):
+                print(format_line(prefix, line), file=output, flush=True)
+        finally:
+            waiter.close()
+    finally:
+        for follower in followers:
+            follower.close()
+
+
+def log_sources(home=None):
+    """(prefix, path) of the logs of the running node, or of the localnet or
+    fleet node running from home."""
+    instance = localnet_instance(home or LOCALNET_HOME)
+    node = node_instance(home)
+    pid_file = instance.pid_file if home else node.pid_file
+    if home and os.path.exists(node.pid_file):
+        pid_file = node.pid_file
+    if not os.path.exists(pid_file):
         logging.info('Node is not running')
         sys.exit(1)
 
-    with open(NODE_PID_FILE) as pid_file:
-        pid_info = pid_file.readline()
+    with open(pid_file) as pid_fd:
+        pid_info = pid_fd.readline()
 
     logging.info(pid_info)
     _, _, network = pid_info.strip().split("|")
 
     if network == "localnet":
-        # TODO: localnet could have several logs, not showing them all but list log files here
-        # Maybe better to support `nearup logs node0` usage.
-        logging.info(
-            'You are running local net. Logs are in: ~/.nearup/logs/localnet/')
-        sys.exit(0)
+        sources = localnet_logs(instance.logs_folder)
+        if not sources:
+            logging.error(f'No localnet logs found in {instance.logs_folder}')
+            sys.exit(1)
+        return sources
+
+    return [(None, os.path.join(node.logs_folder, f'{network}.log'))]
+
 
-    command = [
-        'tail',
-        '-n',
-        str(number_lines),
-        '-F' if follow else '',
-        os.path.expanduser(f'~/.nearup/logs/{network}.log'),
-    ]
+def show_logs(follow, number_lines, home=None):
+    sources = log_sources(home)
 
     try:
-        subprocess.run(command, start_new_session=True, check=True)
+        print_logs(sources, number_lines, follow)
     except KeyboardInterrupt:
         sys.exit(0)
-    except subprocess.CalledProcessError:
-        logging.error("Unable to read logs. Please try again.")
+    except OSError as ex:
+        logging.error(f"Unable to read logs: {ex}")
         sys.exit(1)
@@ -0,0 +1,153 @@
+"""Move directories aside and delete them in a background process.
+
+Removing a large data dir takes minutes, so it is first renamed to
+<dir>.trash.<ms> in the same directory, which is atomic and instant, and the
+renamed directory is deleted by `python3 -m nearuplib.trash` at low CPU and
+I/O priority while the node starts. A deleter holds a lock on each trash dir
+it works on, so a trash dir is never deleted by two processes at once.
+"""
+import errno
+import fcntl
+import glob
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from nearuplib.constants import LOGS_FOLDER, TRASH_WORKERS
+
+TRASH_SUFFIX = '.trash.'
+
+
+def move_to_trash(path):
+    """Rename path aside and return the new name, or None if it's missing."""
+    path = os.path.normpath(path)
+    while True:
+        trash = f'{path}{TRASH_SUFFIX}{int(time.time() * 1000)}'
+        if not os.path.exists(trash):
+            break
+        time.sleep(0.001)
+
+    try:
+        os.rename(path, trash)
+    except FileNotFoundError:
+        return None
+    return trash
+
+
+def find_trash(directory):
+    """Trash dirs left in directory, e.g. by a deletion that was killed."""
+    return sorted(
+        glob.glob(os.path.join(glob.escape(directory), f'*{TRASH_SUFFIX}*')))
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_tree(path, workers=TRASH_WORKERS):
+    """Delete a directory tree, unlinking its files from several threads.
+
+    RocksDB keeps thousands of files in one directory, so the files are
+    unlinked concurrently and the emptied directories removed afterwards.
+    """
+    directories = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for root, dirs, files in os.walk(path):
+            directories.append(root)
+            # symlinks to directories are unlinked rather than followed
+            files.extend(
+                d for d in dirs if os.path.islink(os.path.join(root, d)))
+            for _ in executor.map(_unlink,
+                                  [os.path.join(root, name) for name in files]):
+                pass
+
+    for directory in reversed(directories):
+        try:
+            os.rmdir(directory)
+        except FileNotFoundError:
+            pass
+        except OSError as ex:
+            # something wrote into the tree while it was being deleted
+            if ex.errno != errno.ENOTEMPTY:
+                raise
+            logging.warning(f'{directory} is not empty, leaving it')
+
+
+def _lock(path):
+    """Lock the trash dir path for deletion.
+
+    Returns the file descriptor holding the lock, or None if path is gone or
+    another deleter has it already.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _background_command(paths):
+    command = [sys.executable, '-m', 'nearuplib.trash'] + list(paths)
+    ionice = shutil.which('ionice')
+    if ionice:
+        command = [ionice, '-c', '3'] + command
+    return command
+
+
+def delete_in_background(paths):
+    """Start a detached process deleting paths. It outlives nearup."""
+    paths = [path for path in paths if path]
+    if not paths:
+        return None
+
+    logging.info(f'Deleting {", ".join(paths)} in the background')
+    os.makedirs(LOGS_FOLDER, exist_ok=True)
+    with open(os.path.join(LOGS_FOLDER, 'trash.log'), 'a') as log_fd:
+        return subprocess.Popen(_background_command(paths),
+                                stdin=subprocess.DEVNULL,
+                                stdout=log_fd,
+                                stderr=log_fd,
+                                start_new_session=True)
+
+
+def trash_and_delete(path):
+    """Move path aside and delete it in the background."""
+    return delete_in_background([move_to_trash(path)])
+
+
+def main(paths):
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s: %(message)s')
+    try:
+        os.nice(19)
+    except OSError:
+        pass
+
+    for path in paths:
+        fd = _lock(path)
+        if fd is None:
+            logging.info(f'{path} is deleted by another process already')
+            continue
+        try:
+            started = time.monotonic()
+            remove_tree(path)
+            logging.info(f'Deleted {path} in {time.monotonic() - started:.1f}s')
+        finally:
+            os.close(fd)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,31 +1,84 @@
-import hashlib
+import base64
+import json
 import logging
 import os
 import re
-import stat
+import shutil
 import textwrap
+import threading
+import typing
+
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
-from botocore import UNSIGNED
-from botocore.client import Config
 import click
 
-from nearuplib.constants import S3_BUCKETS
+from nearuplib.constants import (BINARIES_FOLDER, BINARY_CACHE_FOLDER,
+                                 BINARY_CACHE_MAX_BYTES, DOWNLOAD_CONCURRENCY,
+                                 DOWNLOAD_PART_SIZE, S3_BUCKETS,
+                                 S3_CONNECT_TIMEOUT, S3_ENDPOINT_URL,
+                                 S3_MAX_POOL_CONNECTIONS, S3_READ_TIMEOUT)
 from nearuplib.exceptions import NetworkError, capture_as
+from nearuplib.hashing import DigestIndex, file_digests
+
+_S3_CLIENTS = {}
+_S3_CLIENTS_LOCK = threading.Lock()
+
+# Last seen ETag and body of every small object read with read_from_s3.
+_S3_OBJECTS = {}
+_S3_OBJECTS_LOCK = threading.Lock()
+
+
+def s3_client(bucket, endpoint_url=None):
+    """Return the shared S3 client for the given bucket.
+
+    Clients are created lazily and reused, so the keep-alive connection pool
+    stays warm across requests. boto3 clients are thread safe.
+    """
+    # boto3 takes longer to import than the rest of nearup, so only the
+    # commands which talk to S3 pay for it
+    import boto3
+    from botocore import UNSIGNED
+    from botocore.client import Config
+
+    endpoint_url = endpoint_url or S3_ENDPOINT_URL
+    key = (bucket, endpoint_url)
+
+    with _S3_CLIENTS_LOCK:
+        client = _S3_CLIENTS.get(key)
+        if client is None:
+            config = Config(signature_version=UNSIGNED,
+                            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                            connect_timeout=S3_CONNECT_TIMEOUT,
+                            read_timeout=S3_READ_TIMEOUT,
+                            tcp_keepalive=True,
+                            retries={
+                                'max_attempts': 3,
+                                'mode': 'standard'
+                            })
+            client = boto3.client('s3',
+                                  endpoint_url=endpoint_url,
+                                  config=config)
+            _S3_CLIENTS[key] = client
+        return client
+
+
+def reset_s3_clients():
+    """Drop all cached S3 clients, e.g. after changing the endpoint."""
+    with _S3_CLIENTS_LOCK:
+        _S3_CLIENTS.clear()
 
 
 @capture_as(NetworkError)
 def download_from_s3(bucket, path, filepath=None):
-    s3_client = boto3.client('s3', config=Config(signature_version=UNSIGNED))
-    s3_client.download_file(bucket, path, filepath)
+    s3_client(bucket).download_file(bucket, path, filepath)
 
 
 @capture_as(NetworkError)
 def exists_on_s3(bucket, path):
-    s3_client = boto3.client('s3', config=Config(signature_version=UNSIGNED))
+    client = s3_client(bucket)
     try:
-        s3_client.head_object(Bucket=bucket, Key=path)
-    except s3_client.exceptions.NoSuchKey:
+        client.head_object(Bucket=bucket, Key=path)
+    except client.exceptions.NoSuchKey:
         return False
 
     return True
@@ -33,9 +86,165 @@ def exists_on_s3(bucket, path):
 
 @capture_as(NetworkError)
 def read_from_s3(bucket, path):
-    s3_client = boto3.client('s3', config=Config(signature_version=UNSIGNED))
-    response = s3_client.get_object(Bucket=bucket, Key=path)
-    return response['Body'].read().decode('utf-8')
+    """Read a small text object, downloading the body only if it changed.
+
+    The ETag of the last response is sent back as If-None-Match, so polling
+    an unchanged object costs a 304 response without a body.
+    """
+    from botocore.exceptions import ClientError
+
+    with _S3_OBJECTS_LOCK:
+        cached = _S3_OBJECTS.get((bucket, path))
+
+    kwargs = {}
+    if cached is not None:
+        kwargs['IfNoneMatch'] = cached[0]
+
+    try:
+        response = s3_client(bucket).get_object(Bucket=bucket,
+                                                Key=path,
+                                                **kwargs)
+    except ClientError as ex:
+        if cached is not None and ex.response['Error']['Code'] in (
+                '304', 'NotModified'):
+            return cached[1]
+        raise
+
+    body = response['Body'].read().decode('utf-8')
+    with _S3_OBJECTS_LOCK:
+        _S3_OBJECTS[(bucket, path)] = (response['ETag'], body)
+    return body
+
+
+class ChecksumMismatch(Exception):
+    """Raised when a downloaded file does not match its expected digest."""
+
+
+def _read_download_state(state_path):
+    try:
+        with open(state_path) as state_fd:
+            return json.load(state_fd)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_download_state(state_path, state):
+    tmp_state_path = f'{state_path}.tmp'
+    with open(tmp_state_path, 'w') as state_fd:
+        json.dump(state, state_fd)
+    os.replace(tmp_state_path, state_path)
+
+
+def _verify_download(filepath, head, expected_md5):
+    digests = file_digests(filepath, ('md5', 'sha256'))
+
+    etag = head['ETag'].strip('"')
+    published_sha256 = head.get('ChecksumSHA256')
+    if expected_md5:
+        expected, actual = expected_md5, digests['md5']
+    elif published_sha256 and '-' not in published_sha256:
+        expected = published_sha256
+        actual = base64.b64encode(bytes.fromhex(
+            digests['sha256'])).decode('ascii')
+    elif '-' not in etag:
+        # ETag of an object uploaded in a single part is its md5sum.
+        expected, actual = etag, digests['md5']
+    else:
+        logging.warning(
+            f'No digest published for {filepath}, only its size was verified')
+        return
+
+    if expected != actual:
+        raise ChecksumMismatch(
+            f'{filepath} has digest {actual}, expected {expected}')
+
+
+def _download_part(client, bucket, path, etag, download_fd, start, end):
+    response = client.get_object(Bucket=bucket,
+                                 Key=path,
+                                 Range=f'bytes={start}-{end}',
+                                 IfMatch=etag)
+    offset = start
+    for chunk in response['Body'].iter_chunks(1024 * 1024):
+        os.pwrite(download_fd, chunk, offset)
+        offset += len(chunk)
+
+    if offset != end + 1:
+        raise IOError(f'short read of bytes {start}-{end} of {path}')
+
+
+@capture_as(NetworkError)
+def download_ranged_from_s3(bucket,
+                            path,
+                            filepath,
+                            part_size=DOWNLOAD_PART_SIZE,
+                            concurrency=DOWNLOAD_CONCURRENCY,
+                            expected_md5=None,
+                            mode=None):
+    """Download a large object with parallel ranged GETs.
+
+    Parts are written into `<filepath>.part` and recorded in
+    `<filepath>.part.json` as they complete, so an interrupted download
+    resumes with the missing parts only. The result is verified against
+    expected_md5, the published SHA-256 checksum or the single-part ETag
+    before it is atomically renamed to filepath.
+    """
+    client = s3_client(bucket)
+    head = client.head_object(Bucket=bucket, Key=path, ChecksumMode='ENABLED')
+    size = head['ContentLength']
+    etag = head['ETag']
+
+    tmp_path = f'{filepath}.part'
+    state_path = f'{filepath}.part.json'
+
+    state = _read_download_state(state_path)
+    if (state is None or state.get('etag') != etag or
+            state.get('size') != size or state.get('part_size') != part_size or
+            not os.path.exists(tmp_path)):
+        state = {'etag': etag, 'size': size, 'part_size': part_size, 'done': []}
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    elif state['done']:
+        logging.info(f'Resuming download of {path}, '
+                     f'{len(state["done"])} parts already on disk')
+
+    done = set(state['done'])
+    parts = [(index, start, min(start + part_size, size) - 1)
+             for index, start in enumerate(range(0, size, part_size))
+             if index not in done]
+
+    state_lock = threading.Lock()
+    download_fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(download_fd, size)
+
+        def fetch(part):
+            index, start, end = part
+            _download_part(client, bucket, path, etag, download_fd, start, end)
+            with state_lock:
+                state['done'].append(index)
+                _write_download_state(state_path, state)
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            for future in [executor.submit(fetch, part) for part in parts]:
+                future.result()
+
+        os.fsync(download_fd)
+    finally:
+        os.close(download_fd)
+
+    try:
+        _verify_download(tmp_path, head, expected_md5)
+    except ChecksumMismatch:
+        os.remove(tmp_path)
+        os.remove(state_path)
+        raise
+
+    if mode is not None:
+        os.chmod(tmp_path, mode)
+    os.replace(tmp_path, filepath)
+    if os.path.exists(state_path):
+        os.remove(state_path)
 
 
 def binary_download_url(net, uname, branch, commit, binary):
@@ -47,19 +256,46 @@ def binary_download_url(net, uname, branch, commit, binary):
         return f'nearcore/{uname}/{branch}/{commit}/{binary}'
 
 
-def new_release_ready(net, uname):
+class ReleaseMetadata(typing.NamedTuple):
+    """Immutable snapshot of the release metadata published for a network."""
+    net: str
+    commit: str
+    branch: str
+    genesis_md5sum: typing.Optional[str]
+    records_md5sum: typing.Optional[str]
+
+    @property
+    def genesis_md5sums(self):
+        return (self.genesis_md5sum, self.records_md5sum)
+
+
+def fetch_release_metadata(net):
+    """Fetch all release metadata of a network in one concurrent round."""
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        commit = executor.submit(latest_deployed_release_commit, net)
+        branch = executor.submit(latest_deployed_release_branch, net)
+        genesis_md5sum = executor.submit(fetch_chain_file, net,
+                                         'genesis_md5sum')
+        records_md5sum = executor.submit(fetch_chain_file, net,
+                                         'records_md5sum')
+
+        return ReleaseMetadata(net=net,
+                               commit=commit.result(),
+                               branch=branch.result(),
+                               genesis_md5sum=genesis_md5sum.result(),
+                               records_md5sum=records_md5sum.result())
+
+
+def new_release_ready(net, uname, metadata=None):
     """Sanity check that a new release is ready for download."""
-    if net in ["localnet", "guildnet"]:
-        commit = latest_deployed_release_commit("testnet")
-        branch = latest_deployed_release_branch("testnet")
-    else:
-        commit = latest_deployed_release_commit(net)
-        branch = latest_deployed_release_branch(net)
+    if metadata is None:
+        metadata = fetch_release_metadata(net)
 
-    if not commit:
+    if not metadata.commit:
         return False
 
-    path = binary_download_url(net, uname, branch, commit, 'neard')
+    path = binary_download_url(net, uname, metadata.branch, metadata.commit,
+                               'neard')
 
     return exists_on_s3(S3_BUCKETS["default"], path)
 
@@ -69,38 +305,104 @@ def download_genesis(net, home_dir):
                      os.path.join(home_dir, 'genesis.json'))
 
 
-def download_binaries(net, uname):
-    commit = latest_deployed_release_commit(net)
-    branch = latest_deployed_release_branch(net)
+def binary_cache_path(net, uname, branch, commit, binary):
+    """Location of a binary in the local cache, keyed like its S3 path."""
+    download_url = binary_download_url(net, uname, branch, commit, binary)
+    return os.path.join(BINARY_CACHE_FOLDER,
+                        os.path.relpath(download_url, 'nearcore'))
+
+
+def link_binary(target, link_path):
+    """Atomically point link_path at target."""
+    tmp_link_path = f'{link_path}.link'
+    if os.path.lexists(tmp_link_path):
+        os.remove(tmp_link_path)
+    os.symlink(target, tmp_link_path)
+    os.replace(tmp_link_path, link_path)
+
+
+def _binaries_in_use(binaries_folder):
+    in_use = set()
+    if not os.path.isdir(binaries_folder):
+        return in_use
+
+    for entry in os.scandir(binaries_folder):
+        path = os.path.join(entry.path, 'neard')
+        if os.path.islink(path):
+            in_use.add(os.path.dirname(os.path.realpath(path)))
+    return in_use
+
+
+def evict_binary_cache(cache_folder=BINARY_CACHE_FOLDER,
+                       max_bytes=BINARY_CACHE_MAX_BYTES,
+                       binaries_folder=BINARIES_FOLDER):
+    """Remove least recently used cache entries until under max_bytes.
+
+    An entry is a directory holding the binaries of one build. Entries that
+    a network's binary currently links to are never evicted.
+    """
+    entries = []
+    for dirpath, _, filenames in os.walk(cache_folder):
+        if not filenames:
+            continue
+        stats = [os.stat(os.path.join(dirpath, name)) for name in filenames]
+        entries.append((max(st.st_mtime for st in stats),
+                        sum(st.st_size for st in stats), dirpath))
+
+    in_use = _binaries_in_use(binaries_folder)
+    total = sum(size for _, size, _ in entries)
+    for _, size, dirpath in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.realpath(dirpath) in in_use:
+            continue
+
+        logging.info(f'Evicting {dirpath} from the binary cache')
+        shutil.rmtree(dirpath, ignore_errors=True)
+        total -= size
+
+        parent = os.path.dirname(dirpath)
+        while parent != cache_folder and not os.listdir(parent):
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+
+
+def download_binaries(net, uname, metadata=None):
+    if metadata is None:
+        metadata = fetch_release_metadata(net)
+    commit = metadata.commit
+    branch = metadata.branch
 
     if commit:
-        logging.info(f'Downloading latest deployed version for {net}')
-
         binary = 'neard'
         download_url = binary_download_url(net, uname, branch, commit, binary)
-
-        download_url = f'nearcore/{uname}/{branch}/{commit}/{binary}'
-        if net == 'betanet':
-            download_url = f'nearcore/{uname}/{branch}/{commit}/nightly/{binary}'
-        elif net == 'shardnet':
-            download_url = f'nearcore/{uname}/{branch}/{commit}/shardnet/{binary}'
-
-        download_path = os.path.expanduser(f'~/.nearup/near/{net}/{binary}')
-
-        logging.info(
-            f"Downloading {binary} to {download_path} from {download_url}...")
-        download_from_s3(S3_BUCKETS['default'], download_url, download_path)
-        logging.info(f"Downloaded {binary} to {download_path}...")
-
-        logging.info(f"Making the {binary} executable...")
-        status = os.stat(download_path)
-        os.chmod(download_path, status.st_mode | stat.S_IEXEC)
+        cache_path = binary_cache_path(net, uname, branch, commit, binary)
+        binary_path = os.path.join(BINARIES_FOLDER, net, binary)
+
+        if os.path.exists(cache_path):
+            logging.info(f'Using cached {binary} {commit} for {net}')
+            os.utime(cache_path)
+        else:
+            logging.info(f'Downloading latest deployed version for {net}')
+            logging.info(
+                f"Downloading {binary} to {cache_path} from {download_url}...")
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            download_ranged_from_s3(S3_BUCKETS['default'],
+                                    download_url,
+                                    cache_path,
+                                    mode=0o755)
+            logging.info(f"Downloaded {binary} to {cache_path}...")
+
+        os.makedirs(os.path.dirname(binary_path), exist_ok=True)
+        link_binary(cache_path, binary_path)
 
         # TODO: seperate into download_metadata function with missing metadata
-        with open(os.path.expanduser(f'~/.nearup/near/{net}/version'),
+        with open(os.path.join(BINARIES_FOLDER, net, 'version'),
                   'w') as version_file:
             version_file.write(commit)
 
+        evict_binary_cache()
+
 
 def latest_deployed_release_commit(net):
     if net in ["localnet", "guildnet"]:
@@ -110,8 +412,11 @@ def latest_deployed_release_commit(net):
                         f'nearcore-deploy/{net}/latest_deploy').strip()
 
 
-def latest_deployed_release_commit_has_changed(net, commit):
-    latest_commit = latest_deployed_release_commit(net)
+def latest_deployed_release_commit_has_changed(net, commit, metadata=None):
+    if metadata is not None:
+        latest_commit = metadata.commit
+    else:
+        latest_commit = latest_deployed_release_commit(net)
 
     logging.info(f"Current release commit is: {commit}")
     logging.info(f"Latest release commit is {latest_commit}")
@@ -149,24 +454,43 @@ def write_genesis_md5sum(home_dir, md5sums):
     write_md5sum_file(home_dir, 'records_md5sum', records_md5sum)
 
 
-def read_md5sum_file(home_dir, name):
-    md5sum_path = os.path.join(home_dir, f'.nearup/{name}_md5sum')
+def _read_stored_md5sum(home_dir, name):
     try:
-        return open(md5sum_path, 'r').read().strip()
+        with open(os.path.join(home_dir, f'.nearup/{name}_md5sum')) as f:
+            return f.read().strip()
     except FileNotFoundError:
-        try:
-            with open(os.path.join(os.path.join(home_dir, f'{name}.json')),
-                      'rb') as fd:
-                md5sum = hashlib.md5(fd.read()).hexdigest()
-                write_md5sum_file(home_dir, f'{name}_md5sum', md5sum)
-                return md5sum
-        except FileNotFoundError:
-            return None
+        return None
+
+
+def read_md5sum_files(home_dir, names):
+    """Read the stored md5sums of chain files, hashing any that are missing.
+
+    Files without a stored md5sum are looked up in the digest index of the
+    home dir, or else hashed concurrently, and their md5sums stored for next
+    time. A file that does not exist has md5sum None.
+    """
+    md5sums = {name: _read_stored_md5sum(home_dir, name) for name in names}
+    missing = {
+        name: os.path.join(home_dir, f'{name}.json')
+        for name, md5sum in md5sums.items()
+        if md5sum is None
+    }
+
+    digests = DigestIndex.for_home(home_dir).file_digests(missing.values())
+    for name, path in missing.items():
+        if digests[path] is not None:
+            md5sums[name] = digests[path]['md5']
+            write_md5sum_file(home_dir, f'{name}_md5sum', md5sums[name])
+
+    return tuple(md5sums[name] for name in names)
+
+
+def read_md5sum_file(home_dir, name):
+    return read_md5sum_files(home_dir, [name])[0]
 
 
 def read_genesis_md5sum(home_dir):
-    return (read_md5sum_file(home_dir,
-                             'genesis'), read_md5sum_file(home_dir, 'records'))
+    return read_md5sum_files(home_dir, ['genesis', 'records'])
 
 
 def fetch_chain_file(net, filename):
@@ -186,8 +510,12 @@ def fetch_chain_file(net, filename):
 
 
 def latest_genesis_md5sum(net):
-    return (fetch_chain_file(net, 'genesis_md5sum'),
-            fetch_chain_file(net, 'records_md5sum'))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        genesis_md5sum = executor.submit(fetch_chain_file, net,
+                                         'genesis_md5sum')
+        records_md5sum = executor.submit(fetch_chain_file, net,
+                                         'records_md5sum')
+        return (genesis_md5sum.result(), records_md5sum.result())
 
 
 _WRAPPER = textwrap.TextWrapper(break_long_words=False, break_on_hyphens=False)
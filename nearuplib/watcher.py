@@ -5,26 +5,23 @@ import sys
 
 from subprocess import Popen
 
-import psutil
-
 from nearuplib.constants import DEFAULT_WAIT_TIMEOUT, WATCHER_PID_FILE
 
 
-def check_watcher_file():
-    if not os.path.exists(WATCHER_PID_FILE):
+def check_watcher_file(pid_file_path=WATCHER_PID_FILE):
+    if not os.path.exists(pid_file_path):
         return False
 
-    with open(WATCHER_PID_FILE) as pid_file:
+    with open(pid_file_path) as pid_file:
         try:
             pid = int(pid_file.readline().strip())
         except Exception:
             logging.error(
-                f"Nearup watcher PID file {WATCHER_PID_FILE} has unexpected content."
+                f"Nearup watcher PID file {pid_file_path} has unexpected content."
             )
             return True
 
-        logging.warning(
-            f"Old Nearup watcher PID file {WATCHER_PID_FILE} found.")
+        logging.warning(f"Old Nearup watcher PID file {pid_file_path} found.")
 
         try:
             os.kill(pid, 0)
@@ -35,10 +32,10 @@ def check_watcher_file():
             return True
 
 
-def is_watcher_running():
-    if check_watcher_file():
+def is_watcher_running(pid_file_path=WATCHER_PID_FILE):
+    if check_watcher_file(pid_file_path):
         logging.error("Run nearup stop or kill the process manually!")
-        logging.warning(f"If this is a mistake, remove {WATCHER_PID_FILE}")
+        logging.warning(f"If this is a mistake, remove {pid_file_path}")
         return True
     return False
 
@@ -64,10 +61,12 @@ def run_watcher(net, path=os.path.join(site.USER_BASE, 'bin/watcher'), home=''):
         watcher_pid_file.write(str(proc.pid))
 
 
-def stop_watcher(timeout=DEFAULT_WAIT_TIMEOUT):
+def stop_watcher(timeout=DEFAULT_WAIT_TIMEOUT, pid_file_path=WATCHER_PID_FILE):
+    import psutil
+
     try:
-        if os.path.exists(WATCHER_PID_FILE):
-            with open(WATCHER_PID_FILE) as pid_file:
+        if os.path.exists(pid_file_path):
+            with open(pid_file_path) as pid_file:
                 pid = int(pid_file.read())
                 process = psutil.Process(pid)
                 logging.info(
@@ -82,7 +81,9 @@ def stop_watcher(timeout=DEFAULT_WAIT_TIMEOUT):
                     logging.warning('Killing watcher with pid {pid}')
                     process.kill()
 
-                os.remove(WATCHER_PID_FILE)
+                # `nearup supervise` removes its PID file itself on exit
+                if os.path.exists(pid_file_path):
+                    os.remove(pid_file_path)
         else:
             logging.info("Nearup watcher is not running...")
     except Exception as ex:
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Compare the in-memory and streaming genesis equivalence checks.
+
+Generates a synthetic genesis.json with embedded records, plus the split
+genesis.json/records.json pair it should be equivalent to, then runs each
+implementation in a fresh process and reports wall time and peak RSS.
+
+    python3 scripts/bench_genesis.py --size-mb 4096
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from nearuplib.nodelib import genesis_files_equivalent  # pylint: disable=C0413
+
+
+def legacy_genesis_files_equivalent(old_genesis_path, new_genesis_path,
+                                    new_records_path):
+    """The implementation that loads every file into memory at once."""
+    with open(old_genesis_path) as old_genesis, open(
+            new_genesis_path) as new_genesis, open(
+                new_records_path) as new_records:
+        old_genesis = json.load(old_genesis)
+        new_genesis = json.load(new_genesis)
+        for key in set(old_genesis) | set(new_genesis):
+            if key != 'records' and old_genesis.get(key) != new_genesis.get(
+                    key):
+                return False
+
+        h = hashlib.sha256()
+        for entry in old_genesis['records']:
+            h.update(json.dumps(entry).encode('utf-8'))
+        old_records_hash = h.digest()
+        del old_genesis
+
+        h = hashlib.sha256()
+        for entry in json.load(new_records):
+            h.update(json.dumps(entry).encode('utf-8'))
+        return h.digest() == old_records_hash
+
+
+def record(i):
+    return {
+        'Account': {
+            'account_id': f'account{i:012}.testnet',
+            'account': {
+                'amount': str(10**24 + i),
+                'locked': '0',
+                'code_hash': '11111111111111111111111111111111',
+                'storage_usage': 182,
+                'version': 'V1',
+            },
+        }
+    }
+
+
+def generate(directory, size_mb):
+    fields = {
+        'chain_id': 'testnet',
+        'genesis_height': 42376888,
+        'protocol_version': 29,
+        'validators': [],
+    }
+    target = size_mb * 1024 * 1024
+    old_genesis = os.path.join(directory, 'old_genesis.json')
+    new_genesis = os.path.join(directory, 'genesis.json')
+    new_records = os.path.join(directory, 'records.json')
+
+    with open(old_genesis, 'w') as old_fd, open(new_records, 'w') as rec_fd:
+        old_fd.write(json.dumps(fields)[:-1] + ', "records": [')
+        rec_fd.write('[')
+        i = 0
+        while old_fd.tell() < target:
+            line = ('' if i == 0 else ',\n') + json.dumps(record(i))
+            old_fd.write(line)
+            rec_fd.write(line)
+            i += 1
+        old_fd.write(']}')
+        rec_fd.write(']')
+
+    with open(new_genesis, 'w') as new_fd:
+        json.dump(dict(fields, records=[]), new_fd)
+
+    return old_genesis, new_genesis, new_records
+
+
+def measure(func, paths, queue):
+    started = time.monotonic()
+    result = func(*paths)
+    elapsed = time.monotonic() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak *= 1024
+    queue.put((result, elapsed, peak))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--skip-legacy',
+                        action='store_true',
+                        help='Only run the streaming implementation')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'generating a {args.size_mb} MB genesis in {directory}...')
+        paths = generate(directory, args.size_mb)
+
+        implementations = [('streaming', genesis_files_equivalent)]
+        if not args.skip_legacy:
+            implementations.append(
+                ('in-memory', legacy_genesis_files_equivalent))
+
+        for name, func in implementations:
+            queue = context.Queue()
+            proc = context.Process(target=measure, args=(func, paths, queue))
+            proc.start()
+            result, elapsed, peak = queue.get()
+            proc.join()
+            print(f'{name:>10}: equivalent={result} time={elapsed:.1f}s '
+                  f'peak_rss={peak / 1024**2:.0f}MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import os
+
+from nearuplib import util
+from nearuplib.util import ReleaseMetadata, evict_binary_cache
+
+METADATA = ReleaseMetadata(net='testnet',
+                           commit='abcdef',
+                           branch='1.26.0',
+                           genesis_md5sum=None,
+                           records_md5sum=None)
+
+
+def test_download_binaries_uses_cache(tmp_path, monkeypatch):
+    downloads = []
+
+    def fake_download(bucket, path, filepath, mode=None):  # pylint: disable=W0613
+        downloads.append(path)
+        with open(filepath, 'wb') as binary:
+            binary.write(b'neard')
+        os.chmod(filepath, mode)
+
+    monkeypatch.setattr(util, 'BINARY_CACHE_FOLDER', str(tmp_path / 'cache'))
+    monkeypatch.setattr(util, 'BINARIES_FOLDER', str(tmp_path / 'near'))
+    monkeypatch.setattr(util, 'download_ranged_from_s3', fake_download)
+    monkeypatch.setattr(util, 'evict_binary_cache', lambda: None)
+
+    util.download_binaries('testnet', 'Linux', METADATA)
+    util.download_binaries('testnet', 'Linux', METADATA)
+    util.download_binaries('guildnet', 'Linux', METADATA)
+
+    assert downloads == ['nearcore/Linux/1.26.0/abcdef/neard']
+    cached = tmp_path / 'cache' / 'Linux' / '1.26.0' / 'abcdef' / 'neard'
+    for net in ('testnet', 'guildnet'):
+        binary = tmp_path / 'near' / net / 'neard'
+        assert binary.is_symlink()
+        assert os.path.realpath(binary) == str(cached)
+        assert (tmp_path / 'near' / net / 'version').read_text() == 'abcdef'
+
+
+def test_evict_binary_cache(tmp_path):
+    cache = tmp_path / 'cache'
+    near = tmp_path / 'near'
+    for age, commit in enumerate(['old', 'linked', 'new']):
+        entry = cache / 'Linux' / 'master' / commit
+        entry.mkdir(parents=True)
+        (entry / 'neard').write_bytes(b'x' * 100)
+        os.utime(entry / 'neard', (1000 + age, 1000 + age))
+
+    (near / 'testnet').mkdir(parents=True)
+    os.symlink(cache / 'Linux' / 'master' / 'linked' / 'neard',
+               near / 'testnet' / 'neard')
+
+    evict_binary_cache(str(cache), max_bytes=150, binaries_folder=str(near))
+
+    assert not (cache / 'Linux' / 'master' / 'old').exists()
+    assert (cache / 'Linux' / 'master' / 'linked' / 'neard').exists()
+    assert not (cache / 'Linux' / 'master' / 'new').exists()
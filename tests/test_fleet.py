@@ -0,0 +1,217 @@
+import subprocess
+import time
+
+import pytest
+
+from nearuplib import fleet
+from nearuplib.constants import NODE_PID_FILE
+from nearuplib.exceptions import NetworkError
+from nearuplib.fleet import FleetPoller, add_node, load_fleet, remove_node
+from nearuplib.instance import Instance
+from nearuplib.scheduler import PollScheduler
+from nearuplib.util import ReleaseMetadata
+
+
+def test_fleet_registry(tmp_path):
+    registry = str(tmp_path / 'fleet.json')
+    rpc = add_node(str(tmp_path / 'rpc'), 'testnet', registry_path=registry)
+    archival = add_node(str(tmp_path / 'archival'),
+                        'testnet',
+                        rpc_port=rpc.rpc_port + 1,
+                        registry_path=registry)
+    with pytest.raises(ValueError):
+        add_node(str(tmp_path / 'rpc'), 'mainnet', registry_path=registry)
+
+    assert load_fleet(registry) == [archival, rpc]
+    assert len({rpc.rpc_port, rpc.network_port, archival.network_port}) == 3
+    assert archival.rpc_port == rpc.rpc_port + 1
+
+    # every home has its own PID file and logs
+    assert rpc.instance.pid_file != archival.instance.pid_file
+    assert NODE_PID_FILE not in (rpc.instance.pid_file,
+                                 archival.instance.pid_file)
+    assert rpc.instance.logs_folder != archival.instance.logs_folder
+
+    assert remove_node(rpc.home, registry)
+    assert not remove_node(rpc.home, registry)
+    assert load_fleet(registry) == [archival]
+
+
+def test_poller_fetches_each_network_once(tmp_path, monkeypatch):
+    registry = str(tmp_path / 'fleet.json')
+    nodes = [
+        add_node(str(tmp_path / 'rpc'), 'testnet', registry_path=registry),
+        add_node(str(tmp_path / 'archival'), 'testnet', registry_path=registry),
+        add_node(str(tmp_path / 'local'),
+                 'testnet',
+                 binary_path=str(tmp_path / 'bin'),
+                 registry_path=registry),
+        add_node(str(tmp_path / 'mainnet'), 'mainnet', registry_path=registry),
+    ]
+    # the nodes look running to the poller
+    monkeypatch.setattr(
+        fleet, 'node_instance',
+        lambda home: Instance('node', f'{home}.pid', str(tmp_path / 'logs')))
+    for node in nodes:
+        (tmp_path / f'{node.home}.pid').write_text('1|neard|testnet')
+
+    restarted = []
+    fetched = []
+    commits = {'testnet': 'a', 'mainnet': 'a'}
+
+    def fetch(net):
+        fetched.append(net)
+        return ReleaseMetadata(net, commits[net], 'master', 'g', None)
+
+    monkeypatch.setattr(fleet, 'read_genesis_md5sum', lambda home: ('g', None))
+    monkeypatch.setattr(fleet, 'new_release_ready', lambda *args: True)
+    monkeypatch.setattr(fleet, 'upgrade_node',
+                        lambda node, metadata: restarted.append(node.home))
+
+    poller = FleetPoller(load=lambda: load_fleet(registry),
+                         scheduler=PollScheduler(interval=1),
+                         fetch=fetch)
+    poller.refresh()
+    assert poller.check_releases() == []
+
+    commits['testnet'] = 'b'
+    assert [node.home for node in poller.check_releases()
+           ] == [nodes[1].home, nodes[0].home]
+    assert sorted(restarted) == sorted([nodes[0].home, nodes[1].home])
+    assert fetched == ['mainnet', 'testnet'] * 2
+    assert poller.check_releases() == []
+
+
+def test_poller_restarts_crashed_nodes(tmp_path, monkeypatch):
+    registry = str(tmp_path / 'fleet.json')
+    rpc = add_node(str(tmp_path / 'rpc'),
+                   'testnet',
+                   boot_nodes='ed25519:peer@127.0.0.1:24567',
+                   registry_path=registry)
+    local = add_node(str(tmp_path / 'local'),
+                     'testnet',
+                     binary_path=str(tmp_path / 'bin'),
+                     registry_path=registry)
+    broken = add_node(str(tmp_path / 'broken'),
+                      'mainnet',
+                      binary_path=str(tmp_path / 'bin'),
+                      registry_path=registry)
+    monkeypatch.setattr(
+        fleet, 'node_instance',
+        lambda home: Instance('node', f'{home}.pid', str(tmp_path / 'logs')))
+
+    def crash(node):
+        proc = subprocess.Popen(['sleep', '0'])
+        proc.wait()
+        (tmp_path / f'{node.home}.pid').write_text(f'{proc.pid}|sleep|testnet')
+
+    for node in (rpc, local, broken):
+        crash(node)
+
+    restarts = []
+    ready = [False]
+
+    def restart_node(node):
+        if node == broken:
+            # run() exits when neard can't be started
+            raise SystemExit(1)
+        restarts.append(('restart', node))
+
+    monkeypatch.setattr(fleet, 'restart_node', restart_node)
+    monkeypatch.setattr(
+        fleet, 'upgrade_node', lambda node, metadata: restarts.append(
+            ('upgrade', node)))
+    monkeypatch.setattr(fleet, 'read_genesis_md5sum', lambda home: ('g', None))
+    monkeypatch.setattr(fleet, 'new_release_ready', lambda *args: ready[0])
+
+    commits = {'testnet': 'a'}
+    poller = FleetPoller(load=lambda: load_fleet(registry),
+                         scheduler=PollScheduler(interval=1),
+                         fetch=lambda net: ReleaseMetadata(
+                             net, commits[net], 'master', 'g', None))
+    poller.refresh()
+    assert poller.check_crashes() == [local, rpc]
+    assert poller.failed == [broken]
+    # the official node stays on its release
+    assert restarts == [('restart', local), ('restart', rpc)]
+
+    # it dies again once a new release is out, and is restarted on it
+    restarts.clear()
+    poller.failed = []
+    commits['testnet'] = 'b'
+    poller._metadata = {}  # pylint: disable=W0212
+    ready[0] = True
+    assert poller.check_crashes() == [local, rpc]
+    assert restarts == [('restart', local), ('upgrade', rpc)]
+
+    # so the release check has nothing left to do for it
+    restarts.clear()
+    assert poller.check_releases() == []
+    assert restarts == []
+
+
+def test_poller_backs_off_failed_restarts(tmp_path, monkeypatch):
+    registry = str(tmp_path / 'fleet.json')
+    crashed = add_node(str(tmp_path / 'crashed'),
+                       'testnet',
+                       binary_path=str(tmp_path / 'bin'),
+                       registry_path=registry)
+    add_node(str(tmp_path / 'rpc'), 'mainnet', registry_path=registry)
+    monkeypatch.setattr(
+        fleet, 'node_instance',
+        lambda home: Instance('node', f'{home}.pid', str(tmp_path / 'logs')))
+    monkeypatch.setattr(fleet, 'NEARD_EXIT_GRACE_PERIOD', 0)
+    monkeypatch.setattr(fleet, 'read_genesis_md5sum', lambda home: ('g', None))
+
+    proc = subprocess.Popen(['sleep', '0'])
+    proc.wait()
+    pid_file = tmp_path / f'{crashed.home}.pid'
+    pid_file.write_text(f'{proc.pid}|sleep|testnet')
+
+    attempts = []
+
+    def restart_node(node):
+        attempts.append(node)
+        if len(attempts) == 1:
+            raise NetworkError()
+        # stopped, but neard fails to start again
+        if pid_file.exists():
+            pid_file.unlink()
+        raise SystemExit(1)
+
+    fetched = []
+    monkeypatch.setattr(fleet, 'restart_node', restart_node)
+    poller = FleetPoller(load=lambda: load_fleet(registry),
+                         scheduler=PollScheduler(interval=0.5,
+                                                 jitter=0,
+                                                 max_backoff=10),
+                         fetch=lambda net: fetched.append(net) or
+                         ReleaseMetadata(net, 'a', 'master', 'g', None))
+
+    deadline = time.monotonic() + 3.5
+    while time.monotonic() < deadline:
+        poller.poll_once()
+
+    # tried at once, after 1s and after 2s more, even once its PID file is
+    # gone, whatever the release checks did in between
+    assert attempts == [crashed] * 3
+    # and the release checks went on meanwhile
+    assert fetched
+
+
+def test_restart_keeps_surviving_node(tmp_path, monkeypatch):
+    node = add_node(str(tmp_path / 'rpc'),
+                    'testnet',
+                    registry_path=str(tmp_path / 'fleet.json'))
+    monkeypatch.setattr(
+        fleet, 'node_instance',
+        lambda home: Instance('node', f'{home}.pid', str(tmp_path / 'logs')))
+    # stop_native keeps the PID file of a node which outlives the timeout
+    (tmp_path / f'{node.home}.pid').write_text('1|neard|testnet')
+    monkeypatch.setattr(fleet, 'stop_native', lambda pid_file: None)
+    started = []
+    monkeypatch.setattr(fleet, '_run', lambda *args: started.append(args))
+
+    with pytest.raises(RuntimeError):
+        fleet.restart_node(node)
+    assert started == []
@@ -0,0 +1,145 @@
+import io
+import json
+
+import pytest
+
+from nearuplib.genesis import (GenesisDiff, JsonStream, compare_genesis,
+                               fields_digest, genesis_digests, records_hash,
+                               scan_genesis)
+from nearuplib.hashing import DigestIndex
+from nearuplib.nodelib import genesis_change_keeps_data, genesis_files_equivalent
+
+RECORDS = [{
+    'Account': {
+        'account_id': f'account{i}.near',
+        'account': {
+            'amount': str(10**24 * i),
+            'storage_usage': 182 + i,
+        },
+    }
+} for i in range(50)]
+
+FIELDS = {
+    'chain_id': 'testnet',
+    'genesis_height': 42376888,
+    'protocol_version': 29,
+    'validators': [{
+        'account_id': 'node0',
+        'amount': '1.5e30'
+    }],
+    'min_gas_price': 1000000000,
+}
+
+
+def write_json(path, value):
+    path.write_text(json.dumps(value, indent=2))
+    return str(path)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_json_stream_matches_json_load(chunk_size):
+    document = dict(FIELDS, records=RECORDS, empty=[], nested={'a': [1.5, -2]})
+    stream = JsonStream(io.StringIO(json.dumps(document)), chunk_size)
+
+    decoded = {}
+    for key in stream.iter_object():
+        if key == 'records':
+            decoded[key] = list(stream.iter_array())
+        else:
+            decoded[key] = stream.decode_value()
+
+    assert decoded == document
+
+
+def test_scan_genesis(tmp_path):
+    path = write_json(tmp_path / 'genesis.json', dict(FIELDS, records=RECORDS))
+    records_path = write_json(tmp_path / 'records.json', RECORDS)
+
+    fields, digest = scan_genesis(path, chunk_size=64)
+    assert fields == FIELDS
+    assert digest == records_hash(records_path, chunk_size=64)
+
+
+def test_genesis_files_equivalent(tmp_path):
+    old_genesis = write_json(tmp_path / 'old_genesis.json',
+                             dict(FIELDS, records=RECORDS))
+    new_genesis = write_json(tmp_path / 'genesis.json', dict(FIELDS,
+                                                             records=[]))
+    records = write_json(tmp_path / 'records.json', RECORDS)
+    assert genesis_files_equivalent(old_genesis, new_genesis, records)
+
+    other_records = write_json(tmp_path / 'other_records.json', RECORDS[:-1])
+    assert not genesis_files_equivalent(old_genesis, new_genesis, other_records)
+
+    other_genesis = write_json(tmp_path / 'other_genesis.json',
+                               dict(FIELDS, protocol_version=30, records=[]))
+    assert not genesis_files_equivalent(old_genesis, other_genesis, records)
+
+
+def test_genesis_digests_are_indexed(tmp_path):
+    path = write_json(tmp_path / 'genesis.json', dict(FIELDS, records=RECORDS))
+    index = DigestIndex(str(tmp_path / 'digests.json'))
+
+    digests = genesis_digests(path, index)
+    assert digests == (fields_digest(FIELDS),
+                       records_hash(
+                           write_json(tmp_path / 'records.json',
+                                      RECORDS)).hex())
+    assert DigestIndex(str(tmp_path / 'digests.json')).lookup(
+        path, 'records-sha256') == digests[1]
+
+
+def test_compare_genesis(tmp_path):
+    old_genesis = write_json(tmp_path / 'old_genesis.json',
+                             dict(FIELDS, records=RECORDS))
+    new_genesis = write_json(tmp_path / 'genesis.json', dict(FIELDS,
+                                                             records=[]))
+    records = write_json(tmp_path / 'records.json', RECORDS)
+
+    diff = compare_genesis(old_genesis, new_genesis, None, records, 64)
+    assert diff == GenesisDiff((), ())
+    assert not diff.state_changing
+
+    changed = [dict(r, changed=True) for r in RECORDS[3:5]]
+    other_records = write_json(
+        tmp_path / 'other_records.json',
+        RECORDS[:3] + changed + RECORDS[5:] + RECORDS[:2])
+    diff = compare_genesis(old_genesis, new_genesis, None, other_records)
+    assert diff.record_ranges == ((3, 5), (50, 52))
+    assert diff.state_changing
+
+
+@pytest.mark.parametrize('field', [
+    'transaction_validity_period', 'online_min_threshold',
+    'protocol_reward_rate', 'protocol_version', 'chain_id', 'unknown_field'
+])
+def test_compare_genesis_fields_change_state(tmp_path, field):
+    old_genesis = write_json(tmp_path / 'old_genesis.json',
+                             dict(FIELDS, records=RECORDS))
+    new_genesis = write_json(tmp_path / 'genesis.json',
+                             dict(FIELDS, records=RECORDS, **{field: 1}))
+
+    diff = compare_genesis(old_genesis, new_genesis)
+    assert diff.fields == (field,)
+    assert diff.state_changing
+
+
+def test_genesis_change_keeps_data(tmp_path):
+    old_home = tmp_path / 'old'
+    new_home = tmp_path / 'new'
+    old_home.mkdir()
+    new_home.mkdir()
+    write_json(old_home / 'genesis.json', dict(FIELDS, records=RECORDS))
+    write_json(new_home / 'genesis.json', dict(FIELDS, records=[]))
+    write_json(new_home / 'records.json', RECORDS)
+    assert genesis_change_keeps_data(old_home, new_home, False, True)
+
+    write_json(new_home / 'records.json', RECORDS[1:])
+    assert not genesis_change_keeps_data(old_home, new_home, False, True)
+
+    write_json(new_home / 'genesis.json',
+               dict(FIELDS, online_max_threshold=[99, 100], records=[]))
+    write_json(new_home / 'records.json', RECORDS)
+    assert not genesis_change_keeps_data(old_home, new_home, False, True)
+    assert not genesis_change_keeps_data(old_home, tmp_path / 'missing', False,
+                                         False)
@@ -0,0 +1,63 @@
+import hashlib
+import os
+
+from nearuplib import hashing
+from nearuplib.hashing import DigestIndex, digest_files, file_digests
+from nearuplib.util import read_genesis_md5sum
+
+
+def test_file_digests(tmp_path):
+    data = os.urandom(3 * 1024 + 5)
+    path = tmp_path / 'genesis.json'
+    path.write_bytes(data)
+
+    assert file_digests(str(path), ('md5', 'sha256'), buffer_size=1024) == {
+        'md5': hashlib.md5(data).hexdigest(),
+        'sha256': hashlib.sha256(data).hexdigest(),
+    }
+
+
+def test_digest_files(tmp_path):
+    (tmp_path / 'a').write_bytes(b'a')
+    (tmp_path / 'b').write_bytes(b'b')
+    paths = [str(tmp_path / name) for name in ('a', 'b', 'missing')]
+
+    assert digest_files(paths) == {
+        paths[0]: {
+            'md5': hashlib.md5(b'a').hexdigest()
+        },
+        paths[1]: {
+            'md5': hashlib.md5(b'b').hexdigest()
+        },
+        paths[2]: None,
+    }
+
+
+def test_read_genesis_md5sum(tmp_path):
+    (tmp_path / 'genesis.json').write_bytes(b'{}')
+
+    assert read_genesis_md5sum(
+        str(tmp_path)) == (hashlib.md5(b'{}').hexdigest(), None)
+    assert (tmp_path / '.nearup' /
+            'genesis_md5sum').read_text() == hashlib.md5(b'{}').hexdigest()
+    assert not (tmp_path / '.nearup' / 'records_md5sum').exists()
+
+
+def test_digest_index(tmp_path, monkeypatch):
+    path = tmp_path / 'records.json'
+    path.write_bytes(b'[]')
+    index = DigestIndex(str(tmp_path / 'digests.json'))
+
+    expected = {
+        'md5': hashlib.md5(b'[]').hexdigest(),
+        'sha256': hashlib.sha256(b'[]').hexdigest(),
+    }
+    assert index.file_digests([str(path)]) == {str(path): expected}
+
+    # unchanged files are answered from the saved index without hashing
+    monkeypatch.setattr(hashing, 'digest_files', None)
+    reloaded = DigestIndex(str(tmp_path / 'digests.json'))
+    assert reloaded.file_digests([str(path)]) == {str(path): expected}
+
+    path.write_bytes(b'[{}]')
+    assert reloaded.lookup(str(path), 'md5') is None
@@ -0,0 +1,72 @@
+import http.server
+import subprocess
+import threading
+
+import pytest
+
+from nearuplib import localnet as localnet_module
+from nearuplib.instance import Instance
+from nearuplib.localnet import Localnet, wait_for_nodes
+
+
+class StatusHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):  # pylint: disable=C0103
+        self.send_response(200 if self.path == '/status' else 404)
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        pass
+
+
+def test_wait_for_nodes():
+    server = http.server.HTTPServer(('127.0.0.1', 0), StatusHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    alive = subprocess.Popen(['sleep', '60'])
+    dead = subprocess.Popen(['true'])
+    dead.wait()
+    try:
+        ready_times = wait_for_nodes([alive, dead],
+                                     [server.server_port, server.server_port],
+                                     timeout=5,
+                                     interval=0.1)
+        assert ready_times[0] is not None and ready_times[0] < 5
+        assert ready_times[1] is None
+    finally:
+        alive.kill()
+        alive.wait()
+        server.shutdown()
+
+
+def test_run_records_started_nodes(tmp_path, monkeypatch):
+    node_dirs = [str(tmp_path / f'node{i}') for i in range(3)]
+    localnet = Localnet(
+        str(tmp_path),
+        Instance('test', str(tmp_path / 'node.pid'), str(tmp_path / 'logs')),
+        node_dirs, [3030, 3031, 3032], [24567, 24568, 24569], 'ed25519:key')
+    monkeypatch.setattr(localnet_module, 'prepare', lambda *args: localnet)
+
+    procs = []
+
+    def run_binary(path, home, action, **kwargs):
+        if home == node_dirs[1]:
+            raise OSError('bad config')
+        procs.append(subprocess.Popen(['sleep', '60']))
+        return procs[-1]
+
+    monkeypatch.setattr(localnet_module, 'run_binary', run_binary)
+    try:
+        with pytest.raises(SystemExit):
+            localnet_module.run('neard', str(tmp_path), 3, 1, False, False, 0,
+                                '')
+        lines = (tmp_path / 'node.pid').read_text().splitlines()
+        assert sorted(line.split('|')[0] for line in lines) == sorted(
+            str(proc.pid) for proc in procs)
+        assert len(lines) == 2
+    finally:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
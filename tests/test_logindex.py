@@ -0,0 +1,116 @@
+import calendar
+import gzip
+import io
+import os
+import re
+import time
+
+import pytest
+
+from nearuplib.logindex import (LogIndex, LogQuery, parse_line_time, parse_time,
+                                search_logs)
+
+START = calendar.timegm((2022, 5, 10, 12, 0, 0))
+
+
+def log_line(i):
+    stamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(START + i))
+    stamp = f'{stamp}.{i % 1000:03}Z'
+    if i % 10 == 0:
+        return f'{stamp}  INFO stats: #{1000 + i // 10:>8} Validator | 4 peers'
+    return f'{stamp} DEBUG chain: processed block {i}'
+
+
+def make_log(path, first, last):
+    with open(path, 'a') as log_fd:
+        for i in range(first, last):
+            log_fd.write(log_line(i) + '\n')
+            if i % 97 == 0:
+                log_fd.write('stack backtrace:\n   0: neard::main\n')
+
+
+def brute_force(paths, query):
+    lines = []
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        timestamp = height = None
+        with opener(path, 'rb') as log_fd:
+            for line in log_fd:
+                line = line.rstrip(b'\n')
+                timestamp = parse_line_time(line, 2022) or timestamp
+                match = re.search(rb'stats: #\s*(\d+)', line)
+                if match:
+                    height = int(match.group(1))
+                if query.matches(line, timestamp, height):
+                    lines.append(line)
+    return lines
+
+
+def test_parse_line_time():
+    assert parse_line_time(b'2022-05-10T12:00:00.500000Z  INFO x',
+                           1970) == START + 0.5
+    assert parse_line_time(b'\x1b[2mMay 10 12:00:00.250\x1b[0m INFO',
+                           2022) == START + 0.25
+    assert parse_line_time(b'   0: neard::main', 2022) is None
+
+
+def test_parse_time():
+    assert parse_time('2022-05-10T12:00:00') == START
+    assert parse_time('2022-05-10 12:00') == START
+    assert parse_time('2h', now=START) == START - 7200
+    with pytest.raises(ValueError):
+        parse_time('yesterday')
+
+
+@pytest.mark.parametrize('query', [
+    LogQuery(pattern=re.compile(rb'block 12\d\b')),
+    LogQuery(since=START + 1000, until=START + 1500),
+    LogQuery(since=START + 3000.5),
+    LogQuery(height=1234),
+    LogQuery(pattern=re.compile(rb'neard::main'), until=START + 2000),
+])
+def test_search_matches_full_scan(tmp_path, query):
+    logname = str(tmp_path / 'testnet.log')
+    make_log(f'{logname}.1', 0, 1000)
+    with open(f'{logname}.1', 'rb') as src, gzip.open(f'{logname}.1.gz',
+                                                      'wb') as dst:
+        dst.write(src.read())
+    os.remove(f'{logname}.1')
+    make_log(f'{logname}.2', 1000, 2500)
+    make_log(logname, 2500, 4000)
+    paths = [f'{logname}.1.gz', f'{logname}.2', logname]
+
+    expected = brute_force(paths, query)
+    assert expected
+    for _ in range(2):
+        index = LogIndex(logname, stride=4096)
+        assert list(index.search(query)) == expected
+        index.save()
+
+
+def test_index_is_extended_incrementally(tmp_path):
+    logname = str(tmp_path / 'testnet.log')
+    make_log(logname, 0, 2000)
+    index = LogIndex(logname, stride=4096)
+    query = LogQuery(since=START + 2500, until=START + 2600)
+    assert list(index.search(query)) == []
+    index.save()
+    checkpoints = len(index._segments['testnet.log']['checkpoints'])
+
+    make_log(logname, 2000, 4000)
+    index = LogIndex(logname, stride=4096)
+    assert list(index.search(query)) == brute_force([logname], query)
+    assert len(index._segments['testnet.log']['checkpoints']) > checkpoints
+
+
+def test_search_logs_prefixes_lines(tmp_path):
+    make_log(tmp_path / 'node0.log', 0, 100)
+    make_log(tmp_path / 'node1.log', 0, 100)
+    output = io.StringIO()
+    search_logs([('node0', str(tmp_path / 'node0.log')),
+                 ('node1', str(tmp_path / 'node1.log'))],
+                LogQuery(height=1005),
+                output=output)
+    lines = output.getvalue().splitlines()
+    assert len(lines) == 20
+    assert lines[0].startswith('node0 | ') and lines[-1].startswith('node1 | ')
@@ -1,9 +1,88 @@
-from nearuplib.tailer import next_logname
+import gzip
+import subprocess
+
+from nearuplib.logrotate import (RotatingLogWriter, prune_segments,
+                                 start_log_rotator)
+from nearuplib.tailer import log_segments, next_logname
 
 
 def test_next_logname():
     assert next_logname(
-        'test-data/incrementlog.log') == 'test-data/incrementlog.log.2'
+        'test-data/incrementlog.log') == 'test-data/incrementlog.log.3'
     assert next_logname('test-data/justlog.log') == 'test-data/justlog.log.1'
     assert next_logname(
         'test-data/nonexistinglog.log') == 'test-data/nonexistinglog.log'
+
+
+def read_segment(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as segment_fd:
+        return segment_fd.read()
+
+
+def test_rotating_log_writer_rotates_by_size(tmp_path):
+    logname = str(tmp_path / 'testnet.log')
+    with open(logname, 'w') as log_fd:
+        log_fd.write('previous run\n')
+
+    writer = RotatingLogWriter(logname,
+                               max_bytes=100,
+                               max_age=3600,
+                               retention_bytes=10**6,
+                               compression='gzip')
+    lines = [f'line {i:04}\n'.encode() for i in range(50)]
+    for i in range(0, 50, 3):
+        writer.write(b''.join(lines[i:i + 3]))
+    writer.close()
+
+    segments = log_segments(logname)
+    assert [index for index, _ in segments] == list(range(1, len(segments) + 1))
+    assert all(path.endswith('.gz') for _, path in segments)
+    assert read_segment(segments[0][1]) == b'previous run\n'
+
+    written = b''.join(read_segment(path) for _, path in segments[1:])
+    with open(logname, 'rb') as log_fd:
+        written += log_fd.read()
+    assert written == b''.join(lines)
+    for _, path in segments[1:]:
+        assert read_segment(path).endswith(b'\n')
+
+
+def test_rotating_log_writer_rotates_by_age(tmp_path):
+    now = [0]
+    logname = str(tmp_path / 'testnet.log')
+    writer = RotatingLogWriter(logname,
+                               max_bytes=10**6,
+                               max_age=60,
+                               compression='none',
+                               clock=lambda: now[0])
+    writer.write(b'first\n')
+    now[0] = 61
+    writer.write(b'second\n')
+    writer.close()
+
+    assert [read_segment(path) for _, path in log_segments(logname)
+           ] == [b'first\n']
+
+
+def test_prune_segments(tmp_path):
+    logname = str(tmp_path / 'testnet.log')
+    for i in range(1, 6):
+        with open(f'{logname}.{i}.gz', 'wb') as segment_fd:
+            segment_fd.write(b'x' * 10)
+
+    removed = prune_segments(logname, retention_bytes=25)
+    assert removed == [f'{logname}.{i}.gz' for i in range(1, 4)]
+    assert [index for index, _ in log_segments(logname)] == [4, 5]
+
+
+def test_start_log_rotator(tmp_path):
+    logname = str(tmp_path / 'node0.log')
+    rotator = start_log_rotator(logname)
+    proc = subprocess.Popen(['echo', 'hello'], stdout=rotator.stdin)
+    rotator.stdin.close()
+    proc.wait()
+
+    assert rotator.wait(timeout=30) == 0
+    with open(logname) as log_fd:
+        assert log_fd.read() == 'hello\n'
@@ -1,4 +1,7 @@
+from nearuplib import util
+from nearuplib.exceptions import NetworkError
 from nearuplib.util import (
+    fetch_release_metadata,
     latest_deployed_release_branch,
     latest_deployed_release_commit,
     latest_deployed_release_commit_has_changed,
@@ -30,3 +33,23 @@ def test_latest_deployed_release_branch():
 
 def test_latest_genesis_md5sum():
     assert latest_genesis_md5sum('betanet')
+
+
+def test_fetch_release_metadata(monkeypatch):
+    objects = {
+        'nearcore-deploy/testnet/latest_deploy': 'abcdef\n',
+        'nearcore-deploy/testnet/latest_release': '1.26.0\n',
+        'nearcore-deploy/testnet/genesis_md5sum': 'aaaa\n',
+    }
+
+    def fake_read_from_s3(bucket, path):  # pylint: disable=W0613
+        if path not in objects:
+            raise NetworkError()
+        return objects[path]
+
+    monkeypatch.setattr(util, 'read_from_s3', fake_read_from_s3)
+
+    metadata = fetch_release_metadata('localnet')
+    assert metadata.commit == 'abcdef'
+    assert metadata.branch == '1.26.0'
+    assert metadata.genesis_md5sums == ('aaaa', None)
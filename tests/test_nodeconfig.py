@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from nearuplib.nodeconfig import (apply_overrides, discover_node_dirs,
+                                  parse_override, patch_node_configs)
+
+
+def test_parse_override():
+    assert parse_override('store.max_open_files=10000') == ([
+        'store', 'max_open_files'
+    ], 10000)
+    assert parse_override('tracked_shards=[0, 1]') == (['tracked_shards'],
+                                                       [0, 1])
+    assert parse_override('rpc.addr=0.0.0.0:3030') == (['rpc',
+                                                        'addr'], '0.0.0.0:3030')
+    with pytest.raises(ValueError):
+        parse_override('archive')
+
+
+def test_apply_overrides():
+    config = {'store': {'max_open_files': 512}, 'archive': False}
+    apply_overrides(config, [(['store', 'max_open_files'], 10000),
+                             (['log_config', 'opentelemetry'], 'info')])
+    assert config == {
+        'store': {
+            'max_open_files': 10000
+        },
+        'archive': False,
+        'log_config': {
+            'opentelemetry': 'info'
+        },
+    }
+
+
+def test_patch_node_configs(tmp_path):
+    for i in [0, 1, 2, 10]:
+        (tmp_path / f'node{i}').mkdir()
+        (tmp_path / f'node{i}' / 'config.json').write_text(
+            json.dumps({'rpc': {
+                'addr': '0.0.0.0:3030'
+            }}))
+    (tmp_path / 'nodes').mkdir()
+
+    node_dirs = discover_node_dirs(tmp_path)
+    assert [d.rsplit('/', 1)[-1] for d in node_dirs
+           ] == ['node0', 'node1', 'node2', 'node10']
+
+    patch_node_configs(node_dirs,
+                       lambda i: [(['rpc', 'addr'], f'0.0.0.0:{4000 + i}')])
+    for i, node_dir in enumerate(node_dirs):
+        with open(f'{node_dir}/config.json') as config:
+            assert json.load(config)['rpc']['addr'] == f'0.0.0.0:{4000 + i}'
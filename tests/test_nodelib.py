@@ -1,11 +1,17 @@
 import json
 import os
 import shutil
+import subprocess
+import time
 from pathlib import Path
 
+import psutil
 import pytest
 
-from nearuplib.nodelib import check_and_setup
+from nearuplib import nodelib
+from nearuplib.exceptions import NetworkError
+from nearuplib.instance import Instance
+from nearuplib.nodelib import NeardMonitor, check_and_setup, stop_native
 
 ACCOUNT_ID = 'mock.nearup.account'
 BETANET_HOME = os.path.expanduser('~/.near/betanet')
@@ -64,3 +70,118 @@ def test_check_and_setup_betanet_existing_config():
                         ACCOUNT_ID)
     except Exception as ex:
         pytest.fail(f'unexpected exception {ex}')
+
+
+def test_neard_monitor(tmp_path):
+    proc = subprocess.Popen(['sleep', '60'])
+    pid_file = tmp_path / 'node.pid'
+    pid_file.write_text(f'{proc.pid}|sleep|betanet\n')
+
+    monitor = NeardMonitor(str(pid_file))
+    try:
+        assert not monitor.is_zombie()
+        assert not monitor.wait_for_exit(0.1)
+
+        proc.kill()
+        started = time.monotonic()
+        assert monitor.wait_for_exit(10)
+        assert time.monotonic() - started < 5
+        assert monitor.is_zombie()
+
+        pid_file.unlink()
+        assert not monitor.is_zombie()
+    finally:
+        monitor.close()
+        proc.kill()
+        proc.wait()
+
+
+def test_stop_native_stops_all_processes_together(tmp_path):
+    # sleep ignoring SIGTERM, so it has to be killed after the timeout
+    stubborn = subprocess.Popen(
+        ['sh', '-c', 'trap "" TERM; while true; do sleep 0.1; done'])
+    procs = [subprocess.Popen(['sleep', '60']) for _ in range(3)] + [stubborn]
+    pid_file = tmp_path / 'node.pid'
+    pid_file.write_text(''.join(
+        f'{proc.pid}|{psutil.Process(proc.pid).name()}|localnet\n'
+        for proc in procs))
+
+    started = time.monotonic()
+    stop_native(timeout=1, pid_file=str(pid_file))
+    # killing the stubborn process fits in the same timeout
+    assert time.monotonic() - started < 1.5
+
+    assert not pid_file.exists()
+    for proc in procs:
+        assert proc.wait(timeout=5) is not None
+
+
+@pytest.mark.parametrize('survives', [False, True])
+def test_restart_stages_release_before_stopping(tmp_path, monkeypatch,
+                                                survives):
+    calls = []
+    instance = Instance(None, str(tmp_path / 'node.pid'), str(tmp_path))
+
+    def stop_nearup(**kwargs):  # pylint: disable=W0613
+        calls.append('stop')
+        if survives:
+            # stop_native puts back the PID file of processes it can't stop
+            (tmp_path / 'node.pid').write_text('1|neard|testnet')
+
+    class Staged:
+
+        def apply(self, home_dir):  # pylint: disable=W0613
+            calls.append('apply')
+
+        def cleanup(self):
+            calls.append('cleanup')
+
+    def stage(*args):  # pylint: disable=W0613
+        calls.append('stage')
+        return Staged()
+
+    monkeypatch.setattr(nodelib, 'download_binaries',
+                        lambda *args: calls.append('download'))
+    monkeypatch.setattr(nodelib, 'stage_genesis_update', stage)
+    monkeypatch.setattr(nodelib, 'stop_nearup', stop_nearup)
+    monkeypatch.setattr(nodelib, 'run',
+                        lambda *args, **kwargs: calls.append('run'))
+    monkeypatch.setattr(nodelib, 'BINARIES_FOLDER', str(tmp_path / 'near'))
+
+    def restart():
+        nodelib.restart_nearup('testnet',
+                               path=__file__,
+                               home_dir=str(tmp_path),
+                               restart_only_new_version=False,
+                               metadata=object(),
+                               instance=instance)
+
+    if survives:
+        # a second neard is not started on the home of the first one
+        with pytest.raises(SystemExit):
+            restart()
+        assert calls == ['download', 'stage', 'stop', 'cleanup']
+    else:
+        restart()
+        assert calls == ['download', 'stage', 'stop', 'apply', 'run', 'cleanup']
+
+
+def test_restart_neard_needs_no_metadata(tmp_path, monkeypatch):
+    calls = []
+    instance = Instance(None, str(tmp_path / 'node.pid'), str(tmp_path))
+    binary = tmp_path / 'near' / 'testnet' / 'neard'
+    binary.parent.mkdir(parents=True)
+    binary.write_text('')
+
+    def fetch(net):
+        raise NetworkError()
+
+    monkeypatch.setattr(nodelib, 'BINARIES_FOLDER', str(tmp_path / 'near'))
+    monkeypatch.setattr(nodelib, 'fetch_release_metadata', fetch)
+    monkeypatch.setattr(nodelib, 'stop_native',
+                        lambda pid_file: calls.append('stop'))
+    monkeypatch.setattr(nodelib, 'run',
+                        lambda home, path, **kwargs: calls.append(path))
+
+    nodelib.restart_neard('testnet', str(tmp_path), instance=instance)
+    assert calls == ['stop', str(binary.parent)]
@@ -0,0 +1,111 @@
+import asyncio
+import http.server
+import json
+import stat
+import threading
+import time
+
+from nearuplib import orchestrator as orchestrator_module
+from nearuplib.instance import Instance
+from nearuplib.localnet import Localnet
+from nearuplib.orchestrator import Orchestrator, watch_children_with_pidfds
+from nearuplib.ports import find_free_range
+from nearuplib.supervisor import RestartBackoff
+from tests.test_localnet import StatusHandler
+
+
+def write_neard(path):
+    # every node crashes on its first start and keeps running after that
+    neard = path / 'neard'
+    neard.write_text('#!/bin/sh\n'
+                     'echo "started $*"\n'
+                     'if [ ! -e "$2/crashed" ]; then\n'
+                     '  touch "$2/crashed"\n'
+                     '  exit 3\n'
+                     'fi\n'
+                     'exec sleep 60\n')
+    neard.chmod(neard.stat().st_mode | stat.S_IEXEC)
+    return str(neard)
+
+
+def test_orchestrator_restarts_nodes(tmp_path):
+    server = http.server.HTTPServer(('127.0.0.1', 0), StatusHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    node_dirs = []
+    for i in range(3):
+        (tmp_path / f'node{i}').mkdir()
+        node_dirs.append(str(tmp_path / f'node{i}'))
+    localnet = Localnet(
+        str(tmp_path),
+        Instance('test', str(tmp_path / 'node.pid'), str(tmp_path / 'logs')),
+        node_dirs, [server.server_port] + find_free_range(2, 40000),
+        [24567, 24568, 24569], 'ed25519:key')
+    orchestrator = Orchestrator(write_neard(tmp_path),
+                                localnet,
+                                backoff_factory=lambda: RestartBackoff(0.05),
+                                status_interval=0.05)
+
+    ready = []
+
+    async def stop_when_restarted():
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            if orchestrator.nodes[0].ready:
+                ready.append(0)
+            if ready and all(node.starts == 2 and node.proc is not None
+                             for node in orchestrator.nodes):
+                break
+        await asyncio.sleep(0.2)
+        ready.extend(
+            i for i, node in enumerate(orchestrator.nodes) if node.ready)
+        orchestrator.request_stop()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    watch_children_with_pidfds(loop)
+    try:
+        loop.run_until_complete(
+            asyncio.gather(orchestrator.run(), stop_when_restarted()))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+        server.shutdown()
+
+    assert set(ready) == {0}
+    status = json.loads((tmp_path / 'nearup_localnet_status.json').read_text())
+    assert status['num_nodes'] == 3
+    assert status['restarts'] == 3
+    assert [node['last_exit_code'] for node in status['nodes']] == [-15] * 3
+    assert [node['state'] for node in status['nodes']] == ['stopped'] * 3
+    for i in range(3):
+        log = (tmp_path / 'logs' / f'node{i}.log').read_text()
+        assert log.count(f'started --home {node_dirs[i]} run') == 2
+        assert '--boot-nodes' in log if i else '--boot-nodes' not in log
+
+
+def test_probe_tracks_readiness(tmp_path, monkeypatch):
+    localnet = Localnet(
+        str(tmp_path),
+        Instance('test', str(tmp_path / 'node.pid'), str(tmp_path / 'logs')),
+        [str(tmp_path / 'node0')], [3030], [24567], 'ed25519:key')
+    orchestrator = Orchestrator('neard', localnet)
+    [node] = orchestrator.nodes
+    node.proc = object()
+    answers = [True, False]
+
+    async def probe_status(port):
+        return answers.pop(0)
+
+    monkeypatch.setattr(orchestrator_module, 'probe_status', probe_status)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(orchestrator._probe(node))
+        assert (node.ready, node.state) == (True, 'ready')
+        # the node stopped answering, e.g. because it is stuck
+        loop.run_until_complete(orchestrator._probe(node))
+        assert (node.ready, node.state) == (False, 'running')
+    finally:
+        loop.close()
@@ -0,0 +1,43 @@
+import os
+import socket
+
+from nearuplib.constants import LOCALNET_HOME, NODE_PID_FILE
+from nearuplib.instance import localnet_instance
+from nearuplib.ports import allocate_ports, find_free_range
+
+
+def test_find_free_range_skips_busy_ports():
+    with socket.socket() as busy:
+        busy.bind(('0.0.0.0', 0))
+        busy_port = busy.getsockname()[1]
+
+        ports = find_free_range(3, busy_port - 1)
+        assert busy_port not in ports
+        assert ports == list(range(ports[0], ports[0] + 3))
+
+
+def test_allocate_ports_isolates_localnets(tmp_path):
+    registry = str(tmp_path / 'ports.json')
+    first_pid_file = tmp_path / 'first.pid'
+    first_pid_file.touch()
+
+    first = allocate_ports('first', str(first_pid_file), [(4, 33030)], registry)
+    second = allocate_ports('second', str(tmp_path / 'second.pid'),
+                            [(4, 33030)], registry)
+    assert not set(first[0]) & set(second[0])
+
+    # a stopped localnet releases its ports
+    first_pid_file.unlink()
+    third = allocate_ports('third', str(tmp_path / 'third.pid'), [(4, 33030)],
+                           registry)
+    assert not set(second[0]) & set(third[0])
+
+
+def test_localnet_instance():
+    assert localnet_instance(LOCALNET_HOME).pid_file == NODE_PID_FILE
+
+    other = localnet_instance(os.path.expanduser('~/.near/localnet2'))
+    assert other.name.startswith('localnet2-')
+    assert other.pid_file != NODE_PID_FILE
+    assert localnet_instance(
+        os.path.expanduser('~/.near/localnet2')).pid_file == other.pid_file
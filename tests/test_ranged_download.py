@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+from nearuplib import util
+from nearuplib.exceptions import NetworkError
+
+
+class FakeBody:
+
+    def __init__(self, data):
+        self.data = data
+
+    def iter_chunks(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start:start + chunk_size]
+
+
+class FakeS3Client:
+
+    def __init__(self, data, etag=None):
+        self.data = data
+        self.etag = etag or f'"{hashlib.md5(data).hexdigest()}"'
+        self.ranges = []
+
+    def head_object(self, **kwargs):  # pylint: disable=W0613
+        return {'ContentLength': len(self.data), 'ETag': self.etag}
+
+    def get_object(self, Range, IfMatch, **kwargs):  # pylint: disable=W0613,C0103
+        assert IfMatch == self.etag
+        start, end = Range[len('bytes='):].split('-')
+        self.ranges.append((int(start), int(end)))
+        return {'Body': FakeBody(self.data[int(start):int(end) + 1])}
+
+
+@pytest.fixture(name='fake_client')
+def fixture_fake_client(monkeypatch):
+    client = FakeS3Client(os.urandom(10 * 1024 + 17))
+    monkeypatch.setattr(util, 's3_client', lambda bucket: client)
+    return client
+
+
+def test_download_ranged(tmp_path, fake_client):
+    target = tmp_path / 'neard'
+    util.download_ranged_from_s3('bucket',
+                                 'neard',
+                                 str(target),
+                                 part_size=1024,
+                                 concurrency=4,
+                                 mode=0o755)
+
+    assert target.read_bytes() == fake_client.data
+    assert os.access(target, os.X_OK)
+    assert len(fake_client.ranges) == 11
+    assert not (tmp_path / 'neard.part').exists()
+    assert not (tmp_path / 'neard.part.json').exists()
+
+
+def test_download_ranged_resumes(tmp_path, fake_client):
+    target = tmp_path / 'neard'
+    partial = bytearray(len(fake_client.data))
+    partial[:2048] = fake_client.data[:2048]
+    (tmp_path / 'neard.part').write_bytes(bytes(partial))
+    (tmp_path / 'neard.part.json').write_text(
+        json.dumps({
+            'etag': fake_client.etag,
+            'size': len(fake_client.data),
+            'part_size': 1024,
+            'done': [0, 1],
+        }))
+
+    util.download_ranged_from_s3('bucket', 'neard', str(target), part_size=1024)
+
+    assert target.read_bytes() == fake_client.data
+    assert (0, 1023) not in fake_client.ranges
+    assert (1024, 2047) not in fake_client.ranges
+    assert len(fake_client.ranges) == 9
+
+
+def test_download_ranged_checksum_mismatch(tmp_path, fake_client):
+    target = tmp_path / 'neard'
+    with pytest.raises(NetworkError):
+        util.download_ranged_from_s3('bucket',
+                                     'neard',
+                                     str(target),
+                                     part_size=1024,
+                                     expected_md5='0' * 32)
+
+    assert not target.exists()
+    assert not (tmp_path / 'neard.part').exists()
@@ -0,0 +1,63 @@
+from botocore.exceptions import ClientError
+
+from nearuplib import util
+from nearuplib.util import reset_s3_clients, s3_client
+
+
+def setup_function(function):  # pylint: disable=W0613
+    reset_s3_clients()
+
+
+def test_s3_client_is_reused_per_bucket():
+    client = s3_client('build.nearprotocol.com')
+    assert s3_client('build.nearprotocol.com') is client
+    assert s3_client('build.openshards.io') is not client
+
+
+def test_s3_client_custom_endpoint():
+    client = s3_client('build.nearprotocol.com',
+                       endpoint_url='http://127.0.0.1:9000')
+    assert client.meta.endpoint_url == 'http://127.0.0.1:9000'
+    assert s3_client('build.nearprotocol.com') is not client
+
+
+class FakeBody:
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class ConditionalS3Client:
+
+    def __init__(self):
+        self.etag = '"v1"'
+        self.body = b'abcdef\n'
+        self.bodies_sent = 0
+
+    def get_object(self, IfNoneMatch=None, **kwargs):  # pylint: disable=W0613,C0103
+        if IfNoneMatch == self.etag:
+            raise ClientError(
+                {'Error': {
+                    'Code': '304',
+                    'Message': 'Not Modified'
+                }}, 'GetObject')
+        self.bodies_sent += 1
+        return {'ETag': self.etag, 'Body': FakeBody(self.body)}
+
+
+def test_read_from_s3_is_conditional(monkeypatch):
+    client = ConditionalS3Client()
+    monkeypatch.setattr(util, 's3_client', lambda bucket: client)
+    monkeypatch.setattr(util, '_S3_OBJECTS', {})
+
+    assert util.read_from_s3('bucket', 'latest_deploy') == 'abcdef\n'
+    assert util.read_from_s3('bucket', 'latest_deploy') == 'abcdef\n'
+    assert client.bodies_sent == 1
+
+    client.etag = '"v2"'
+    client.body = b'123456\n'
+    assert util.read_from_s3('bucket', 'latest_deploy') == '123456\n'
+    assert client.bodies_sent == 2
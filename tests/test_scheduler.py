@@ -0,0 +1,69 @@
+from nearuplib.scheduler import PollScheduler
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def make_scheduler(clock, rand=lambda: 0.5):
+    return PollScheduler(interval=60,
+                         jitter=0.2,
+                         max_backoff=600,
+                         fast_interval=10,
+                         fast_window=300,
+                         clock=clock,
+                         rand=rand)
+
+
+def test_jitter_stays_within_bounds():
+    clock = FakeClock()
+    assert make_scheduler(clock, rand=lambda: 0).next_delay() == 48
+    assert make_scheduler(clock, rand=lambda: 0.5).next_delay() == 60
+    assert make_scheduler(clock, rand=lambda: 1).next_delay() == 72
+
+
+def test_backoff_on_errors():
+    scheduler = make_scheduler(FakeClock())
+    delays = []
+    for _ in range(5):
+        scheduler.record_error()
+        delays.append(scheduler.next_delay())
+    assert delays == [120, 240, 480, 600, 600]
+
+    scheduler.record_success()
+    assert scheduler.next_delay() == 60
+
+    # a long outage doesn't overflow the backoff
+    scheduler.errors = 5000
+    assert scheduler.next_delay() == 600
+
+
+def test_fast_polling_after_release():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    scheduler.release_announced()
+    assert scheduler.next_delay() == 10
+
+    clock.now = 301
+    assert scheduler.next_delay() == 60
+
+
+def test_fast_window_starts_once_per_release():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    scheduler.release_announced('b')
+    clock.now = 200
+    # seen again on the next poll, the window is not extended
+    scheduler.release_announced('b')
+    clock.now = 301
+    assert scheduler.next_delay() == 60
+
+    scheduler.release_announced('c')
+    assert scheduler.next_delay() == 10
+    scheduler.release_applied()
+    assert scheduler.next_delay() == 60
@@ -0,0 +1,78 @@
+import errno
+import os
+
+import pytest
+
+from nearuplib import snapshot
+from nearuplib.snapshot import (TreeCopier, create_snapshot, list_snapshots,
+                                restore_snapshot)
+
+
+def make_localnet(home):
+    for i in range(2):
+        data = home / f'node{i}' / 'data'
+        data.mkdir(parents=True)
+        (home / f'node{i}' / 'config.json').write_text(f'{{"node": {i}}}')
+        (data / '000001.sst').write_bytes(b'sst' * 1000)
+        (data / 'MANIFEST-000002').write_bytes(b'manifest')
+        (data / 'CURRENT').symlink_to('MANIFEST-000002')
+    (home / 'nearup_localnet.json').write_text('{}')
+
+
+def no_reflinks(src, dst):
+    raise OSError(errno.EOPNOTSUPP, 'not supported', dst)
+
+
+def test_copy_tree_links_sst_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, '_reflink', no_reflinks)
+    make_localnet(tmp_path / 'home')
+
+    copier = TreeCopier(workers=4)
+    copier.copy_tree(str(tmp_path / 'home'),
+                     str(tmp_path / 'copy'),
+                     exclude={'nearup_localnet.json'})
+
+    src, dst = tmp_path / 'home' / 'node1', tmp_path / 'copy' / 'node1'
+    assert (dst / 'config.json').read_text() == '{"node": 1}'
+    assert os.path.samefile(src / 'data' / '000001.sst',
+                            dst / 'data' / '000001.sst')
+    assert not os.path.samefile(src / 'data' / 'MANIFEST-000002',
+                                dst / 'data' / 'MANIFEST-000002')
+    assert os.readlink(dst / 'data' / 'CURRENT') == 'MANIFEST-000002'
+    assert not (tmp_path / 'copy' / 'nearup_localnet.json').exists()
+    assert copier.counts == {'linked': 2, 'copied': 4}
+    assert not copier.reflink
+
+
+def test_snapshot_and_restore(tmp_path):
+    make_localnet(tmp_path / 'home')
+    snapshots = str(tmp_path / 'snapshots')
+
+    create_snapshot(str(tmp_path / 'home'),
+                    'height-100',
+                    snapshots_folder=snapshots)
+    with pytest.raises(SystemExit):
+        create_snapshot(str(tmp_path / 'home'),
+                        'height-100',
+                        snapshots_folder=snapshots)
+
+    [metadata] = list_snapshots(snapshots)
+    assert metadata['name'] == 'height-100'
+    assert metadata['num_nodes'] == 2
+
+    restore_snapshot('height-100',
+                     str(tmp_path / 'restored'),
+                     snapshots_folder=snapshots)
+    restored = tmp_path / 'restored'
+    assert (restored / 'node0' / 'data' /
+            '000001.sst').read_bytes() == (b'sst' * 1000)
+    assert not (restored / 'nearup_snapshot.json').exists()
+    assert not (restored / 'nearup_localnet.json').exists()
+
+
+def test_invalid_snapshot_names(tmp_path):
+    for name in ('../home', '.hidden', f'x{snapshot.trash.TRASH_SUFFIX}1', ''):
+        with pytest.raises(ValueError):
+            snapshot.snapshot_path(name, str(tmp_path))
+    with pytest.raises(SystemExit):
+        restore_snapshot('missing', str(tmp_path / 'home'), str(tmp_path))
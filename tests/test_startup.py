@@ -0,0 +1,45 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+NEARUP = os.path.join(os.path.dirname(__file__), '..', 'nearup')
+HEAVY_MODULES = {'boto3', 'botocore', 'psutil', 's3transfer'}
+# Generous, to stay reliable on slow CI machines: importing boto3 alone
+# takes longer than this.
+STARTUP_BUDGET_US = 150 * 1000
+
+IMPORT_TIME_RE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_times(args, home):
+    env = dict(os.environ, HOME=str(home))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', NEARUP] + args,
+                          env=env,
+                          stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE,
+                          universal_newlines=True,
+                          check=False)
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        if match:
+            times[match.group(4)] = (int(match.group(2)),
+                                     len(match.group(3)) == 1)
+    return times
+
+
+@pytest.mark.parametrize('args', [['version'], ['logs'], ['logs', '--help']])
+def test_startup_does_not_import_heavy_modules(tmp_path, args):
+    times = import_times(args, tmp_path)
+    assert 'nearuplib.constants' in times
+
+    imported = {name.split('.')[0] for name in times}
+    assert not imported & HEAVY_MODULES
+
+    nearup_time = sum(
+        cumulative for name, (cumulative, top_level) in times.items()
+        if top_level and (name == 'click' or name.startswith('nearuplib')))
+    assert nearup_time < STARTUP_BUDGET_US
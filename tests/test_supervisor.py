@@ -0,0 +1,161 @@
+import os
+import stat
+import threading
+import time
+
+from nearuplib import supervisor as supervisor_module
+from nearuplib.exceptions import NetworkError
+from nearuplib.scheduler import PollScheduler
+from nearuplib.supervisor import RestartBackoff, Supervisor
+from nearuplib.util import ReleaseMetadata
+
+
+def test_restart_backoff():
+    backoff = RestartBackoff(delay=1, max_delay=5, stable_period=60)
+    assert [backoff.next_delay(uptime=1) for _ in range(5)] == [1, 2, 4, 5, 5]
+    assert backoff.next_delay(uptime=61) == 1
+    assert backoff.next_delay(uptime=1) == 2
+
+
+def write_neard(path, body):
+    path.mkdir(exist_ok=True)
+    neard = path / 'neard'
+    neard.write_text(f'#!/bin/sh\necho started >> {path}/starts\n{body}\n')
+    neard.chmod(neard.stat().st_mode | stat.S_IEXEC)
+
+
+def make_supervisor(tmp_path):
+    return Supervisor('testnet',
+                      str(tmp_path / 'home'),
+                      str(tmp_path / 'bin'),
+                      official_binary=False,
+                      scheduler=PollScheduler(interval=3600),
+                      backoff=RestartBackoff(delay=0.05, max_delay=0.1),
+                      pid_file=str(tmp_path / 'node.pid'),
+                      logs_folder=str(tmp_path))
+
+
+def test_supervisor_restarts_crashed_node(tmp_path):
+    write_neard(tmp_path / 'bin', 'exit 3')
+    supervisor = make_supervisor(tmp_path)
+    supervisor._install_signal_handlers()
+    try:
+        supervisor.start_node()
+        deadline = time.monotonic() + 20
+        while supervisor.starts < 4 and time.monotonic() < deadline:
+            supervisor.poll_once(max_wait=1)
+    finally:
+        supervisor.stop_node()
+        supervisor._restore_signal_handlers()
+
+    assert supervisor.starts >= 4
+    assert supervisor.backoff.failures >= 3
+
+
+def test_supervisor_stops_node(tmp_path):
+    write_neard(tmp_path / 'bin', 'exec sleep 60')
+    supervisor = make_supervisor(tmp_path)
+    supervisor._install_signal_handlers()
+    try:
+        supervisor.start_node()
+        proc = supervisor.proc
+        assert os.path.exists(tmp_path / 'node.pid')
+
+        supervisor.request_stop()
+        supervisor.poll_once(max_wait=0)
+        assert supervisor.starts == 1
+
+        started = time.monotonic()
+        supervisor.stop_node(timeout=5)
+        assert time.monotonic() - started < 5
+        assert proc.returncode is not None
+        assert not os.path.exists(tmp_path / 'node.pid')
+    finally:
+        supervisor._restore_signal_handlers()
+
+
+class FailingStage:
+
+    def __init__(self):
+        self.cleaned_up = False
+
+    def apply(self, home_dir):
+        raise OSError(f'no space left in {home_dir}')
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+def test_supervisor_survives_failed_upgrade(tmp_path, monkeypatch):
+    write_neard(tmp_path / 'bin', 'exec sleep 60')
+    supervisor = make_supervisor(tmp_path)
+    stage = FailingStage()
+    stages = [SystemExit(1), stage]
+
+    def stage_release(*args):
+        result = stages.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        return str(tmp_path / 'bin'), result
+
+    monkeypatch.setattr(
+        supervisor_module, 'fetch_release_metadata',
+        lambda net: ReleaseMetadata(net, 'new', 'master', 'g', None))
+    monkeypatch.setattr(supervisor_module, 'new_release_ready',
+                        lambda *args: True)
+    monkeypatch.setattr(supervisor_module, 'stage_release', stage_release)
+
+    supervisor._install_signal_handlers()
+    try:
+        supervisor.start_node()
+        proc = supervisor.proc
+
+        # staging failed, the running node is left alone
+        supervisor._check_release()
+        assert supervisor.proc is proc and proc.poll() is None
+        assert supervisor.scheduler.errors == 1
+
+        # applying failed after the node was stopped, it is started again
+        supervisor._check_release()
+        assert stage.cleaned_up
+        assert supervisor.scheduler.errors == 2
+        supervisor.poll_once(max_wait=0)
+        assert supervisor.starts == 2
+        assert supervisor.proc.poll() is None
+    finally:
+        supervisor.stop_node()
+        supervisor._restore_signal_handlers()
+
+
+def test_supervisor_survives_failed_release_fetch(tmp_path, monkeypatch):
+    write_neard(tmp_path / 'bin', 'exec sleep 60')
+    fetches = []
+
+    def fetch(net):
+        fetches.append(net)
+        raise NetworkError()
+
+    monkeypatch.setattr(supervisor_module, 'fetch_release_metadata', fetch)
+    monkeypatch.setattr(supervisor_module, 'read_genesis_md5sum', lambda home:
+                        ('g', None))
+    supervisor = Supervisor('testnet',
+                            str(tmp_path / 'home'),
+                            str(tmp_path / 'bin'),
+                            scheduler=PollScheduler(interval=0.05,
+                                                    jitter=0,
+                                                    max_backoff=0.1),
+                            pid_file=str(tmp_path / 'node.pid'),
+                            logs_folder=str(tmp_path),
+                            metadata=ReleaseMetadata('testnet', 'a', 'master',
+                                                     'g', None))
+    timer = threading.Timer(1, supervisor.request_stop)
+    timer.start()
+    try:
+        supervisor.run()
+    finally:
+        timer.cancel()
+
+    # neard kept running while the release could not be fetched
+    assert supervisor.starts == 1
+    assert fetches and supervisor.scheduler.errors == len(fetches)
+    assert supervisor._commit == 'a'
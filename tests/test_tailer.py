@@ -0,0 +1,74 @@
+import io
+import os
+
+import pytest
+
+from nearuplib.tailer import (LogFollower, change_waiter, follow_lines,
+                              localnet_logs, print_logs, tail_lines)
+
+
+def write_lines(path, lines, mode='a'):
+    with open(path, mode) as log_fd:
+        log_fd.writelines(f'{line}\n' for line in lines)
+
+
+@pytest.mark.parametrize('block_size', [1, 5, 4096])
+def test_tail_lines(tmp_path, block_size):
+    path = tmp_path / 'testnet.log'
+    lines = [f'line {i}' for i in range(100)]
+    write_lines(path, lines, 'w')
+
+    assert tail_lines(path, 10, block_size) == lines[-10:]
+    assert tail_lines(path, 1000, block_size) == lines
+    assert tail_lines(path, 0, block_size) == []
+
+    with open(path, 'a') as log_fd:
+        log_fd.write('partial')
+    assert tail_lines(path, 2, block_size) == ['line 99', 'partial']
+
+
+def test_log_follower_handles_rotation_and_truncation(tmp_path):
+    path = tmp_path / 'testnet.log'
+    write_lines(path, ['old'], 'w')
+    follower = LogFollower(str(path))
+    assert follower.tail(5) == ['old']
+    assert follower.read_lines() == []
+
+    write_lines(path, ['one'])
+    with open(path, 'a') as log_fd:
+        log_fd.write('tw')
+    assert follower.read_lines() == ['one']
+
+    with open(path, 'a') as log_fd:
+        log_fd.write('o\n')
+    os.rename(path, f'{path}.1')
+    write_lines(path, ['three'], 'w')
+    assert follower.read_lines() == ['two', 'three']
+
+    with open(path, 'r+') as log_fd:
+        log_fd.truncate(0)
+    write_lines(path, ['four'])
+    assert follower.read_lines() == ['four']
+    follower.close()
+
+
+def test_follow_localnet_logs(tmp_path):
+    for i in [10, 2, 0]:
+        write_lines(tmp_path / f'node{i}.log', [f'start {i}'], 'w')
+    write_lines(tmp_path / 'node0.log.1', ['rotated'], 'w')
+
+    sources = localnet_logs(str(tmp_path))
+    assert [prefix for prefix, _ in sources] == ['node0', 'node2', 'node10']
+
+    output = io.StringIO()
+    print_logs(sources, 1, follow=False, output=output)
+    assert output.getvalue().splitlines() == [
+        'node0 | start 0', 'node2 | start 2', 'node10 | start 10'
+    ]
+
+    followers = [LogFollower(path, prefix) for prefix, path in sources]
+    waiter = change_waiter([path for _, path in sources])
+    lines = follow_lines(followers, waiter, timeout=0.1)
+    write_lines(tmp_path / 'node2.log', ['block 1'])
+    assert next(lines) == ('node2', 'block 1')
+    waiter.close()
@@ -0,0 +1,73 @@
+import os
+
+from nearuplib import trash as trash_module
+from nearuplib.trash import (delete_in_background, find_trash, move_to_trash,
+                             remove_tree)
+
+
+def make_tree(root):
+    for i in range(3):
+        directory = root / f'dir{i}' / 'nested'
+        directory.mkdir(parents=True)
+        for j in range(20):
+            (directory / f'{j:06}.sst').write_bytes(b'x' * 100)
+    (root / 'CURRENT').write_text('MANIFEST-000001')
+
+
+def test_move_to_trash(tmp_path):
+    data = tmp_path / 'data'
+    make_tree(data)
+
+    trash = move_to_trash(str(data))
+    assert not data.exists()
+    assert os.path.exists(os.path.join(trash, 'CURRENT'))
+    assert find_trash(str(tmp_path)) == [trash]
+    assert move_to_trash(str(data)) is None
+
+
+def test_remove_tree_does_not_follow_symlinks(tmp_path):
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    (outside / 'keep').write_text('keep')
+    data = tmp_path / 'data'
+    make_tree(data)
+    os.symlink(outside, data / 'link')
+
+    remove_tree(str(data), workers=4)
+    assert not data.exists()
+    assert (outside / 'keep').exists()
+
+
+def test_delete_in_background(tmp_path):
+    data = tmp_path / 'data'
+    make_tree(data)
+
+    proc = delete_in_background([move_to_trash(str(data))])
+    assert proc.wait(timeout=30) == 0
+    assert find_trash(str(tmp_path)) == []
+
+
+def test_trash_deleted_by_one_process(tmp_path, monkeypatch):
+    data = tmp_path / 'data'
+    make_tree(data)
+    trash = move_to_trash(str(data))
+
+    # another deleter is working on it
+    fd = trash_module._lock(trash)  # pylint: disable=W0212
+    trash_module.main([trash])
+    assert os.path.exists(os.path.join(trash, 'CURRENT'))
+    os.close(fd)
+
+    # a file appearing while the tree is deleted doesn't fail the deletion
+    unlink = trash_module._unlink  # pylint: disable=W0212
+
+    def unlink_and_write(path):
+        unlink(path)
+        if path.endswith('CURRENT'):
+            (tmp_path / 'late').write_text('late')
+            os.rename(tmp_path / 'late', path)
+
+    monkeypatch.setattr(trash_module, '_unlink', unlink_and_write)
+    trash_module.main([trash])
+    assert find_trash(str(tmp_path)) == [trash]
+    assert os.listdir(trash) == ['CURRENT']